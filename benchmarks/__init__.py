@@ -0,0 +1,68 @@
+"""
+Benchmarks for django-separated.  They run against the testproject models in
+an in-memory SQLite database, so run them from the root of the repository::
+
+    $ python -m benchmarks.row_extraction
+    $ python -m benchmarks.row_writing
+    $ python -m benchmarks.suite
+"""
+import os
+import timeit
+
+
+def setup():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+    import django
+    django.setup()
+
+    from django.db import connection
+    from testproject.testproject.models import Car, Manufacturer
+
+    with connection.schema_editor() as editor:
+        editor.create_model(Manufacturer)
+        editor.create_model(Car)
+
+
+def reset():
+    """
+    Drops and recreates the tables, which is much faster than deleting a
+    million rows.
+    """
+    from django.db import connection
+    from testproject.testproject.models import Car, Manufacturer
+
+    with connection.schema_editor() as editor:
+        editor.delete_model(Car)
+        editor.delete_model(Manufacturer)
+        editor.create_model(Manufacturer)
+        editor.create_model(Car)
+
+
+def create_cars(count, manufacturers=10):
+    from testproject.testproject.models import Car, Manufacturer
+
+    Manufacturer.objects.bulk_create(
+        Manufacturer(name='Manufacturer %d' % i) for i in range(manufacturers)
+    )
+    pks = list(Manufacturer.objects.values_list('pk', flat=True))
+    body_styles = [value for value, label in Car.BODY_STYLE_CHOICES]
+    # bulk_create makes a list out of the objects, so a million cars are
+    # created a batch at a time.
+    for start in range(0, count, 50000):
+        Car.objects.bulk_create(
+            Car(
+                name='Car %d' % i,
+                manufacturer_id=pks[i % len(pks)],
+                is_electric=i % 3 == 0,
+                body_style=body_styles[i % len(body_styles)],
+            )
+            for i in range(start, min(start + 50000, count))
+        )
+
+
+def best_of(function, repeat=5):
+    """
+    Returns the fastest time in seconds of repeat runs of function.
+    """
+    return min(timeit.repeat(function, number=1, repeat=repeat))
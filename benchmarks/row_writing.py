@@ -0,0 +1,68 @@
+"""
+Compares writing an export with one writerow call per row, which is what
+ColumnSerializer used to do, with ColumnSerializer.write, which encodes the
+rows in batches and writes them in big chunks.  The file counts the writes
+that it gets, each of which would be a system call (or a separate chunk of an
+HttpResponse).
+"""
+from __future__ import print_function
+
+import sys
+
+import unicodecsv as csv
+
+from . import best_of, setup
+
+
+ROWS = 1000000
+
+
+class CountingFile(object):
+    def __init__(self):
+        self.writes = 0
+        self.size = 0
+
+    def write(self, data):
+        self.writes += 1
+        self.size += len(data)
+
+
+def get_rows(count):
+    for i in range(count):
+        yield [i, 'Car %d' % i, 'Manufacturer %d' % (i % 10), '2016-04-15', 'True']
+
+
+def write_per_row(rows, file):
+    writer = csv.writer(file)
+    for row in rows:
+        writer.writerow(row)
+
+
+def main():
+    setup()
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else ROWS
+
+    from separated.utils import ColumnSerializer
+
+    serializer = ColumnSerializer([], output_headers=False)
+
+    files = {}
+
+    def run(name, write):
+        def function():
+            files[name] = CountingFile()
+            write(get_rows(rows), files[name])
+        return best_of(function, repeat=3)
+
+    per_row = run('per_row', write_per_row)
+    batched = run('batched', serializer.write)
+    assert files['per_row'].size == files['batched'].size
+
+    print('%d rows, %d bytes' % (rows, files['batched'].size))
+    print('writerow:  %8.0f rows/s, %8d writes' % (rows / per_row, files['per_row'].writes))
+    print('batched:   %8.0f rows/s, %8d writes' % (rows / batched, files['batched'].writes))
+    print('speedup:   %8.2fx' % (per_row / batched))
+
+
+if __name__ == '__main__':
+    main()
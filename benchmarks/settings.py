@@ -0,0 +1,10 @@
+from testproject.testproject.settings import *  # NOQA
+
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    }
+}
+DEBUG = False
@@ -0,0 +1,334 @@
+"""
+The benchmark suite.  Exports generated datasets of cars through
+ColumnSerializer, CsvView and the CsvExportModelAdmin action, and reports
+the rows per second, the peak memory and the number of queries for every
+scenario::
+
+    $ python -m benchmarks.suite
+    $ python -m benchmarks.suite --sizes 1000,10000,100000,1000000
+    $ python -m benchmarks.suite --scenarios attributes,fk_path --repeat 5
+
+To catch regressions between commits, save the results on one commit and
+compare against them on the other::
+
+    $ git checkout master
+    $ python -m benchmarks.suite --save before.json
+    $ git checkout my-branch
+    $ python -m benchmarks.suite --compare before.json
+
+The comparison marks every scenario that got slower or used more memory by
+more than --threshold (20% by default, the timings are noisy), or that ran
+more queries, and exits with status 1 if there are any.  Peak memory is
+measured with tracemalloc, which needs Python 3.
+"""
+from __future__ import division, print_function
+
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import sys
+
+from . import best_of, create_cars, reset, setup
+from .row_writing import CountingFile
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+
+SIZES = (1000, 10000, 100000)
+
+THRESHOLD = 0.2
+
+
+class Scenario(object):
+    """
+    An export of the cars (or of the manufacturers, with model='manufacturer')
+    through path, one of 'serializer', 'view', 'streaming_view' or 'admin'.
+    The other keyword arguments are passed on to the ColumnSerializer or to
+    the view.
+    """
+    def __init__(self, name, columns, path='serializer', model='car', **kwargs):
+        self.name = name
+        self.columns = columns
+        self.path = path
+        self.model = model
+        self.kwargs = kwargs
+
+    def get_queryset(self):
+        from testproject.testproject.models import Car, Manufacturer
+
+        return {'car': Car, 'manufacturer': Manufacturer}[self.model].objects.all()
+
+    def prepare(self):
+        """
+        Returns a function that runs the export once, and returns the number
+        of bytes it produced.
+        """
+        return getattr(self, 'prepare_%s' % self.path)()
+
+    def prepare_serializer(self):
+        from separated.utils import ColumnSerializer
+
+        serializer = ColumnSerializer(self.columns, **self.kwargs)
+
+        def run():
+            file = CountingFile()
+            serializer(self.get_queryset(), file)
+            return file.size
+        return run
+
+    def prepare_view(self, streaming=False):
+        from django.test import RequestFactory
+        from separated.views import CsvView
+
+        request = RequestFactory().get('/')
+        view = CsvView.as_view(queryset=self.get_queryset(), columns=self.columns,
+                               streaming=streaming, **self.kwargs)
+
+        def run():
+            return get_size(view(request))
+        return run
+
+    def prepare_streaming_view(self):
+        return self.prepare_view(streaming=True)
+
+    def prepare_admin(self):
+        from django.contrib.admin import AdminSite
+        from django.test import RequestFactory
+        from separated.admin import CsvExportModelAdmin
+
+        queryset = self.get_queryset()
+        model_admin = type(str('BenchmarkAdmin'), (CsvExportModelAdmin,), dict(
+            csv_export_columns=self.columns,
+            **self.kwargs
+        ))(queryset.model, AdminSite())
+
+        def run():
+            request = RequestFactory().post('/')
+            return get_size(model_admin.export_csv_action(request, self.get_queryset()))
+        return run
+
+
+def get_size(response):
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+def get_scenarios():
+    from separated.utils import BooleanGetter, DisplayGetter
+
+    attributes = ['pk', 'name', 'updated_at']
+    return [
+        Scenario('attributes', attributes),
+        Scenario('attributes_no_header', attributes, output_headers=False),
+        Scenario('attributes_chunked', attributes, chunk_size=2000),
+        Scenario('fk_path', ['name', 'manufacturer.name', 'manufacturer.pk']),
+        Scenario('relation_count', ['name', 'car_set.count'], model='manufacturer'),
+        Scenario('getters', [
+            'name',
+            (BooleanGetter('is_electric'), 'Electric'),
+            DisplayGetter('body_style'),
+        ]),
+        Scenario('method', ['name', 'get_display_name']),
+        Scenario('related_method', ['name', 'manufacturer.get_absolute_url']),
+        Scenario('related_method_memoized', ['name', 'manufacturer.get_absolute_url'],
+                 memoize=True),
+        Scenario('related_slug', ['name', 'manufacturer.get_slug']),
+        Scenario('related_slug_memoized', ['name', 'manufacturer.get_slug'],
+                 memoize=['manufacturer.get_slug']),
+        Scenario('view', attributes + ['manufacturer.name'], path='view'),
+        Scenario('streaming_view', attributes + ['manufacturer.name'], path='streaming_view'),
+        Scenario('admin', attributes + ['manufacturer.name'], path='admin'),
+    ]
+
+
+def get_row_count(scenario):
+    return scenario.get_queryset().count()
+
+
+def measure(scenario, repeat):
+    """
+    Times the export, then runs it once more to measure the peak memory and
+    count the queries, which would slow down the timed runs.
+    """
+    from separated.metrics import QueryCounter
+
+    run = scenario.prepare()
+    run()  # Warm up the caches.
+    time = best_of(run, repeat=repeat)
+
+    counter = QueryCounter('default')
+    peak_memory = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+    counter.start()
+    try:
+        size = run()
+    finally:
+        counter.stop()
+        if tracemalloc is not None:
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    rows = get_row_count(scenario)
+    return {
+        'scenario': scenario.name,
+        'rows': rows,
+        'bytes': size,
+        'time': time,
+        'rows_per_second': rows / time if time else None,
+        'peak_memory': peak_memory,
+        'queries': counter.queries,
+    }
+
+
+def get_revision():
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'])
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('ascii').strip()
+
+
+def get_environment():
+    import django
+
+    return {
+        'revision': get_revision(),
+        'date': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+    }
+
+
+def run_suite(sizes, names=None, repeat=5):
+    scenarios = get_scenarios()
+    if names:
+        unknown = set(names) - set(scenario.name for scenario in scenarios)
+        if unknown:
+            raise ValueError('Unknown scenarios: %s' % ', '.join(sorted(unknown)))
+        scenarios = [scenario for scenario in scenarios if scenario.name in names]
+
+    for size in sizes:
+        reset()
+        create_cars(size, manufacturers=max(10, size // 10))
+        for scenario in scenarios:
+            result = measure(scenario, repeat)
+            result['size'] = size
+            yield result
+
+
+def format_memory(value):
+    if value is None:
+        return '-'
+    return '%.1f MB' % (value / (1024 * 1024))
+
+
+def format_change(new, old):
+    if new is None or not old:
+        return ''
+    return '%+.0f%%' % ((new - old) / old * 100)
+
+
+def get_key(result):
+    return result['size'], result['scenario']
+
+
+def get_regressions(result, baseline, threshold):
+    """
+    Returns a list of what got worse in result compared to baseline.
+    """
+    regressions = []
+    if baseline['rows_per_second'] and result['rows_per_second'] is not None:
+        if result['rows_per_second'] < baseline['rows_per_second'] * (1 - threshold):
+            regressions.append('slower')
+    if baseline['peak_memory'] and result['peak_memory'] is not None:
+        if result['peak_memory'] > baseline['peak_memory'] * (1 + threshold):
+            regressions.append('memory')
+    if result['queries'] > baseline['queries']:
+        regressions.append('queries')
+    return regressions
+
+
+def print_result(result, baseline=None, threshold=THRESHOLD):
+    line = '%8d  %-22s %8d rows %10.0f rows/s %10s %7d queries' % (
+        result['size'],
+        result['scenario'],
+        result['rows'],
+        result['rows_per_second'] or 0,
+        format_memory(result['peak_memory']),
+        result['queries'],
+    )
+    regressions = []
+    if baseline is not None:
+        regressions = get_regressions(result, baseline, threshold)
+        line += '  (%s rows/s, %s memory, %+d queries)%s' % (
+            format_change(result['rows_per_second'], baseline['rows_per_second']) or '?',
+            format_change(result['peak_memory'], baseline['peak_memory']) or '?',
+            result['queries'] - baseline['queries'],
+            '  REGRESSION: %s' % ', '.join(regressions) if regressions else '',
+        )
+    print(line)
+    sys.stdout.flush()
+    return regressions
+
+
+def parse_sizes(value):
+    return [int(size) for size in value.split(',')]
+
+
+def parse_names(value):
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=parse_sizes, default=list(SIZES),
+                        help='Comma separated numbers of cars (default: %(default)s).')
+    parser.add_argument('--scenarios', type=parse_names,
+                        help='Comma separated names of the scenarios to run (default: all).')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='How many times to time each export (default: %(default)s).')
+    parser.add_argument('--save', metavar='FILE', help='Write the results to FILE as JSON.')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='Compare the results with the ones saved in FILE.')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='How much slower a scenario may get before it counts as a '
+                             'regression (default: %(default)s).')
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            saved = json.load(f)
+        baseline = dict((get_key(result), result) for result in saved['results'])
+        print('Comparing with %s (revision %s)' % (
+            args.compare, saved['environment'].get('revision')))
+
+    setup()
+    environment = get_environment()
+    print('Python %(python)s, Django %(django)s, revision %(revision)s' % environment)
+
+    results = []
+    regressions = 0
+    for result in run_suite(args.sizes, args.scenarios, args.repeat):
+        results.append(result)
+        if print_result(result, baseline.get(get_key(result)), args.threshold):
+            regressions += 1
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'environment': environment, 'results': results}, f, indent=2)
+
+    if args.compare:
+        print('%d regressions' % regressions)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,3 +2,5 @@
 import pkg_resources
 
 __version__ = pkg_resources.get_distribution('django-separated').version
+
+default_app_config = 'separated.apps.SeparatedConfig'
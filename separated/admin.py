@@ -1,10 +1,34 @@
 from __future__ import unicode_literals
 
-from django.contrib import admin
+import csv
+
+from django import forms
+from django.conf.urls import url
+from django.contrib import admin, messages
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied, ValidationError
+from django.http import Http404, HttpResponseRedirect, JsonResponse
+from django.template.response import TemplateResponse
+from django.utils.html import format_html
 from django.utils.translation import ugettext_lazy as _
 
+from .importers import ColumnDeserializer
+from .jobs import ThreadPoolExportBackend
 from .views import CsvView
 
+try:
+    from django.urls import reverse
+except ImportError:  # Django < 1.10
+    from django.core.urlresolvers import reverse
+
+
+class CsvExportView(CsvView):
+    """
+    The view that CsvExportAdminMixin exports with by default.  It streams
+    the export and reads it chunk_size rows at a time.
+    """
+    streaming = True
+    chunk_size = 2000
+
 
 class CsvExportAdminMixin(object):
     """
@@ -13,9 +37,25 @@ class CsvExportAdminMixin(object):
     csv_export_columns corresponds to CsvView.columns.  For more control, you
     can override csv_export_view_class to get all of the flexibility that
     CsvView provides.
+
+    If csv_export_async is True, the export runs in the background with
+    csv_export_backend_class and the user gets a link to follow its progress.
+
+    The default view class streams exports and reads them 2000 rows at a
+    time, so selecting all of a big changelist doesn't load it into memory.
+    csv_export_streaming and csv_export_chunk_size override the view's
+    streaming and chunk_size, if they are set.  If csv_export_max_rows is
+    set, bigger selections are refused, or exported in the background if
+    csv_export_async_over_max_rows is True.
     """
     csv_export_columns = None
-    csv_export_view_class = CsvView
+    csv_export_view_class = CsvExportView
+    csv_export_async = False
+    csv_export_backend_class = ThreadPoolExportBackend
+    csv_export_streaming = None
+    csv_export_chunk_size = None
+    csv_export_max_rows = None
+    csv_export_async_over_max_rows = False
 
     def get_csv_export_columns(self, request):
         return self.csv_export_columns
@@ -23,17 +63,53 @@ class CsvExportAdminMixin(object):
     def get_csv_export_view_class(self, request):
         return self.csv_export_view_class
 
-    def export_csv_action(self, request, queryset):
+    def get_csv_export_async(self, request):
+        return self.csv_export_async
+
+    def get_csv_export_backend(self, request):
+        return self.csv_export_backend_class()
+
+    def get_csv_export_max_rows(self, request):
+        return self.csv_export_max_rows
+
+    def get_csv_export_initkwargs(self, request, queryset):
         initkwargs = {
             'queryset': queryset,
         }
 
+        # maybe they already set these on the view.
         columns = self.get_csv_export_columns(request)
-        # maybe they already set the columns on the view.
         if columns is not None:
             initkwargs['columns'] = columns
+        if self.csv_export_streaming is not None:
+            initkwargs['streaming'] = self.csv_export_streaming
+        if self.csv_export_chunk_size is not None:
+            initkwargs['chunk_size'] = self.csv_export_chunk_size
+        return initkwargs
 
+    def export_csv_action(self, request, queryset):
+        # When the user selects all of the rows, queryset is the filtered and
+        # ordered queryset of the changelist, so the primary keys are never
+        # loaded, and the export is read a chunk at a time.
+        initkwargs = self.get_csv_export_initkwargs(request, queryset)
         csv_view_class = self.get_csv_export_view_class(request)
+        run_async = self.get_csv_export_async(request)
+
+        max_rows = self.get_csv_export_max_rows(request)
+        if not run_async and max_rows is not None:
+            count = queryset.count()
+            if count > max_rows:
+                if not self.csv_export_async_over_max_rows:
+                    self.message_user(request, _(
+                        'Cannot export %(count)d rows, the limit is %(max_rows)d. '
+                        'Please select fewer rows.'
+                    ) % {'count': count, 'max_rows': max_rows}, messages.ERROR)
+                    return None
+                run_async = True
+
+        if run_async:
+            return self.start_csv_export_job(request, queryset, csv_view_class(**initkwargs))
+
         viewfn = csv_view_class.as_view(**initkwargs)
         # The base CsvView does not respond to POST requests, actions are only
         # ever POST requests.
@@ -41,6 +117,154 @@ class CsvExportAdminMixin(object):
         return viewfn(request)
     export_csv_action.short_description = _("Export to CSV")
 
+    def start_csv_export_job(self, request, queryset, view):
+        view.request = request
+        view.args = ()
+        view.kwargs = {}
+        model = queryset.model
+        job = self.get_csv_export_backend(request).submit(
+            queryset,
+            view.get_column_serializer(model),
+            view.get_filename(model),
+            user=request.user,
+        )
+        url = reverse('%s:%s' % (self.admin_site.name, self.get_csv_export_job_url_name()),
+                      args=[job.id])
+        self.message_user(request, format_html(
+            _('The export has been started. <a href="{0}">Check on its progress</a>.'),
+            url,
+        ))
+        # Back to the changelist.
+        return None
+
+    def get_csv_export_job_url_name(self):
+        opts = self.model._meta
+        return '%s_%s_export_csv_job' % (opts.app_label, opts.model_name)
+
+    def get_urls(self):
+        urls = super(CsvExportAdminMixin, self).get_urls()
+        return [
+            url(r'^export-csv/(?P<job_id>[0-9a-f]+)/$',
+                self.admin_site.admin_view(self.export_csv_job_view),
+                name=self.get_csv_export_job_url_name()),
+        ] + urls
+
+    def export_csv_job_view(self, request, job_id):
+        """
+        Reports the progress of a background export as JSON.  Once the job is
+        done, ?download redirects to the file.
+        """
+        backend = self.get_csv_export_backend(request)
+        job = backend.get_job(job_id)
+        if job is None or job.user_id != request.user.pk:
+            raise Http404
+        file_url = backend.get_url(job)
+        if file_url and 'download' in request.GET:
+            return HttpResponseRedirect(file_url)
+        return JsonResponse({
+            'id': job.id,
+            'status': job.status,
+            'rows': job.rows,
+            'total': job.total,
+            'error': job.error,
+            'url': file_url,
+        })
+
+
+class CsvImportForm(forms.Form):
+    file = forms.FileField(label=_('CSV file'))
+
+
+class CsvImportAdminMixin(object):
+    """
+    Adds an Import CSV page for ModelAdmins, with a link to it on the change
+    list.  The columns are csv_import_columns, or the export columns if the
+    ModelAdmin also uses CsvExportAdminMixin, so that an export can be edited
+    and imported again.  With csv_import_key_fields, rows that match an
+    existing object update it instead of creating a new one.  Rows that
+    don't validate are skipped and reported to the user.
+    """
+    change_list_template = 'separated/admin/change_list.html'
+    csv_import_template = 'separated/admin/import_csv.html'
+    csv_import_columns = None
+    csv_import_key_fields = None
+    csv_import_deserializer_class = ColumnDeserializer
+    csv_import_max_error_messages = 10
+
+    def get_csv_import_columns(self, request):
+        columns = self.csv_import_columns
+        if columns is None and hasattr(self, 'get_csv_export_columns'):
+            columns = self.get_csv_export_columns(request)
+        if columns is None:
+            raise ImproperlyConfigured('Please set csv_import_columns.')
+        return columns
+
+    def get_csv_import_deserializer(self, request):
+        return self.csv_import_deserializer_class(
+            self.get_csv_import_columns(request),
+            key_fields=self.csv_import_key_fields,
+            skip_errors=True,
+        )
+
+    def has_csv_import_permission(self, request):
+        if self.csv_import_key_fields and not self.has_change_permission(request):
+            return False
+        return self.has_add_permission(request)
+
+    def get_csv_import_url_name(self):
+        opts = self.model._meta
+        return '%s_%s_import_csv' % (opts.app_label, opts.model_name)
+
+    def get_urls(self):
+        urls = super(CsvImportAdminMixin, self).get_urls()
+        return [
+            url(r'^import-csv/$',
+                self.admin_site.admin_view(self.import_csv_view),
+                name=self.get_csv_import_url_name()),
+        ] + urls
+
+    def import_csv_view(self, request):
+        """
+        Shows the upload form, and imports the file that is posted to it.
+        """
+        if not self.has_csv_import_permission(request):
+            raise PermissionDenied
+        request.current_app = self.admin_site.name
+        opts = self.model._meta
+        form = CsvImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            deserialize = self.get_csv_import_deserializer(request)
+            try:
+                result = deserialize(form.cleaned_data['file'], self.model)
+            except ValidationError as e:
+                form.add_error('file', e)
+            except (csv.Error, UnicodeDecodeError) as e:
+                form.add_error('file', _('The file could not be read: %s') % e)
+            else:
+                self.message_user(request, _(
+                    'Imported %(rows)d rows: %(created)d created, %(updated)d updated, '
+                    '%(skipped)d skipped.'
+                ) % vars(result))
+                for line, message in result.errors[:self.csv_import_max_error_messages]:
+                    self.message_user(request, _('Line %(line)d: %(message)s') % {
+                        'line': line,
+                        'message': message,
+                    }, messages.WARNING)
+                return HttpResponseRedirect(reverse('%s:%s_%s_changelist' % (
+                    self.admin_site.name, opts.app_label, opts.model_name)))
+
+        context = dict(
+            self.admin_site.each_context(request),
+            opts=opts,
+            form=form,
+            title=_('Import %s') % opts.verbose_name_plural,
+        )
+        return TemplateResponse(request, self.csv_import_template, context)
+
 
 class CsvExportModelAdmin(CsvExportAdminMixin, admin.ModelAdmin):
     actions = ['export_csv_action']
+
+
+class CsvImportModelAdmin(CsvImportAdminMixin, admin.ModelAdmin):
+    pass
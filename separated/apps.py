@@ -0,0 +1,15 @@
+from django.apps import AppConfig
+
+
+class SeparatedConfig(AppConfig):
+    name = 'separated'
+    verbose_name = 'Separated'
+
+    def ready(self):
+        from .cache import connect_invalidation, get_export_cache_aliases
+
+        # Every process that saves models has to bump the versions of the
+        # cached exports, not just the ones that render exports.  Without
+        # any export caches, saving a model shouldn't touch the cache.
+        if get_export_cache_aliases():
+            connect_invalidation()
@@ -0,0 +1,279 @@
+"""
+Typed, column-oriented exports with Apache Arrow.
+
+ArrowSerializer takes the same columns as ColumnSerializer and reads the rows
+the same way, but instead of turning every value into text, it collects the
+values into typed Arrow record batches and writes them as Parquet or as an
+Arrow IPC file.  The Arrow type of each column comes from the model field it
+reads.  This needs the pyarrow package.
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models
+from django.utils import six
+from django.views.generic.list import BaseListView
+
+from .compression import compress_chunks
+from .utils import ColumnSerializer, force_text, identity
+from .views import CsvResponseMixin
+from .writers import ChunkSink, Writer
+
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+
+def typed(type_name, *args):
+    # pyarrow might not be installed when this module is imported, so the
+    # registry stores factories that look the type up when they are called.
+    def factory(serializer, field):
+        return getattr(pa, type_name)(*args), identity
+    return factory
+
+
+def null_safe_text(function):
+    # Unlike in a CSV, None is a null and not the string 'None'.
+    def convert(value):
+        if value is None:
+            return None
+        return function(value)
+    return convert
+
+
+def text_type(serializer, field):
+    return pa.string(), null_safe_text(six.text_type)
+
+
+def binary_type(serializer, field):
+    return pa.binary(), null_safe_text(bytes)
+
+
+def decimal_type(serializer, field):
+    return pa.decimal128(field.max_digits, field.decimal_places), identity
+
+
+def datetime_type(serializer, field):
+    return pa.timestamp('us', tz='UTC' if settings.USE_TZ else None), identity
+
+
+FIELD_TYPES = {
+    models.Field: text_type,
+    models.BinaryField: binary_type,
+    models.BooleanField: typed('bool_'),
+    models.NullBooleanField: typed('bool_'),
+    models.SmallIntegerField: typed('int16'),
+    models.PositiveSmallIntegerField: typed('int16'),
+    models.IntegerField: typed('int32'),
+    models.PositiveIntegerField: typed('int32'),
+    models.AutoField: typed('int32'),
+    models.BigIntegerField: typed('int64'),
+    models.FloatField: typed('float64'),
+    models.DecimalField: decimal_type,
+    models.DateField: typed('date32'),
+    models.DateTimeField: datetime_type,
+    models.TimeField: typed('time64', 'us'),
+}
+if hasattr(models, 'BigAutoField'):  # Django >= 1.10
+    FIELD_TYPES[models.BigAutoField] = typed('int64')
+
+
+class ArrowFormat(Writer):
+    """
+    ArrowSerializer writes the files itself, these writers only describe the
+    formats.
+    """
+    binary = True
+    concatenable = False
+    writes_rows = False
+
+    def write_rows(self, rows):
+        raise ImproperlyConfigured(
+            'The %s format can only be written by ArrowSerializer itself, not a row at a '
+            'time.' % self.extension)
+
+
+class ParquetFormat(ArrowFormat):
+    extension = 'parquet'
+    content_type = 'application/vnd.apache.parquet'
+
+
+class ArrowFileFormat(ArrowFormat):
+    extension = 'arrow'
+    content_type = 'application/vnd.apache.arrow.file'
+
+
+class ArrowSerializer(ColumnSerializer):
+    """
+    A ColumnSerializer that writes Parquet (format='parquet') or an Arrow IPC
+    file (format='arrow').  The rows are collected into record batches of
+    batch_size rows, so memory use doesn't grow with the size of the
+    queryset.  Columns that don't read a field directly (callables, methods,
+    normalizers) become string columns.
+    """
+    format = 'parquet'
+    parquet_compression = 'snappy'
+    batch_size = 64 * 1024
+    field_types = FIELD_TYPES
+    writers = {
+        'parquet': ParquetFormat,
+        'arrow': ArrowFileFormat,
+    }
+
+    def __init__(self, columns, **kwargs):
+        if pa is None:
+            raise ImproperlyConfigured('ArrowSerializer requires the pyarrow package.')
+        super(ArrowSerializer, self).__init__(columns, **kwargs)
+        self.parquet_compression = kwargs.get('parquet_compression', self.parquet_compression)
+        self.get_writer_class()
+
+    def __call__(self, queryset, file=None):
+        """
+        Writes the queryset to file, or returns the bytes if there is no file.
+        """
+        if self.compression:
+            # The whole file is compressed, on top of Parquet's own
+            # compression of the columns, so it goes through stream.
+            chunks = self.stream(queryset)
+            if file is None:
+                return b''.join(chunks)
+            for chunk in chunks:
+                file.write(chunk)
+            return
+        if file is None:
+            sink = pa.BufferOutputStream()
+            self.write_batches(queryset, sink)
+            return sink.getvalue().to_pybytes()
+        self.write_batches(queryset, pa.PythonFile(file, mode='w'))
+
+    def stream(self, queryset):
+        """
+        Yields the file a record batch at a time.  If compression is set, the
+        chunks are compressed as they go.
+        """
+        chunks = self._stream(queryset)
+        if self.compression:
+            chunks = compress_chunks(chunks, self.compression)
+        return chunks
+
+    def _stream(self, queryset):
+        sink = ChunkSink()
+        for _ in self.write_batches(queryset, pa.PythonFile(sink, mode='w'), lazy=True):
+            chunk = sink.pop()
+            if chunk:
+                yield chunk
+        yield sink.pop()
+
+    def write_batches(self, queryset, sink, lazy=False):
+        schema = self.get_schema(queryset)
+        writer = self.get_batch_writer(sink, schema)
+        batches = self.get_batches(queryset, schema)
+        if lazy:
+            return self._write_lazily(writer, batches)
+        try:
+            for batch in batches:
+                self.write_batch(writer, batch)
+        finally:
+            writer.close()
+
+    def _write_lazily(self, writer, batches):
+        try:
+            for batch in batches:
+                self.write_batch(writer, batch)
+                yield
+        finally:
+            writer.close()
+
+    def get_batch_writer(self, sink, schema):
+        if self.format == 'parquet':
+            return pq.ParquetWriter(sink, schema, compression=self.parquet_compression)
+        return pa.RecordBatchFileWriter(sink, schema)
+
+    def write_batch(self, writer, batch):
+        if self.format == 'parquet':
+            writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            writer.write_batch(batch)
+
+    def get_schema(self, queryset):
+        """
+        Returns the Arrow schema for the queryset, with a nullable column for
+        every column of the serializer, named after its header.
+        """
+        names = self.get_header_row()
+        if self.can_compile_row_getter(queryset):
+            fields = self.get_column_fields(queryset)
+        else:
+            # get_row turns everything into text.
+            fields = [None] * len(names)
+        return pa.schema([
+            pa.field(name, self.get_field_type(field)[0])
+            for name, field in zip(names, fields)
+        ])
+
+    def get_batches(self, queryset, schema):
+        """
+        Yields record batches of batch_size rows.
+        """
+        batch = []
+        for row in self.get_rows(queryset):
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                yield self.make_batch(batch, schema)
+                batch = []
+        if batch:
+            yield self.make_batch(batch, schema)
+
+    def make_batch(self, rows, schema):
+        arrays = [pa.array(list(column), type=schema.types[i])
+                  for i, column in enumerate(zip(*rows))]
+        return pa.RecordBatch.from_arrays(arrays, schema.names)
+
+    def get_header_row(self):
+        headers = super(ArrowSerializer, self).get_header_row()
+        # The columns need names even without headers.
+        return [header if self.output_headers else 'column_%d' % i
+                for i, header in enumerate(headers)]
+
+    def get_row(self, obj):
+        return [null_safe_text(force_text)(c[0](obj)) for c in self.normalized_columns]
+
+    def get_field_type(self, field):
+        """
+        Returns a 2-tuple of the Arrow type for the values of field and a
+        function that converts the values to something pyarrow accepts for
+        that type.
+        """
+        if field is None:
+            return pa.string(), null_safe_text(force_text)
+        for klass in type(field).__mro__:
+            if klass in self.field_types:
+                return self.field_types[klass](self, field)
+        return pa.string(), null_safe_text(force_text)
+
+    def get_formatter(self, field):
+        return self.get_field_type(field)[1]
+
+
+class ArrowResponseMixin(CsvResponseMixin):
+    """
+    A CsvResponseMixin that returns Parquet or an Arrow IPC file instead of
+    CSV, depending on format.
+    """
+    column_serializer_class = ArrowSerializer
+    format = 'parquet'
+
+
+class ParquetView(ArrowResponseMixin, BaseListView):
+    """
+    A ListView that returns Parquet.
+    """
+
+
+class ArrowView(ArrowResponseMixin, BaseListView):
+    """
+    A ListView that returns an Arrow IPC file.
+    """
+    format = 'arrow'
@@ -0,0 +1,164 @@
+"""
+Async exports, for async code like an ASGI application or a websocket
+consumer.
+
+AsyncColumnSerializer.astream is an async generator that yields an export
+chunk_size rows at a time.  Each chunk is fetched, turned into rows and
+encoded in a worker thread with asgiref's sync_to_async, and no thread is
+busy in between.  The next chunk is only read once the previous one has been
+consumed, so a slow client leaves a suspended coroutine behind instead of a
+blocked request thread.
+
+The chunks are read in a fixed number of worker threads (ExportThreads),
+not in Django's one thread for synchronous code, so concurrent exports don't
+queue up behind each other or behind the rest of the application.  Every
+export stays on one worker, whose database connection its cursor belongs to,
+and the exports that share a worker take turns a chunk at a time.  However
+many exports are running, there are never more threads, or database
+connections, than workers.  A worker's connections are closed as soon as it
+has no exports left.
+
+There is no async view: the Django versions that this package supports
+can't serve them.  This module needs Python 3.6 or later and asgiref 3.4 or
+later.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from timeit import default_timer
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+
+from .compression import compress_chunks
+from .utils import ColumnSerializer
+
+
+def next_chunk(chunks):
+    return next(chunks, None)
+
+
+class ExportThreads(object):
+    """
+    A fixed number of worker threads that async exports are spread over.  An
+    export is assigned the worker with the fewest exports when it starts, and
+    runs all of its chunks there.  The threads are started when the first
+    export needs them.
+    """
+    def __init__(self, size=4):
+        self.size = size
+        self.lock = threading.Lock()
+        self.executors = []
+        # The number of exports on each worker.
+        self.exports = []
+
+    def acquire(self):
+        """
+        Returns the index and the executor of the worker for a new export.
+        """
+        with self.lock:
+            if not self.executors:
+                self.executors = [ThreadPoolExecutor(max_workers=1) for _ in range(self.size)]
+                self.exports = [0] * self.size
+            index = self.exports.index(min(self.exports))
+            self.exports[index] += 1
+            return index, self.executors[index]
+
+    def release(self, index):
+        """
+        Takes an export off of a worker.  A worker that has no exports left
+        closes its database connections, before it runs anything for the
+        next export.
+        """
+        with self.lock:
+            self.exports[index] -= 1
+            if not self.exports[index]:
+                self.executors[index].submit(connections.close_all)
+
+
+class AsyncColumnSerializer(ColumnSerializer):
+    """
+    A ColumnSerializer that can also serialize from async code.  The rows are
+    always read in chunks (2000 at a time by default), since a queryset that
+    is read all at once would hold a thread for the whole query.  The chunks
+    are read in the threads of export_threads, which every instance of the
+    class shares.
+    """
+    chunk_size = 2000
+    export_threads = ExportThreads(4)
+
+    def iter_chunks(self, queryset):
+        """
+        Yields the export chunk_size rows at a time, after whatever the
+        writer puts before the rows.  This is the synchronous part of
+        astream, every chunk takes at most one query.
+        """
+        metrics = self.start_metrics(queryset)
+        try:
+            writer = self.get_writer()
+            chunk = writer.start(self.get_header_row() if self.output_headers else None)
+            if metrics is not None:
+                metrics.bytes += len(chunk)
+            yield chunk
+
+            rows = self.get_rows(queryset, metrics)
+            size = self.chunk_size or self.batch_size
+            while True:
+                batch = list(islice(rows, size))
+                if not batch:
+                    break
+                started = default_timer()
+                chunk = writer.write_rows(batch)
+                if metrics is not None:
+                    metrics.writing_time += default_timer() - started
+                    metrics.bytes += len(chunk)
+                yield chunk
+
+            chunk = writer.finish()
+            if metrics is not None:
+                metrics.bytes += len(chunk)
+            yield chunk
+        finally:
+            self.finish_metrics(metrics)
+
+    async def astream(self, queryset):
+        """
+        The async counterpart of stream.  Yields the export (compressed, if
+        compression is set) a chunk at a time.
+        """
+        chunks = self.iter_chunks(queryset)
+        if self.compression:
+            chunks = compress_chunks(chunks, self.compression)
+        # All of the chunks have to be read in the same thread, which the
+        # database connection (and any open cursor) belongs to.
+        index, executor = self.export_threads.acquire()
+        try:
+            read = sync_to_async(next_chunk, thread_sensitive=False, executor=executor)
+            try:
+                while True:
+                    chunk = await read(chunks)
+                    if chunk is None:
+                        break
+                    if chunk:
+                        yield chunk
+            finally:
+                # Runs the finally clause of iter_chunks if the client went
+                # away.
+                await sync_to_async(chunks.close, thread_sensitive=False,
+                                    executor=executor)()
+        finally:
+            self.export_threads.release(index)
+
+    async def aserialize(self, queryset):
+        """
+        The async counterpart of calling the serializer without a file.
+        Returns the whole export as a string (or bytes, if compression is
+        set or the format is binary).
+        """
+        chunks = []
+        async for chunk in self.astream(queryset):
+            chunks.append(chunk)
+        data = b''.join(chunks)
+        if self.compression or self.get_writer_class().binary:
+            return data
+        return data.decode('utf-8')
@@ -0,0 +1,204 @@
+"""
+Export bundles: several exports delivered together in one file.
+
+An ExportBundle takes a list of (name, queryset, columns) and writes every
+queryset with its own ColumnSerializer, either as a file in a ZIP archive
+(format='zip') or as a sheet in one Excel workbook (format='xlsx').  All of
+the querysets are read in a single transaction on a single database
+connection, so the files are consistent with each other: on PostgreSQL and
+MySQL the transaction is REPEATABLE READ, and every query sees the same
+snapshot of the data.
+"""
+import sys
+import zipfile
+from contextlib import contextmanager
+from io import BytesIO
+from itertools import islice
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, transaction
+from django.views.generic import View
+
+from .utils import ColumnSerializer
+from .views import StreamingCsvResponse
+from .writers import ChunkSink, XlsxWriter
+
+
+@contextmanager
+def snapshot(using):
+    """
+    Runs the block in a transaction in which every query sees the same data.
+    If a transaction is already open (with ATOMIC_REQUESTS, for example), it
+    is used as it is, since its isolation level can't be changed anymore.
+    """
+    connection = connections[using]
+    outermost = not connection.in_atomic_block
+    with transaction.atomic(using=using):
+        if outermost and connection.vendor in ('postgresql', 'mysql'):
+            # This has to come before any other query in the transaction.
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        yield
+
+
+class ExportBundle(object):
+    """
+    Writes several querysets into one ZIP of files or one workbook.  exports
+    is a list of (name, queryset, columns) tuples, where columns is either a
+    list of columns or a ColumnSerializer.  The other keyword arguments are
+    passed to serializer_class for every list of columns.
+    """
+    format = 'zip'
+    formats = {
+        'zip': ('zip', 'application/zip'),
+        'xlsx': (XlsxWriter.extension, XlsxWriter.content_type),
+    }
+    serializer_class = ColumnSerializer
+
+    def __init__(self, exports, **kwargs):
+        self.format = kwargs.pop('format', self.format)
+        self.serializer_class = kwargs.pop('serializer_class', self.serializer_class)
+        if self.format not in self.formats:
+            raise ImproperlyConfigured('Unknown bundle format: %r' % (self.format,))
+        self.exports = [self.normalize_export(export, kwargs) for export in exports]
+
+    def normalize_export(self, export, kwargs):
+        name, queryset, columns = export
+        if isinstance(columns, ColumnSerializer):
+            serializer = columns
+        else:
+            serializer = self.serializer_class(columns, **kwargs)
+        return name, queryset, serializer
+
+    @property
+    def extension(self):
+        return self.formats[self.format][0]
+
+    @property
+    def content_type(self):
+        return self.formats[self.format][1]
+
+    def get_db(self):
+        """
+        Returns the database that all of the querysets read from.
+        """
+        databases = set(queryset.db for name, queryset, serializer in self.exports)
+        if len(databases) > 1:
+            raise ImproperlyConfigured(
+                'The querysets of a bundle have to use the same database, not %s.'
+                % ', '.join(sorted(databases)))
+        return databases.pop() if databases else 'default'
+
+    def __call__(self, file=None):
+        """
+        Writes the bundle to file, or returns it as bytes if there is no
+        file.
+        """
+        output = BytesIO() if file is None else file
+        for chunk in self.stream():
+            output.write(chunk)
+        if file is None:
+            return output.getvalue()
+
+    def stream(self):
+        """
+        Returns a generator that yields the bundle as it is written.  The
+        transaction stays open until the generator is exhausted or closed.
+        """
+        using = self.get_db()
+        with snapshot(using):
+            for chunk in getattr(self, 'stream_%s' % self.format)():
+                if chunk:
+                    yield chunk
+
+    def get_filename(self, name, serializer):
+        return '%s.%s' % (name, serializer.get_writer_class().extension)
+
+    def iter_batches(self, queryset, serializer):
+        """
+        Yields the rows of queryset batch_size at a time, measured into the
+        serializer's metrics if it is instrumented.
+        """
+        metrics = serializer.start_metrics(queryset)
+        try:
+            chunk_size = serializer.chunk_size or serializer.stream_chunk_size
+            rows = serializer.get_rows(queryset, metrics, chunk_size=chunk_size)
+            while True:
+                batch = list(islice(rows, serializer.batch_size))
+                if not batch:
+                    break
+                yield batch
+        finally:
+            serializer.finish_metrics(metrics)
+
+    def stream_zip(self):
+        sink = ChunkSink()
+        archive = zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED)
+        for name, queryset, serializer in self.exports:
+            filename = self.get_filename(name, serializer)
+            if sys.version_info < (3, 6):
+                # Files can't be streamed into a zip file that can't seek.
+                data = BytesIO()
+                serializer(queryset, file=data)
+                archive.writestr(filename, data.getvalue())
+                yield sink.pop()
+                continue
+            if not serializer.get_writer_class().writes_rows:
+                # Formats like Parquet are written by the serializer itself.
+                with archive.open(filename, 'w', force_zip64=True) as member:
+                    for chunk in serializer.stream(queryset):
+                        member.write(chunk)
+                        yield sink.pop()
+                yield sink.pop()
+                continue
+            with archive.open(filename, 'w', force_zip64=True) as member:
+                writer = serializer.get_writer()
+                header_row = serializer.get_header_row() if serializer.output_headers else None
+                member.write(writer.start(header_row))
+                for batch in self.iter_batches(queryset, serializer):
+                    member.write(writer.write_rows(batch))
+                    yield sink.pop()
+                member.write(writer.finish())
+            yield sink.pop()
+        archive.close()
+        yield sink.pop()
+
+    def stream_xlsx(self):
+        # Every serializer's rows go into a sheet, whatever its own format.
+        writer = XlsxWriter(None)
+        yield writer.start_workbook([name for name, queryset, serializer in self.exports])
+        for number, (name, queryset, serializer) in enumerate(self.exports, 1):
+            header_row = serializer.get_header_row() if serializer.output_headers else None
+            yield writer.start_sheet(number, header_row)
+            for batch in self.iter_batches(queryset, serializer):
+                yield writer.write_rows(batch)
+            yield writer.finish_sheet()
+        yield writer.finish_workbook()
+
+
+class ExportBundleView(View):
+    """
+    A view that streams an ExportBundle.  exports is a list of (name,
+    queryset, columns) tuples, like ExportBundle takes.  The querysets are
+    re-evaluated for every request.
+    """
+    exports = None
+    format = 'zip'
+    bundle_class = ExportBundle
+    filename = 'export.{extension}'
+
+    def get(self, request, *args, **kwargs):
+        bundle = self.get_bundle()
+        return StreamingCsvResponse(
+            filename=self.filename.format(extension=bundle.extension),
+            content_type=bundle.content_type,
+            streaming_content=bundle.stream(),
+        )
+
+    def get_exports(self):
+        if self.exports is None:
+            raise ImproperlyConfigured('Please set the exports.')
+        return [(name, queryset.all(), columns) for name, queryset, columns in self.exports]
+
+    def get_bundle(self):
+        return self.bundle_class(self.get_exports(), format=self.format)
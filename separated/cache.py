@@ -0,0 +1,207 @@
+"""
+Helpers for caching rendered exports.
+
+Cached exports are keyed on a version number for every model that the export
+reads.  Saving or deleting an instance of one of those models bumps its
+version, which makes all of the cached exports that depend on it unreachable.
+The receivers that do that are connected when the separated app is ready, if
+the SEPARATED_EXPORT_CACHES setting names any caches, so that every process
+that saves models (workers, shell sessions, management commands) invalidates
+the exports, not just the ones that have rendered them.  Projects that don't
+cache exports don't pay for a cache round trip on every save.
+"""
+import hashlib
+import time
+import types
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.utils import six
+from django.utils.encoding import force_bytes
+
+from .utils import get_relations
+
+
+def get_version_key(model):
+    opts = model._meta
+    return 'separated-export-version:%s.%s' % (opts.app_label, opts.model_name)
+
+
+def new_version():
+    # Versions start at the current time, so that a version that was evicted
+    # from the cache doesn't start over at a number that was already used.
+    return int(time.time() * 1000)
+
+
+def get_versions(cache, models):
+    """
+    Returns the current version of each of the models.
+    """
+    keys = [get_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            versions[key] = new_version()
+            cache.add(key, versions[key], None)
+    return [versions[key] for key in keys]
+
+
+def invalidate_exports(model, cache_alias=None):
+    """
+    Makes every cached export that reads model stale, in the cache_alias
+    cache, or in every cache in SEPARATED_EXPORT_CACHES.
+    """
+    key = get_version_key(model)
+    for alias in get_export_cache_aliases() if cache_alias is None else (cache_alias,):
+        cache = caches[alias]
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, new_version(), None)
+
+
+def get_export_cache_aliases():
+    """
+    Returns the aliases of the caches that cached exports are kept in, from
+    the SEPARATED_EXPORT_CACHES setting.  There are none by default.
+    """
+    return tuple(getattr(settings, 'SEPARATED_EXPORT_CACHES', ()))
+
+
+def invalidate_changed_model(sender, **kwargs):
+    for cache_alias in get_export_cache_aliases():
+        cache = caches[cache_alias]
+        try:
+            cache.incr(get_version_key(sender))
+        except ValueError:
+            # No export has read the model since the version was evicted, the
+            # next one starts a new version anyway.
+            pass
+
+
+def connect_invalidation(model=None, cache_alias=None):
+    """
+    Invalidates the cached exports for model (or for every model, if model is
+    None) whenever one of its instances is saved or deleted.  Without a
+    cache_alias, the versions are bumped in every cache in
+    SEPARATED_EXPORT_CACHES.  Connecting more than once is harmless.
+    """
+    if cache_alias is None:
+        receiver = invalidate_changed_model
+    else:
+        def receiver(sender, **kwargs):
+            invalidate_exports(sender, cache_alias)
+
+    if model is None:
+        dispatch_uid = 'separated-export-version:%s' % (cache_alias or '*')
+    else:
+        dispatch_uid = '%s:%s' % (get_version_key(model), cache_alias or '*')
+    post_save.connect(receiver, sender=model, weak=False, dispatch_uid=dispatch_uid)
+    post_delete.connect(receiver, sender=model, weak=False, dispatch_uid=dispatch_uid)
+
+
+def get_path_models(model, path):
+    """
+    Returns the models that a dotted attribute path reads from, starting with
+    model itself.
+    """
+    models = [model]
+    for name in path.split('.'):
+        field = get_relations(models[-1]._meta).get(name)
+        if field is None or field.related_model is None:
+            break
+        models.append(field.related_model)
+    return models
+
+
+literal_types = six.integer_types + (
+    type(None), bool, float, complex, six.text_type, six.binary_type, type(Ellipsis))
+
+
+def describe_literal(value):
+    """
+    Returns a description of a constant like a number, a string or a dict of
+    them.  Raises ValueError for anything else.
+    """
+    if isinstance(value, literal_types):
+        return repr(value)
+    if isinstance(value, (tuple, list)):
+        return (type(value).__name__, [describe_literal(item) for item in value])
+    if isinstance(value, (set, frozenset)):
+        # Sets of strings are ordered differently in every process.
+        return (type(value).__name__, sorted(describe_literal(item) for item in value))
+    if isinstance(value, dict):
+        return ('dict', sorted(
+            (describe_literal(key), describe_literal(item)) for key, item in value.items()))
+    raise ValueError('%r can not be described.' % (value,))
+
+
+def describe_code(code):
+    """
+    Returns the line that a function starts on and a hash of its bytecode and
+    constants, which tell apart the lambdas of one module.
+    """
+    consts = [
+        describe_code(const) if isinstance(const, types.CodeType) else describe_literal(const)
+        for const in code.co_consts
+    ]
+    data = repr((code.co_code, code.co_names, consts))
+    return code.co_firstlineno, hashlib.sha1(force_bytes(data)).hexdigest()
+
+
+def get_name(value):
+    name = getattr(value, '__qualname__', None) or getattr(value, '__name__', None)
+    return '%s.%s' % (getattr(value, '__module__', None), name)
+
+
+def describe(value):
+    """
+    Returns a description of a column accessor or normalizer that stays the
+    same from one process to the next.  Getters are described by what they
+    wrap, and functions by their name, where their code is and what their
+    defaults and closures hold.  Raises ValueError for callables whose
+    behaviour can't be told from the outside, like callable objects, bound
+    methods or closures over those.
+    """
+    if value is None or isinstance(value, six.string_types):
+        return value
+    if isinstance(value, six.class_types):
+        return get_name(value)
+    if callable(value) and hasattr(value, 'accessor') and hasattr(value, 'normalizer'):
+        # A Getter.
+        return ('Getter', describe(value.accessor), describe(value.normalizer))
+    if isinstance(value, partial):
+        return (
+            'partial',
+            describe(value.func),
+            [describe(arg) for arg in value.args],
+            sorted((key, describe(arg)) for key, arg in (value.keywords or {}).items()),
+        )
+    if isinstance(value, types.FunctionType):
+        return (
+            get_name(value),
+            describe_code(value.__code__),
+            describe_literal(value.__defaults__ or ()),
+            describe_literal(getattr(value, '__kwdefaults__', None) or {}),
+            [describe(cell.cell_contents) for cell in value.__closure__ or ()],
+        )
+    if isinstance(value, types.MethodType):
+        owner = value.__self__
+        if owner is None or isinstance(owner, six.class_types):
+            # Unbound methods on Python 2, and class methods.
+            return (describe(owner), describe(value.__func__))
+        raise ValueError('The bound method %r can not be described.' % (value,))
+    if isinstance(value, types.BuiltinFunctionType):
+        owner = getattr(value, '__self__', None)
+        if owner is None or isinstance(owner, types.ModuleType):
+            return get_name(value)
+        # A method of a builtin object, like dict.get of a dict of strings.
+        return (value.__name__, describe(owner))
+    if isinstance(getattr(value, '__objclass__', None), six.class_types):
+        # An unbound method of a builtin type, like str.upper.
+        return (describe(value.__objclass__), value.__name__)
+    if callable(value):
+        raise ValueError('%r can not be described.' % (value,))
+    return describe_literal(value)
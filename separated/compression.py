@@ -0,0 +1,109 @@
+"""
+Incremental compression for CSV output.
+
+The CSV is compressed a piece at a time as the rows are written, so that
+neither a streamed response nor a file on disk ever has to be held in memory
+in full.  gzip is always available, zstd needs the zstandard package.
+"""
+import zlib
+
+from django.core.exceptions import ImproperlyConfigured
+
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# In order of preference, when the client accepts both equally.
+ENCODINGS = ('zstd', 'gzip')
+
+
+def get_available_encodings():
+    return tuple(encoding for encoding in ENCODINGS
+                 if encoding != 'zstd' or zstandard is not None)
+
+
+def get_compressor(encoding):
+    """
+    Returns an object with compress(data) and flush() methods that produces
+    the encoding.
+    """
+    if encoding == 'gzip':
+        # 16 + MAX_WBITS makes zlib write the gzip header and trailer.
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if encoding == 'zstd':
+        if zstandard is None:
+            raise ImproperlyConfigured('zstd compression requires the zstandard package.')
+        return zstandard.ZstdCompressor().compressobj()
+    raise ImproperlyConfigured('Unknown compression: %r' % (encoding,))
+
+
+def compress_chunks(chunks, encoding):
+    """
+    Compresses an iterator of byte strings, yielding compressed data as soon
+    as the compressor produces some.
+    """
+    compressor = get_compressor(encoding)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class CompressedFile(object):
+    """
+    A write-only wrapper around a file that compresses everything written to
+    it.  Call finish when you are done writing, it writes whatever the
+    compressor still has buffered, but doesn't close the file.
+    """
+    def __init__(self, file, encoding):
+        self.file = file
+        self.compressor = get_compressor(encoding)
+
+    def write(self, data):
+        data = self.compressor.compress(data)
+        if data:
+            self.file.write(data)
+
+    def finish(self):
+        self.file.write(self.compressor.flush())
+
+
+def parse_accept_encoding(header):
+    """
+    Returns a dictionary of the content codings in an Accept-Encoding header
+    and their quality values.
+    """
+    accepted = {}
+    for part in header.split(','):
+        name, _, params = part.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name] = quality
+    return accepted
+
+
+def negotiate_encoding(header, encodings):
+    """
+    Returns the encoding out of encodings that the Accept-Encoding header
+    prefers, or None if it doesn't accept any of them.
+    """
+    accepted = parse_accept_encoding(header or '')
+    best, best_quality = None, 0.0
+    for encoding in encodings:
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
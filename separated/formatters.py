@@ -0,0 +1,109 @@
+"""
+Formatters turn the values of model fields into text for the CSV.
+
+ColumnSerializer picks a formatter for every column that reads a model field
+when it builds its row getter, so that the type checks that force_text does on
+every cell only happen once per column.  The formatters are looked up in
+ColumnSerializer.field_formatters by the class of the field (walking up the
+MRO), which maps field classes to factories.  A factory is called with the
+serializer and the field and returns a function that takes a value and returns
+text.
+"""
+from django.conf import settings
+from django.db import models
+from django.utils import dateformat, numberformat, six
+
+
+try:
+    from django.utils.encoding import force_text
+except ImportError:  # Django < 1.4
+    from django.utils.encoding import force_unicode as force_text
+
+
+def null_safe(function):
+    """
+    Wraps a formatter so that None comes out the same way that force_text
+    would have written it.
+    """
+    def formatter(value):
+        if value is None:
+            return 'None'
+        return function(value)
+    return formatter
+
+
+def text_formatter(serializer, field):
+    # Values of most fields are already text, or they are things like ints,
+    # floats and UUIDs that six.text_type can handle without all of the checks
+    # that force_text does.
+    return six.text_type
+
+
+def force_text_formatter(serializer, field):
+    return force_text
+
+
+def boolean_formatter(serializer, field):
+    strings = {True: 'True', False: 'False', None: 'None'}
+
+    def format_boolean(value):
+        try:
+            return strings[value]
+        except KeyError:
+            return force_text(value)
+    return format_boolean
+
+
+def number_formatter(serializer, field):
+    if not serializer.localize:
+        return six.text_type
+
+    decimal_sep = serializer.get_l10n_format('DECIMAL_SEPARATOR')
+    thousand_sep = serializer.get_l10n_format('THOUSAND_SEPARATOR')
+    grouping = serializer.get_l10n_format('NUMBER_GROUPING')
+    force_grouping = settings.USE_THOUSAND_SEPARATOR
+
+    def format_number(value):
+        return numberformat.format(
+            value, decimal_sep,
+            grouping=grouping,
+            thousand_sep=thousand_sep,
+            force_grouping=force_grouping,
+        )
+    return null_safe(format_number)
+
+
+def date_formatter(serializer, field):
+    format_string = serializer.get_date_format('DATE_FORMAT')
+    if format_string is None:
+        return six.text_type
+    return null_safe(lambda value: dateformat.format(value, format_string))
+
+
+def datetime_formatter(serializer, field):
+    format_string = serializer.get_date_format('DATETIME_FORMAT')
+    if format_string is None:
+        return six.text_type
+    return null_safe(lambda value: dateformat.format(value, format_string))
+
+
+def time_formatter(serializer, field):
+    format_string = serializer.get_date_format('TIME_FORMAT')
+    if format_string is None:
+        return six.text_type
+    return null_safe(lambda value: dateformat.time_format(value, format_string))
+
+
+FIELD_FORMATTERS = {
+    models.Field: text_formatter,
+    models.BinaryField: force_text_formatter,
+    models.BooleanField: boolean_formatter,
+    models.NullBooleanField: boolean_formatter,
+    models.AutoField: number_formatter,
+    models.IntegerField: number_formatter,
+    models.FloatField: number_formatter,
+    models.DecimalField: number_formatter,
+    models.DateField: date_formatter,
+    models.DateTimeField: datetime_formatter,
+    models.TimeField: time_formatter,
+}
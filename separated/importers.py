@@ -0,0 +1,504 @@
+"""
+CSV imports, the inverse of ColumnSerializer.
+
+ColumnDeserializer takes the same columns as ColumnSerializer and reads back
+the files that it writes.  The file is read as a stream and the rows are
+validated and saved batch_size at a time, each batch in its own transaction,
+with bulk_create for new rows and a bulk update for rows that already exist
+(when key_fields says how to find them).  Columns that don't read a field
+(methods, counts and other computed values) are ignored.
+"""
+import csv as text_csv
+import re
+from collections import OrderedDict
+from itertools import chain, islice
+
+import unicodecsv as csv
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured, ValidationError
+from django.db import IntegrityError, connections, models, router, transaction
+from django.db.models import Q
+from django.utils import six
+from django.utils.encoding import force_text
+
+from .cache import invalidate_exports
+from .utils import ColumnSerializer, bool2string_map, get_relations
+
+
+display_re = re.compile(r'^get_(\w+)_display$')
+
+string2bool_map = dict((value, key) for key, value in bool2string_map.items())
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def bulk_update(queryset, objects, fields, batch_size=None):
+    """
+    Saves fields (a list of field names) of objects that are already in the
+    database, with one UPDATE per batch.  This is QuerySet.bulk_update on
+    Django 2.2 and later.  Older versions get the same query, written by
+    hand, because building it out of Case and When expressions takes longer
+    than running it.
+    """
+    if hasattr(queryset, 'bulk_update'):
+        return queryset.bulk_update(objects, fields, batch_size=batch_size)
+    if not objects or not fields:
+        return
+    opts = queryset.model._meta
+    pk = opts.pk
+    fields = [opts.get_field(name) for name in fields]
+    connection = connections[queryset.db]
+    quote = connection.ops.quote_name
+    # Every object needs its primary key and a value for each field, and its
+    # primary key again for the WHERE clause.
+    max_size = connection.ops.bulk_batch_size(['pk'] * (2 * len(fields) + 1), objects)
+    batch_size = min(batch_size, max_size) if batch_size else max_size
+    for batch in batches(objects, max(batch_size, 1)):
+        assignments = []
+        params = []
+        for field in fields:
+            placeholder = '%s'
+            if connection.vendor == 'postgresql':
+                # Otherwise, PostgreSQL takes the parameters to be text.
+                placeholder = 'CAST(%%s AS %s)' % field.db_type(connection)
+            assignments.append('%s = CASE %s %s END' % (
+                quote(field.column),
+                quote(pk.column),
+                ' '.join(['WHEN %s THEN ' + placeholder] * len(batch)),
+            ))
+            for obj in batch:
+                params.append(pk.get_db_prep_value(obj.pk, connection))
+                params.append(field.get_db_prep_save(getattr(obj, field.attname), connection))
+        params.extend(pk.get_db_prep_value(obj.pk, connection) for obj in batch)
+        sql = 'UPDATE %s SET %s WHERE %s IN (%s)' % (
+            quote(opts.db_table),
+            ', '.join(assignments),
+            quote(pk.column),
+            ', '.join(['%s'] * len(batch)),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+
+class ImportResult(object):
+    """
+    What an import did.  errors is a list of (line number, message) for the
+    rows that were skipped.
+    """
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.skipped = 0
+        self.errors = []
+
+
+class ImportColumn(object):
+    """
+    How to read one column into a model: the field whose attname gets the
+    value, and, for a column that reads a field of a related object (like
+    'manufacturer.name'), the field of the related model to look the object
+    up by.
+    """
+    def __init__(self, field, lookup_field=None, choices=None):
+        self.field = field
+        self.lookup_field = lookup_field
+        self.choices = choices
+
+    @property
+    def parse_field(self):
+        return self.lookup_field or self.field
+
+    def parse(self, value):
+        field = self.parse_field
+        if self.field.null and value in ('', 'None'):
+            # ColumnSerializer writes None as 'None'.
+            if self.lookup_field is not None or not field.empty_strings_allowed:
+                return None
+        if value == '' and field.primary_key:
+            # A new row.
+            return None
+        if isinstance(field, (models.BooleanField, models.NullBooleanField)):
+            value = string2bool_map.get(value, value)
+        if self.choices is not None:
+            value = self.choices.get(value, value)
+        if self.lookup_field is not None:
+            return field.to_python(value)
+        return field.clean(value, None)
+
+
+class ColumnDeserializer(object):
+    """
+    Reads CSV (or TSV, with format='tsv') that was written with the same
+    columns into model instances and saves them.  If output_headers is True,
+    the first row is the header and the columns are found by their headers,
+    in any order.  Otherwise, the columns have to be in order.
+
+    Without key_fields, every row is a new object.  With key_fields (a list
+    of field names that identify a row, like ['pk'] or ['name']), rows whose
+    key already exists update that object instead, unless update_existing is
+    False, in which case they are skipped.  Rows that don't validate raise a
+    ValidationError before their batch is saved, or are skipped and reported
+    in the ImportResult if skip_errors is True.  The same goes for new rows
+    that lack a column for a required field, and for a batch that the
+    database rejects (because of a unique constraint, for example), which is
+    rolled back as a whole.
+    """
+    serializer_class = ColumnSerializer
+    output_headers = True
+    format = 'csv'
+    encoding = 'utf-8-sig'
+    batch_size = 1000
+    key_fields = None
+    update_existing = True
+    skip_errors = False
+
+    def __init__(self, columns, **kwargs):
+        self.output_headers = kwargs.get('output_headers', self.output_headers)
+        self.format = kwargs.get('format', self.format)
+        self.encoding = kwargs.get('encoding', self.encoding)
+        self.batch_size = kwargs.get('batch_size', self.batch_size)
+        self.key_fields = kwargs.get('key_fields', self.key_fields)
+        self.update_existing = kwargs.get('update_existing', self.update_existing)
+        self.skip_errors = kwargs.get('skip_errors', self.skip_errors)
+        # The serializer knows how to normalize the columns and what their
+        # headers are.
+        self.serializer = self.serializer_class(
+            columns, output_headers=self.output_headers, format=self.format)
+        self.get_dialect()
+
+    def __call__(self, file, model, using=None):
+        """
+        Imports file (opened in binary or text mode) into model, and returns
+        an ImportResult.
+        """
+        if using is None:
+            using = router.db_for_write(model)
+        columns = self.get_import_columns(model)
+        result = ImportResult()
+        rows = self.read(file)
+        if self.output_headers:
+            header = next(rows, None)
+            if header is None:
+                return result
+            columns = self.match_header(columns, header[1])
+        missing = self.get_missing_fields(model, columns)
+        if missing and not self.key_fields:
+            # Every row is new, none of them could be saved.
+            raise ValidationError(self.format_missing_fields(missing))
+
+        # The primary keys of the related objects, by column and value.
+        related = {}
+        for batch in batches(rows, self.batch_size):
+            objects = self.build_objects(model, columns, batch, using, related, result)
+            self.save_batch(model, columns, objects, using, result, missing)
+        if result.created or result.updated:
+            # Bulk queries don't send post_save, which invalidates the cached
+            # exports.
+            invalidate_exports(model)
+        return result
+
+    def get_dialect(self):
+        dialect = getattr(self.serializer.get_writer_class(), 'dialect', None)
+        if dialect is None:
+            raise ImproperlyConfigured('Cannot import the %s format.' % self.format)
+        return dialect
+
+    def read(self, file):
+        """
+        Yields (line number, row) for every row in file.
+        """
+        lines = iter(file)
+        first = next(lines, None)
+        if first is None:
+            return
+        dialect = self.get_dialect()
+        if isinstance(first, six.text_type):
+            if first.startswith(u'\ufeff'):
+                first = first[1:]
+            lines = chain([first], lines)
+            if six.PY3:
+                reader = text_csv.reader(lines, dialect=dialect)
+            else:
+                lines = (line.encode('utf-8') for line in lines)
+                reader = csv.reader(lines, dialect=dialect, encoding='utf-8')
+        else:
+            lines = chain([first], lines)
+            reader = csv.reader(lines, dialect=dialect, encoding=self.encoding)
+        for row in reader:
+            if row:
+                yield reader.line_num, row
+
+    def get_import_columns(self, model):
+        """
+        Returns an ImportColumn, or None for a column that can't be imported,
+        for every column.
+        """
+        columns = []
+        for getter, header in self.serializer.normalized_columns:
+            path = getattr(getter, 'path', None)
+            columns.append(self.get_import_column(model, path) if path else None)
+        if not any(columns):
+            raise ImproperlyConfigured('None of the columns can be imported into %s.' % (
+                model._meta.object_name,))
+        return columns
+
+    def get_import_column(self, model, path):
+        opts = model._meta
+        names = path.split('.')
+        if len(names) == 1:
+            match = display_re.match(path)
+            if match:
+                field = self._get_field(opts, match.group(1))
+                if field is None or not field.choices:
+                    return None
+                choices = dict((force_text(label), value) for value, label in field.flatchoices)
+                return ImportColumn(field, choices=choices)
+            field = self._get_field(opts, path)
+            if field is None or field.is_relation:
+                return None
+            return ImportColumn(field)
+        if len(names) == 2:
+            field = get_relations(opts).get(names[0])
+            if field is None or not (field.concrete and (field.many_to_one or field.one_to_one)):
+                return None
+            lookup_field = self._get_field(field.related_model._meta, names[1])
+            if lookup_field is None or lookup_field.is_relation:
+                return None
+            return ImportColumn(field, lookup_field=lookup_field)
+        return None
+
+    def _get_field(self, opts, name):
+        if name == 'pk':
+            return opts.pk
+        try:
+            field = opts.get_field(name)
+        except FieldDoesNotExist:
+            return None
+        return field if field.concrete else None
+
+    def match_header(self, columns, header):
+        """
+        Reorders the columns to match the header row of the file.  Columns
+        that aren't in the file can't be imported.
+        """
+        positions = dict((force_text(name).strip(), i) for i, name in enumerate(header))
+        matched = [None] * len(header)
+        for column, header_value in zip(columns, self.serializer.get_header_row()):
+            if column is not None and header_value in positions:
+                matched[positions[header_value]] = column
+        if not any(matched):
+            raise ValidationError('The header row does not match any of the columns.')
+        return matched
+
+    def get_missing_fields(self, model, columns):
+        """
+        Returns the fields that new objects need a value for, but that none
+        of the columns imports.
+        """
+        imported = set(column.field for column in columns if column is not None)
+        missing = []
+        for field in model._meta.concrete_fields:
+            if field in imported or field.null or field.has_default() or \
+                    isinstance(field, models.AutoField) or \
+                    getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+                continue
+            # Blank strings are fine for fields that allow them.
+            if field.blank and field.empty_strings_allowed:
+                continue
+            missing.append(field)
+        return missing
+
+    def format_missing_fields(self, missing):
+        return 'There are no columns for the required fields: %s.' % ', '.join(
+            field.name for field in missing)
+
+    def report_errors(self, errors, result):
+        if not self.skip_errors:
+            raise ValidationError(['Line %d: %s' % error for error in errors])
+        result.errors.extend(errors)
+        result.skipped += len(errors)
+
+    def save_batch(self, model, columns, objects, using, result, missing=()):
+        """
+        Saves the objects of a batch in a transaction.  If the database
+        rejects them, the batch is rolled back, and the error is raised as a
+        ValidationError or, with skip_errors, reported for every row.
+        """
+        counts = result.created, result.updated, result.skipped, len(result.errors)
+        try:
+            with transaction.atomic(using=using):
+                self.save_objects(model, columns, objects, using, result, missing)
+        except IntegrityError as e:
+            result.created, result.updated, result.skipped = counts[:3]
+            del result.errors[counts[3]:]
+            message = 'The batch was not saved: %s' % force_text(e)
+            self.report_errors([(line, message) for line, obj in objects], result)
+
+    def build_objects(self, model, columns, batch, using, related, result):
+        """
+        Returns a list of (line number, unsaved object) for the rows of a
+        batch.
+        """
+        values = []
+        errors = []
+        for line, row in batch:
+            result.rows += 1
+            data = {}
+            row_errors = []
+            for column, value in zip(columns, row):
+                if column is None:
+                    continue
+                try:
+                    data[column] = column.parse(value)
+                except ValidationError as e:
+                    row_errors.append('%s: %s' % (column.parse_field.name, ' '.join(e.messages)))
+            if row_errors:
+                errors.append((line, '; '.join(row_errors)))
+            else:
+                values.append((line, data))
+
+        self.get_related_objects(columns, values, using, related)
+        objects = []
+        for line, data in values:
+            kwargs = {}
+            row_errors = []
+            for column, value in data.items():
+                if column.lookup_field is None:
+                    kwargs[column.field.attname] = value
+                elif value is None:
+                    kwargs[column.field.attname] = None
+                else:
+                    pk = related[column].get(value)
+                    if pk is None:
+                        row_errors.append("%s: No %s with %s '%s'." % (
+                            column.field.name, column.field.related_model._meta.verbose_name,
+                            column.lookup_field.name, value))
+                    kwargs[column.field.attname] = pk
+            if row_errors:
+                errors.append((line, '; '.join(row_errors)))
+            else:
+                objects.append((line, model(**kwargs)))
+
+        if errors:
+            self.report_errors(errors, result)
+        return objects
+
+    def get_related_objects(self, columns, values, using, related):
+        """
+        Adds the primary keys of the related objects that the columns look
+        up to related, which maps every such column to a dict of primary
+        keys (or None if there is no such object) by the looked up value.
+        Only the values that weren't looked up in an earlier batch are
+        queried.
+        """
+        for column in columns:
+            if column is None or column.lookup_field is None:
+                continue
+            mapping = related.setdefault(column, {})
+            keys = set(data[column] for line, data in values
+                       if data.get(column) is not None and data[column] not in mapping)
+            if not keys:
+                continue
+            model = column.field.related_model
+            name = column.lookup_field.name
+            for chunk in self.slice_keys(using, [column.lookup_field], list(keys)):
+                mapping.update((key, None) for key in chunk)
+                queryset = model._default_manager.using(using).filter(**{name + '__in': chunk})
+                mapping.update(queryset.values_list(name, 'pk'))
+
+    def slice_keys(self, using, fields, keys):
+        # Databases limit the number of parameters in a query.
+        size = connections[using].ops.bulk_batch_size(fields, keys) or len(keys)
+        return batches(keys, max(size, 1))
+
+    def get_key_fields(self, model):
+        opts = model._meta
+        return [opts.pk if name == 'pk' else opts.get_field(name) for name in self.key_fields]
+
+    def save_objects(self, model, columns, objects, using, result, missing=()):
+        manager = model._default_manager.using(using)
+        if not self.key_fields:
+            manager.bulk_create([obj for line, obj in objects])
+            result.created += len(objects)
+            return
+
+        key_fields = self.get_key_fields(model)
+
+        def get_key(obj):
+            return tuple(getattr(obj, field.attname) for field in key_fields)
+
+        # If a key shows up more than once, the last row wins.  Rows without
+        # a key (like a blank primary key) are always new.
+        new, by_key = [], OrderedDict()
+        for line, obj in objects:
+            key = get_key(obj)
+            if None in key:
+                new.append((line, obj))
+            else:
+                by_key[key] = line, obj
+        existing = self.get_existing(manager, key_fields, list(by_key))
+
+        changed = []
+        for key, (line, obj) in by_key.items():
+            if key in existing:
+                obj.pk = existing[key]
+                changed.append(obj)
+            else:
+                new.append((line, obj))
+        result.skipped += len(objects) - len(new) - len(changed)
+
+        if missing and new:
+            # Only rows that would be created need the missing fields.
+            self.report_errors([
+                (line, self.format_missing_fields(missing)) for line, obj in new], result)
+            new = []
+        new = [obj for line, obj in new]
+
+        manager.bulk_create(new)
+        result.created += len(new)
+        if not self.update_existing:
+            result.skipped += len(changed)
+            return
+        fields = self.get_update_fields(model, columns, key_fields)
+        for obj in changed:
+            for field in fields:
+                # Keep auto_now fields like updated_at up to date.
+                field.pre_save(obj, False)
+        bulk_update(manager.all(), changed, [field.name for field in fields],
+                    batch_size=self.batch_size)
+        result.updated += len(changed)
+
+    def get_existing(self, manager, key_fields, keys):
+        """
+        Returns a dict of the primary keys of the objects that have the keys.
+        """
+        existing = {}
+        attnames = [field.attname for field in key_fields]
+        for chunk in self.slice_keys(manager.db, key_fields, keys):
+            if len(attnames) == 1:
+                queryset = manager.filter(**{attnames[0] + '__in': [key[0] for key in chunk]})
+            else:
+                condition = Q()
+                for key in chunk:
+                    condition |= Q(**dict(zip(attnames, key)))
+                queryset = manager.filter(condition)
+            for values in queryset.values_list(*(attnames + ['pk'])):
+                existing[tuple(values[:-1])] = values[-1]
+        return existing
+
+    def get_update_fields(self, model, columns, key_fields):
+        fields = [column.field for column in columns if column is not None]
+        fields.extend(field for field in model._meta.concrete_fields
+                      if getattr(field, 'auto_now', False))
+        unique = []
+        for field in fields:
+            if field not in unique and field not in key_fields and not field.primary_key:
+                unique.append(field)
+        return unique
@@ -0,0 +1,218 @@
+"""
+Background jobs for exports that are too big to serialize inside a request.
+
+A job backend writes the CSV to a Django storage in the background, and keeps
+track of the progress of the job in the cache so that it can be looked up
+from any process, as long as the cache is shared between processes (a
+process-local cache like LocMemCache is refused).  ThreadPoolExportBackend
+runs the exports in a pool of threads.  To run them on a different kind of
+worker (a task queue for example), subclass ExportBackend and override
+enqueue.
+"""
+import tempfile
+import threading
+import uuid
+from multiprocessing.pool import ThreadPool
+
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import connections
+
+from .compression import CompressedFile
+
+
+class ExportJob(object):
+    """
+    The state of a background export.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, id, filename, user_id=None, status=PENDING, rows=0, total=None,
+                 path=None, error=None):
+        self.id = id
+        self.filename = filename
+        self.user_id = user_id
+        self.status = status
+        self.rows = rows
+        self.total = total
+        self.path = path
+        self.error = error
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    @property
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+
+class ExportBackend(object):
+    """
+    Runs exports in the background.  Subclasses need to implement enqueue.
+    The state of the jobs is kept in the cache_alias cache, which every
+    process that runs or looks up jobs has to share, unless local_cache is
+    True.
+    """
+    cache_alias = 'default'
+    local_cache = False
+    cache_timeout = 60 * 60 * 24
+    storage = None
+    upload_to = 'exports/'
+    progress_interval = 1000
+
+    def get_storage(self):
+        return self.storage or default_storage
+
+    def get_cache(self):
+        return caches[self.cache_alias]
+
+    def check_cache(self):
+        """
+        Raises ImproperlyConfigured if the cache can't keep track of jobs:
+        a cache that doesn't store anything, or one that only the current
+        process sees when the job or the next request might run elsewhere.
+        """
+        cache = self.get_cache()
+        if isinstance(cache, DummyCache) or \
+                (not self.local_cache and isinstance(cache, LocMemCache)):
+            raise ImproperlyConfigured(
+                'Export jobs need a cache that all processes share, the %r cache is a %s.'
+                % (self.cache_alias, type(cache).__name__))
+
+    def get_job(self, job_id):
+        """
+        Returns the ExportJob for job_id, or None if there isn't one.
+        """
+        state = self.get_cache().get(self.get_cache_key(job_id))
+        if state is None:
+            return None
+        return ExportJob(**state)
+
+    def save_job(self, job):
+        self.get_cache().set(self.get_cache_key(job.id), job.to_dict(), self.cache_timeout)
+
+    def get_cache_key(self, job_id):
+        return 'separated-export-job:%s' % job_id
+
+    def get_url(self, job):
+        """
+        Returns the URL to download the file for a finished job.
+        """
+        if job.status != job.DONE:
+            return None
+        return self.get_storage().url(job.path)
+
+    def submit(self, queryset, serializer, filename, user=None):
+        """
+        Starts exporting queryset with serializer and returns the ExportJob
+        right away.
+        """
+        self.check_cache()
+        job = ExportJob(
+            id=uuid.uuid4().hex,
+            filename=filename,
+            user_id=getattr(user, 'pk', None),
+        )
+        self.save_job(job)
+        self.enqueue(self.run, job.id, queryset, serializer)
+        return job
+
+    def enqueue(self, function, *args):
+        raise NotImplementedError('Subclasses of ExportBackend need to implement enqueue.')
+
+    def run(self, job_id, queryset, serializer):
+        """
+        Does the actual export.  This is what enqueue runs on the worker.
+        If the job has expired or was evicted from the cache before it
+        started, nobody can fetch the file anymore, and it is skipped.
+        """
+        job = self.get_job(job_id)
+        if job is None:
+            return
+        try:
+            job.status = job.RUNNING
+            job.total = queryset.count()
+            self.save_job(job)
+            with tempfile.TemporaryFile() as f:
+                self.write(job, queryset, serializer, f)
+                f.seek(0)
+                name = '%s%s/%s' % (self.upload_to, job.id, job.filename)
+                job.path = self.get_storage().save(name, File(f))
+            job.status = job.DONE
+        except Exception as e:
+            job.status = job.FAILED
+            job.error = '%s: %s' % (e.__class__.__name__, e)
+            raise
+        finally:
+            self.save_job(job)
+
+    def write(self, job, queryset, serializer, file):
+        if not serializer.get_writer_class().writes_rows:
+            # Formats like Parquet are written by the serializer itself, the
+            # progress is only known at the end.
+            serializer(queryset, file=file)
+            job.rows = job.total
+            return
+        if serializer.compression:
+            file = CompressedFile(file, serializer.compression)
+        metrics = serializer.start_metrics(queryset)
+        try:
+            rows = self.count_rows(job, serializer.get_rows(queryset, metrics))
+            serializer.write(rows, file, metrics)
+        finally:
+            serializer.finish_metrics(metrics)
+        if serializer.compression:
+            file.finish()
+
+    def count_rows(self, job, rows):
+        for row in rows:
+            yield row
+            job.rows += 1
+            if job.rows % self.progress_interval == 0:
+                self.save_job(job)
+
+
+class SynchronousExportBackend(ExportBackend):
+    """
+    Runs the export right away, before submit returns.  Useful for tests and
+    development.
+    """
+    local_cache = True
+
+    def enqueue(self, function, *args):
+        function(*args)
+
+
+class ThreadPoolExportBackend(ExportBackend):
+    """
+    Runs exports in a pool of threads in the web server process.
+    """
+    processes = 2
+    _pool = None
+    _pool_lock = threading.Lock()
+
+    def get_pool(self):
+        cls = type(self)
+        with cls._pool_lock:
+            if cls._pool is None:
+                cls._pool = ThreadPool(self.processes)
+        return cls._pool
+
+    def enqueue(self, function, *args):
+        return self.get_pool().apply_async(self.run_in_thread, (function,) + args)
+
+    def run_in_thread(self, function, *args):
+        try:
+            return function(*args)
+        finally:
+            # The threads in the pool stick around, don't leave their
+            # database connections open.
+            for connection in connections.all():
+                connection.close()
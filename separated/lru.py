@@ -0,0 +1,162 @@
+"""
+A bounded least recently used cache.
+"""
+import threading
+import weakref
+from collections import OrderedDict
+
+
+missing = object()
+
+
+class LRUCache(object):
+    """
+    A mapping that holds at most maxsize items.  When it is full, the item
+    that was used least recently is dropped to make room.  hits and misses
+    count the lookups with get, to show whether the cache pays off.  It can
+    be shared between threads.
+
+    If weak_callables is True, callable keys (like lambdas that are used as
+    accessors) are only referenced weakly, and so are their values, if they
+    can be.  The item goes away with the callable, or once nothing else uses
+    the value, instead of keeping both alive until it is pushed out.
+    """
+    def __init__(self, maxsize=1024, weak_callables=False):
+        self.maxsize = maxsize
+        self.weak_callables = weak_callables
+        self.hits = 0
+        self.misses = 0
+        # Maps keys to 3-tuples of (value, whether value is a weakref, key).
+        # The key is kept because the one that an item is looked up with
+        # might be a different weakref than the one with the callback.
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        # (key, value weakref or None) for the items whose key or value has
+        # died.  Weakref callbacks can run at any time, even while the lock
+        # is held, so they only add to this list.
+        self.dead = []
+
+    def __len__(self):
+        with self.lock:
+            self.purge()
+            return len(self.data)
+
+    def __contains__(self, key):
+        try:
+            key = self.get_key(key)
+        except TypeError:
+            return False
+        with self.lock:
+            return self.lookup(key, move=False) is not missing
+
+    def get_key(self, key, callback=None):
+        """
+        Returns what key is stored under, a weakref if it is a callable that
+        should be referenced weakly.  Raises TypeError if key isn't hashable.
+        """
+        if self.weak_callables and callable(key):
+            try:
+                key = weakref.ref(key, callback)
+            except TypeError:
+                # Some callables can't be referenced weakly, like builtins on
+                # Python 2, but those live forever anyway.
+                pass
+        hash(key)
+        return key
+
+    def purge(self):
+        # Called with the lock held.
+        while self.dead:
+            key, ref = self.dead.pop()
+            entry = self.data.get(key)
+            if entry is not None and (ref is None or entry[0] is ref):
+                del self.data[key]
+
+    def lookup(self, key, move=True):
+        # Called with the lock held.
+        if self.dead:
+            self.purge()
+        entry = self.data.get(key)
+        if entry is None:
+            return missing
+        value, weak, stored_key = entry
+        if weak:
+            value = value()
+            if value is None:
+                return missing
+        if move:
+            # The most recently used items are at the end.
+            try:
+                self.data.move_to_end(key)
+            except AttributeError:  # Python 2
+                del self.data[key]
+                self.data[stored_key] = entry
+        return value
+
+    def store(self, key, value):
+        # Called with the lock held.
+        entry = (value, False, key)
+        if isinstance(key, weakref.ref):
+            try:
+                entry = (weakref.ref(value, self.value_died(key)), True, key)
+            except TypeError:
+                pass
+        self.purge()
+        self.data.pop(key, None)
+        self.data[key] = entry
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def key_died(self, ref):
+        self.dead.append((ref, None))
+
+    def value_died(self, key):
+        return lambda ref: self.dead.append((key, ref))
+
+    def get(self, key, default=None):
+        try:
+            key = self.get_key(key)
+        except TypeError:
+            self.misses += 1
+            return default
+        with self.lock:
+            value = self.lookup(key)
+            if value is missing:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        try:
+            key = self.get_key(key, self.key_died)
+        except TypeError:
+            return
+        with self.lock:
+            self.store(key, value)
+
+    def get_or_set(self, key, create):
+        """
+        Returns the value for key, calling create to make it if it isn't in
+        the cache.  Threads that ask for the same key at the same time might
+        both call create, but they all get the same value back.
+        """
+        value = self.get(key, missing)
+        if value is not missing:
+            return value
+        value = create()
+        try:
+            key = self.get_key(key, self.key_died)
+        except TypeError:
+            return value
+        with self.lock:
+            existing = self.lookup(key)
+            if existing is not missing:
+                return existing
+            self.store(key, value)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            del self.dead[:]
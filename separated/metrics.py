@@ -0,0 +1,251 @@
+"""
+Instrumentation for exports.
+
+An instrumented ColumnSerializer (instrument=True) collects an ExportMetrics
+for every export: how many rows, bytes and queries it took, and how the time
+was split between iterating over the queryset, extracting the cells and
+writing.  With profile_columns=True, it also times every column separately
+and counts the queries that each column causes, which shows N+1 queries and
+slow accessors.  When the export is done, the metrics are sent with the
+separated.signals.export_finished signal and passed to the serializer's
+metrics_hook.
+"""
+from timeit import default_timer
+
+from django.db import connections
+
+from .signals import export_finished
+
+
+def get_model_label(model):
+    opts = model._meta
+    return '%s.%s' % (opts.app_label, opts.model_name)
+
+
+class CountingCursor(object):
+    """
+    Wraps a database cursor and counts its queries for the QueryCounters that
+    are running on its connection.
+    """
+    def __init__(self, cursor, counters):
+        self.cursor = cursor
+        self.counters = counters
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self.cursor.__exit__(exc_type, exc_value, traceback)
+
+    def count(self):
+        for counter in self.counters:
+            counter.queries += 1
+
+    def execute(self, sql, params=None):
+        self.count()
+        return self.cursor.execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        self.count()
+        return self.cursor.executemany(sql, param_list)
+
+
+class QueryCounter(object):
+    """
+    Counts the queries that are run on a database connection between start
+    and stop.  On Django < 2.0, which doesn't have execute wrappers, the
+    connection's cursors are wrapped instead.
+    """
+    def __init__(self, using):
+        self.connection = connections[using]
+        self.queries = 0
+        self.running = False
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def start(self):
+        self.running = True
+        if hasattr(self.connection, 'execute_wrappers'):
+            self.connection.execute_wrappers.append(self)
+            return
+        counters = self.connection.__dict__.get('separated_query_counters')
+        if counters is None:
+            counters = self.connection.separated_query_counters = []
+            self.wrap_cursors(counters)
+        counters.append(self)
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        if hasattr(self.connection, 'execute_wrappers'):
+            if self in self.connection.execute_wrappers:
+                self.connection.execute_wrappers.remove(self)
+            return
+        counters = self.connection.__dict__.get('separated_query_counters', [])
+        if self in counters:
+            counters.remove(self)
+        if not counters:
+            self.unwrap_cursors()
+
+    def wrap_cursors(self, counters):
+        # Both kinds of cursors that the connection makes, depending on
+        # whether it logs queries.
+        connection = self.connection
+        for name in ('make_cursor', 'make_debug_cursor'):
+            make_cursor = getattr(connection, name)
+
+            def wrapped(cursor, make_cursor=make_cursor):
+                return CountingCursor(make_cursor(cursor), counters)
+
+            setattr(connection, name, wrapped)
+
+    def unwrap_cursors(self):
+        for name in ('separated_query_counters', 'make_cursor', 'make_debug_cursor'):
+            self.connection.__dict__.pop(name, None)
+
+    @property
+    def count(self):
+        return self.queries
+
+
+class ExportMetrics(object):
+    """
+    The measurements for one export.  All times are in seconds.
+    """
+    def __init__(self, serializer, queryset, profile_columns=False):
+        self.serializer = serializer
+        self.model = getattr(queryset, 'model', None)
+        self.format = getattr(serializer, 'format', None)
+        self.profile_columns = profile_columns
+        self.rows = 0
+        self.bytes = 0
+        self.queries = 0
+        self.time = 0.0
+        self.iteration_time = 0.0
+        self.extraction_time = 0.0
+        self.writing_time = 0.0
+        # The Memo for memoized columns, if the serializer has one.
+        self.memo = None
+        self.memo_hits = 0
+        self.memo_misses = 0
+        self.columns = [
+            {'header': header, 'time': 0.0, 'queries': 0}
+            for getter, header in serializer.normalized_columns
+        ]
+        self.counter = QueryCounter(getattr(queryset, 'db', 'default'))
+
+    def start(self):
+        self.counter.start()
+        self.started = default_timer()
+
+    def stop(self):
+        self.time = default_timer() - self.started
+        self.counter.stop()
+        self.queries = self.counter.queries
+        if self.memo is not None:
+            self.memo_hits = self.memo.hits
+            self.memo_misses = self.memo.misses
+
+    def measure_rows(self, objects, get_row):
+        """
+        Wraps the iterator over the rows, timing how long it takes to get
+        each object from the queryset and how long it takes to turn it into a
+        row.
+        """
+        timer = default_timer
+        objects = iter(objects)
+        while True:
+            started = timer()
+            try:
+                obj = next(objects)
+            except StopIteration:
+                self.iteration_time += timer() - started
+                return
+            fetched = timer()
+            row = get_row(obj)
+            self.iteration_time += fetched - started
+            self.extraction_time += timer() - fetched
+            self.rows += 1
+            yield row
+
+    def profile_row_getter(self, cell_getters, unpack=False):
+        """
+        Returns a row getter that calls a getter for each cell separately, so
+        that the time and queries for every column can be measured.  The cell
+        getters take the object (or a 1-tuple of the value, if unpack is True)
+        and return a 1-item list.
+        """
+        timer = default_timer
+        counter = self.counter
+        columns = self.columns
+        cells = list(enumerate(cell_getters))
+
+        def get_row(obj):
+            row = []
+            for index, get_cell in cells:
+                queries = counter.count
+                started = timer()
+                row.extend(get_cell((obj[index],) if unpack else obj))
+                column = columns[index]
+                column['time'] += timer() - started
+                column['queries'] += counter.count - queries
+            return row
+        return get_row
+
+    def to_dict(self):
+        data = {
+            'model': get_model_label(self.model) if self.model is not None else None,
+            'format': self.format,
+            'rows': self.rows,
+            'bytes': self.bytes,
+            'queries': self.queries,
+            'time': self.time,
+            'iteration_time': self.iteration_time,
+            'extraction_time': self.extraction_time,
+            'writing_time': self.writing_time,
+        }
+        if self.memo is not None:
+            data['memo_hits'] = self.memo_hits
+            data['memo_misses'] = self.memo_misses
+        if self.profile_columns:
+            data['columns'] = [dict(column) for column in self.columns]
+        return data
+
+    def send(self):
+        serializer = self.serializer
+        export_finished.send(sender=type(serializer), serializer=serializer, metrics=self)
+        if serializer.metrics_hook is not None:
+            serializer.metrics_hook(self)
+
+
+class StatsdHook(object):
+    """
+    A metrics_hook that reports to a statsd client (anything with timing,
+    incr and gauge methods, like the statsd and datadog packages).
+    """
+    def __init__(self, client, prefix='separated.export'):
+        self.client = client
+        self.prefix = prefix
+
+    def __call__(self, metrics):
+        prefix = self.prefix
+        if metrics.model is not None:
+            prefix = '%s.%s' % (prefix, get_model_label(metrics.model))
+        self.client.incr('%s.count' % prefix)
+        self.client.incr('%s.rows' % prefix, metrics.rows)
+        self.client.incr('%s.bytes' % prefix, metrics.bytes)
+        self.client.gauge('%s.queries' % prefix, metrics.queries)
+        if metrics.memo is not None:
+            self.client.incr('%s.memo_hits' % prefix, metrics.memo_hits)
+            self.client.incr('%s.memo_misses' % prefix, metrics.memo_misses)
+        for name in ('time', 'iteration_time', 'extraction_time', 'writing_time'):
+            self.client.timing('%s.%s' % (prefix, name), getattr(metrics, name) * 1000)
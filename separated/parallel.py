@@ -0,0 +1,169 @@
+"""
+Serializes big querysets on several CPU cores at once.
+
+ShardedColumnSerializer splits a queryset into primary key ranges and
+serializes each range in a separate process, with its own database
+connection, then concatenates the results in order.  The worker processes are
+forked, so this only works on platforms that have fork.
+"""
+import multiprocessing
+import os
+import tempfile
+import threading
+
+from django.db import connections
+
+from .compression import compress_chunks
+from .ranges import get_pk_ranges
+from .utils import ColumnSerializer, can_split_by_pk
+
+
+# The serializer and queryset for the shards that are being forked.  Worker
+# processes inherit them instead of having to pickle them (columns can be
+# lambdas).
+_shard_context = None
+_fork_lock = threading.Lock()
+
+
+def serialize_shard(bounds):
+    serializer, queryset = _shard_context
+    return serializer.serialize_shard(queryset, bounds)
+
+
+def get_pool(processes):
+    try:
+        return multiprocessing.get_context('fork').Pool(processes)
+    except AttributeError:  # Python 2 always forks
+        return multiprocessing.Pool(processes)
+
+
+class ShardedColumnSerializer(ColumnSerializer):
+    """
+    A ColumnSerializer that serializes primary key ranges of the queryset in
+    parallel.  processes is the number of worker processes (the number of
+    CPUs by default) and shards_per_process is how many pieces each process
+    gets, so that one slow range doesn't hold up all of the others.
+
+    Querysets that can't be split by primary key (because they are sliced,
+    ordered by something else or have non-integer primary keys) are
+    serialized the normal way.  Inside of a transaction, the shards are
+    serialized one after the other in this process, because other
+    connections wouldn't be able to see uncommitted rows.
+    """
+    processes = None
+    shards_per_process = 4
+
+    def __init__(self, columns, **kwargs):
+        super(ShardedColumnSerializer, self).__init__(columns, **kwargs)
+        self.processes = kwargs.get('processes', self.processes) or multiprocessing.cpu_count()
+        self.shards_per_process = kwargs.get('shards_per_process', self.shards_per_process)
+
+    def __call__(self, queryset, file=None):
+        shards = self.get_shards(queryset)
+        if shards is None:
+            return super(ShardedColumnSerializer, self).__call__(queryset, file=file)
+
+        chunks = self.stream_shards(queryset, shards)
+        if file is None:
+            output = b''.join(chunks)
+            if self.compression or self.get_writer_class().binary:
+                return output
+            return output.decode('utf-8')
+        for chunk in chunks:
+            file.write(chunk)
+
+    def stream(self, queryset):
+        shards = self.get_shards(queryset)
+        if shards is None:
+            return super(ShardedColumnSerializer, self).stream(queryset)
+        return self.stream_shards(queryset, shards)
+
+    def stream_shards(self, queryset, shards):
+        chunks = self._stream_shards(queryset, shards)
+        if self.compression:
+            chunks = compress_chunks(chunks, self.compression)
+        return chunks
+
+    def get_shards(self, queryset):
+        """
+        Returns a list of (first pk, last pk) ranges that cover the queryset,
+        or None if it can't be split up.  Every range has about the same
+        number of rows, however the primary keys are spread out.
+        """
+        if not self.get_writer_class().concatenable:
+            return None
+        if not can_split_by_pk(queryset):
+            return None
+
+        count = queryset.count()
+        if not count:
+            return []
+        shards = self.processes * self.shards_per_process
+        return get_pk_ranges(queryset, -(-count // shards))
+
+    def serialize_shard(self, queryset, bounds):
+        """
+        Writes the rows in the range of primary keys to a temporary file,
+        without the header, and returns its path.
+        """
+        writer = self.get_writer()
+        # The header goes at the top of the whole file, but the writer might
+        # need to know what it is.
+        writer.start(self.get_header_row() if self.output_headers else None)
+        first, last = bounds
+        queryset = queryset.filter(pk__gte=first, pk__lte=last).order_by('pk')
+        fd, path = tempfile.mkstemp(suffix='.' + writer.extension)
+        with os.fdopen(fd, 'wb') as f:
+            self.write_rows(writer, self.get_rows(queryset), f)
+        return path
+
+    def _stream_shards(self, queryset, shards):
+        writer = self.get_writer()
+        chunk = writer.start(self.get_header_row() if self.output_headers else None)
+        if chunk:
+            yield chunk
+
+        for path in self._serialize_shards(queryset, shards):
+            try:
+                with open(path, 'rb') as f:
+                    while True:
+                        chunk = f.read(64 * 1024)
+                        if not chunk:
+                            break
+                        yield chunk
+            finally:
+                os.remove(path)
+
+        chunk = writer.finish()
+        if chunk:
+            yield chunk
+
+    def _serialize_shards(self, queryset, shards):
+        global _shard_context
+
+        connection = connections[queryset.db]
+        if self.processes == 1 or len(shards) < 2 or connection.in_atomic_block:
+            for bounds in shards:
+                yield self.serialize_shard(queryset, bounds)
+            return
+
+        with _fork_lock:
+            # Make the workers open their own connections instead of sharing
+            # the socket of ours.
+            for conn in connections.all():
+                if not conn.in_atomic_block:
+                    conn.close()
+            _shard_context = (self, queryset)
+            try:
+                pool = get_pool(min(self.processes, len(shards)))
+            finally:
+                _shard_context = None
+
+        try:
+            # imap hands the results back in order, as soon as each one is
+            # ready.
+            for path in pool.imap(serialize_shard, shards):
+                yield path
+        finally:
+            pool.terminate()
+            pool.join()
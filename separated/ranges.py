@@ -0,0 +1,196 @@
+"""
+Resumable exports.
+
+A resumable export is split into ranges of primary keys, and every range is
+saved to a file in a Django storage the first time it is serialized.  Since
+the export is then made of pieces whose sizes are known, it can answer HTTP
+Range requests: a client whose download broke off asks for the rest of the
+file, and only the ranges that it covers and that haven't been saved yet are
+serialized again.  The files are keyed on the ETag of the export, so a
+client never gets pieces of two different versions of the data.
+"""
+import re
+import tempfile
+
+from django.core.files import File
+from django.db.models import Max
+from django.utils import six
+
+
+range_re = re.compile(r'^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$')
+
+
+def parse_range_header(header):
+    """
+    Returns a 2-tuple of the first and last byte positions of the Range
+    header, with None for the one that is left out ((None, 500) means the
+    last 500 bytes).  Returns None if the header isn't a single byte range,
+    in which case it should be ignored.
+    """
+    match = range_re.match(header or '')
+    if match is None:
+        return None
+    first, last = [int(value) if value else None for value in match.groups()]
+    if first is None and last is None:
+        return None
+    if first is not None and last is not None and last < first:
+        return None
+    return first, last
+
+
+def get_pk_ranges(queryset, size):
+    """
+    Returns a list of (first pk, last pk) ranges that cover the queryset
+    with size rows each (the last one might have fewer).  The boundaries are
+    the primary keys of actual rows, so gaps between the keys don't make
+    empty ranges, and keys don't have to be numbers.  Every range takes one
+    query that skips size rows ahead on the primary key's index.
+    """
+    pks = queryset.order_by('pk').values_list('pk', flat=True)
+    ranges = []
+    first = next(iter(pks[:1]), None)
+    while first is not None:
+        # The last key of this range, and the first one of the next.
+        bounds = list(pks.filter(pk__gte=first)[size - 1:size + 1])
+        if not bounds:
+            bounds = [pks.filter(pk__gte=first).aggregate(last=Max('pk'))['last']]
+        ranges.append((first, bounds[0]))
+        first = bounds[1] if len(bounds) > 1 else None
+    return ranges
+
+
+class ChunkedExport(object):
+    """
+    An export made of parts: whatever the writer puts before the rows, one
+    chunk for every range of primary keys, and whatever the writer puts
+    after the rows.  The chunks are saved in storage under path, and their
+    sizes are remembered in cache under cache_key.
+    """
+    read_size = 64 * 1024
+
+    def __init__(self, serializer, queryset, ranges, storage, path, cache, cache_key,
+                 cache_timeout=None):
+        self.serializer = serializer
+        self.queryset = queryset
+        self.ranges = ranges
+        self.storage = storage
+        self.path = path
+        self.cache = cache
+        self.cache_key = cache_key
+        self.cache_timeout = cache_timeout
+        self.sizes = cache.get(cache_key) or {}
+
+        writer = serializer.get_writer()
+        self.extension = writer.extension
+        # The header and footer are cheap, so they aren't saved.
+        self.parts = [writer.start(self.get_header_row())]
+        self.parts.extend(six.moves.range(len(ranges)))
+        self.parts.append(writer.finish())
+
+    def get_header_row(self):
+        if self.serializer.output_headers:
+            return self.serializer.get_header_row()
+        return None
+
+    def get_name(self, index):
+        first, last = self.ranges[index]
+        return '%s%s-%s.%s' % (self.path, first, last, self.extension)
+
+    def get_size(self, part, serialize=True):
+        """
+        Returns the size of a part.  If its chunk hasn't been saved yet, it
+        is serialized, or the size is None if serialize is False.
+        """
+        if isinstance(part, bytes):
+            return len(part)
+        if part not in self.sizes:
+            name = self.get_name(part)
+            if self.storage.exists(name):
+                size = self.storage.size(name)
+            elif serialize:
+                size = self.save_chunk(part)
+            else:
+                return None
+            self.sizes[part] = size
+            self.cache.set(self.cache_key, self.sizes, self.cache_timeout)
+        return self.sizes[part]
+
+    def get_length(self, stop=None):
+        """
+        Returns the length of the export, serializing the chunks that haven't
+        been saved yet.  If stop is given, only the chunks that start before
+        byte stop are serialized, and the length is None if the size of any
+        of the others isn't known yet.
+        """
+        length = 0
+        for part in self.parts:
+            size = self.get_size(part, serialize=stop is None or length < stop)
+            if size is None:
+                return None
+            length += size
+        return length
+
+    def is_saved(self):
+        return all(self.get_size(part, serialize=False) is not None for part in self.parts)
+
+    def save_chunk(self, index):
+        """
+        Serializes the rows in a range of primary keys to storage, and
+        returns the size of the file.
+        """
+        serializer = self.serializer
+        writer = serializer.get_writer()
+        # The writer might need to know the header, even though it doesn't
+        # go into the chunk.
+        writer.start(self.get_header_row())
+        first, last = self.ranges[index]
+        queryset = self.queryset.filter(pk__gte=first, pk__lte=last).order_by('pk')
+        name = self.get_name(index)
+        with tempfile.TemporaryFile() as f:
+            serializer.write_rows(writer, serializer.get_rows(queryset), f)
+            size = f.tell()
+            f.seek(0)
+            saved = self.storage.save(name, File(f))
+        if saved != name:
+            # Another request saved the same chunk in the meantime.
+            self.storage.delete(saved)
+        return size
+
+    def read(self, part, start, stop):
+        """
+        Yields the bytes of a part from start up to stop.
+        """
+        if isinstance(part, bytes):
+            yield part[start:stop]
+            return
+        name = self.get_name(part)
+        if not self.storage.exists(name):
+            # The file was cleaned up since its size was remembered.
+            self.save_chunk(part)
+        with self.storage.open(name, 'rb') as f:
+            f.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                data = f.read(min(self.read_size, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+
+    def iter_range(self, first=0, last=None):
+        """
+        Yields the bytes of the export from first to last (inclusive), or to
+        the end.  Chunks are serialized as they are reached.
+        """
+        offset = 0
+        for part in self.parts:
+            if last is not None and offset > last:
+                break
+            size = self.get_size(part)
+            if offset + size > first:
+                start = max(first - offset, 0)
+                stop = size if last is None else min(last - offset + 1, size)
+                for data in self.read(part, start, stop):
+                    if data:
+                        yield data
+            offset += size
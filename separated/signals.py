@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+
+# Sent by an instrumented ColumnSerializer when an export is finished, with
+# the serializer and the ExportMetrics.
+export_finished = Signal(providing_args=['serializer', 'metrics'])
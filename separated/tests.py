@@ -1,27 +1,85 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import datetime
+import gc
+import gzip
+import json
+import re
+import shutil
+import sys
 import tempfile
+import threading
+import time
+import zipfile
+from calendar import timegm
+from decimal import Decimal
+from io import BytesIO
+from unittest import skipIf
 
-from django.core.exceptions import ImproperlyConfigured
-from django.core.urlresolvers import reverse
-from django.test import TestCase
+from django.apps import apps
+from django.contrib import messages
+from django.contrib.auth.models import User
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied, ValidationError
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import connection, models
+from django.db.models.signals import post_delete, post_save
+from django.http import Http404
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.test.client import RequestFactory
+from django.utils import six
+from django.utils.encoding import force_text
+from django.utils.http import http_date
 
 from testproject.testproject.admin import (
-    ExportColumnsAndExportViewAdmin, NoColumnsExportAdmin,
-    OverrideExportColumnsAdmin, OverrideExportViewAdmin
+    AsyncExportAdmin, CarAdmin, ExportColumnsAndExportViewAdmin, NoColumnsExportAdmin,
+    OverrideExportColumnsAdmin, OverrideExportViewAdmin, site
 )
-from testproject.testproject.models import Manufacturer
+from testproject.testproject.models import Car, Manufacturer
+from testproject.testproject.urls import CarView, ManufacturerView
 
-from .utils import BooleanGetter, ColumnSerializer, Getter
-from .views import encode_header
+from .arrow import ArrowSerializer, ParquetView, pa, pq
+from .bundles import ExportBundle, ExportBundleView
+from .cache import get_versions
+from .compression import negotiate_encoding, zstandard
+from .importers import ColumnDeserializer, bulk_update
+from .jobs import (
+    ExportBackend, ExportJob, SynchronousExportBackend, ThreadPoolExportBackend,
+)
+from .lru import LRUCache
+from .metrics import CountingCursor, StatsdHook
+from .parallel import ShardedColumnSerializer
+from .ranges import get_pk_ranges, parse_range_header
+from .utils import (
+    BooleanGetter, ColumnSerializer, Getter, Memo, get_count_lookup, get_related_lookups,
+    memoize_path,
+)
+from .signals import export_finished
+from .views import CsvView, encode_header
+from .writers import get_sheet_name
+
+try:
+    from django.urls import reverse
+except ImportError:  # Django < 1.10
+    from django.core.urlresolvers import reverse
+
+try:
+    from asgiref.sync import async_to_sync
+    from .asynchronous import AsyncColumnSerializer, ExportThreads
+except (ImportError, SyntaxError):  # No asgiref, or Python 2
+    async_to_sync = AsyncColumnSerializer = ExportThreads = None
 
 
 def utf8(text):
     return text.encode('utf8')
 
 
+def gunzip(data):
+    return gzip.GzipFile(fileobj=BytesIO(data)).read()
+
+
 class StringAccessorTest(TestCase):
     def setUp(self):
         self.manufacturer = Manufacturer.objects.create(
@@ -170,6 +228,665 @@ class SerializerTest(TestCase):
             f.seek(0)
             self.assertEqual(f.read(), b'Name,Number of models\r\nMy Manufacturer,0\r\n')
 
+    def test_serializer_stream(self):
+        serialize = ColumnSerializer([
+            ('name', 'Name'),
+            ('car_set.count', 'Number of models'),
+        ])
+        Manufacturer.objects.create(name='你好凯兰')
+        output = serialize.stream(Manufacturer.objects.all())
+        # Everything fits in one buffer.
+        self.assertEqual(list(output), [
+            utf8('Name,Number of models\r\nMy Manufacturer,0\r\n你好凯兰,0\r\n'),
+        ])
+
+    def test_batched_stream(self):
+        for i in range(9):
+            Manufacturer.objects.create(name='Manufacturer %d' % i)
+        serialize = ColumnSerializer([('name', 'Name')], batch_size=2, buffer_size=50)
+        chunks = list(serialize.stream(Manufacturer.objects.order_by('pk')))
+        self.assertEqual(b''.join(chunks), utf8(serialize(Manufacturer.objects.order_by('pk'))))
+        # The rows are encoded two at a time, and yielded once there are 50
+        # bytes of them.
+        self.assertEqual(chunks[0], b'Name\r\nMy Manufacturer\r\nManufacturer 0\r\n'
+                                    b'Manufacturer 1\r\nManufacturer 2\r\n')
+        self.assertEqual(len(chunks), 3)
+
+    def test_batched_writes(self):
+        class File(object):
+            def __init__(self):
+                self.writes = []
+
+            def write(self, data):
+                self.writes.append(data)
+
+        for i in range(4):
+            Manufacturer.objects.create(name='Manufacturer %d' % i)
+        expected = (b'Name\r\nMy Manufacturer\r\n' +
+                    b''.join(utf8('Manufacturer %d\r\n' % i) for i in range(4)))
+
+        f = File()
+        ColumnSerializer([('name', 'Name')])(Manufacturer.objects.all(), file=f)
+        self.assertEqual(f.writes, [expected])
+
+        f = File()
+        serialize = ColumnSerializer([('name', 'Name')], batch_size=2, buffer_size=1)
+        serialize(Manufacturer.objects.all(), file=f)
+        self.assertEqual(f.writes, [
+            b'Name\r\nMy Manufacturer\r\nManufacturer 0\r\n',
+            b'Manufacturer 1\r\nManufacturer 2\r\n',
+            b'Manufacturer 3\r\n',
+        ])
+
+
+class QueryPlanningTest(TestCase):
+    def setUp(self):
+        for name in ['Jeep', 'Dodge']:
+            manufacturer = Manufacturer.objects.create(name=name)
+            manufacturer.car_set.create(name='%s 1' % name)
+            manufacturer.car_set.create(name='%s 2' % name)
+
+    def test_related_lookups(self):
+        self.assertEqual(get_related_lookups(Car, 'name'), (None, None))
+        self.assertEqual(get_related_lookups(Car, 'manufacturer.name'), ('manufacturer', None))
+        self.assertEqual(get_related_lookups(Manufacturer, 'car_set.count'), (None, 'car_set'))
+        self.assertEqual(get_related_lookups(Car, 'manufacturer.car_set.count'),
+                         ('manufacturer', 'manufacturer__car_set'))
+
+    def test_select_related(self):
+        serialize = ColumnSerializer(['name', 'manufacturer.name'], output_headers=False)
+        with self.assertNumQueries(1):
+            output = serialize(Car.objects.order_by('pk'))
+        self.assertEqual(
+            output, 'Jeep 1,Jeep\r\nJeep 2,Jeep\r\nDodge 1,Dodge\r\nDodge 2,Dodge\r\n')
+
+    def test_prefetch_related(self):
+        serialize = ColumnSerializer(['name', 'car_set.exists'], output_headers=False)
+        with self.assertNumQueries(2):
+            output = serialize(Manufacturer.objects.order_by('pk'))
+        self.assertEqual(output, 'Jeep,True\r\nDodge,True\r\n')
+
+    def test_prefetch_related_chunked(self):
+        serialize = ColumnSerializer(['name', 'car_set.exists'], output_headers=False,
+                                     chunk_size=1)
+        with self.assertNumQueries(5):
+            output = serialize(Manufacturer.objects.all())
+        self.assertEqual(output, 'Jeep,True\r\nDodge,True\r\n')
+
+    def test_count_lookups(self):
+        self.assertEqual(get_count_lookup(Manufacturer, 'car_set.count'), 'car')
+        self.assertEqual(get_count_lookup(Car, 'manufacturer.car_set.count'),
+                         'manufacturer__car')
+        self.assertIsNone(get_count_lookup(Manufacturer, 'car_set.all'))
+        self.assertIsNone(get_count_lookup(Manufacturer, 'name.count'))
+
+    def test_count_is_annotated(self):
+        serialize = ColumnSerializer(['name', 'car_set.count'], output_headers=False)
+        Manufacturer.objects.create(name='Tesla')
+        with self.assertNumQueries(1):
+            output = serialize(Manufacturer.objects.order_by('pk'))
+        self.assertEqual(output, 'Jeep,2\r\nDodge,2\r\nTesla,0\r\n')
+
+    def test_count_is_annotated_for_instances(self):
+        serialize = ColumnSerializer(['get_display_name', 'manufacturer.car_set.count'],
+                                     output_headers=False)
+        with self.assertNumQueries(1):
+            output = serialize(Car.objects.order_by('pk'))
+        self.assertEqual(output, 'JEEP 1,2\r\nJEEP 2,2\r\nDODGE 1,2\r\nDODGE 2,2\r\n')
+
+    def test_count_with_filtered_relation(self):
+        # Annotating here would only count the cars that matched the filter.
+        serialize = ColumnSerializer(['name', 'car_set.count'], output_headers=False)
+        queryset = Manufacturer.objects.filter(car__name='Jeep 1')
+        self.assertEqual(serialize(queryset), 'Jeep,2\r\n')
+
+    def test_disabled(self):
+        serialize = ColumnSerializer(['get_display_name', 'manufacturer.name'],
+                                     output_headers=False, optimize_queries=False)
+        with self.assertNumQueries(5):
+            serialize(Car.objects.all())
+
+
+class ValuesFastPathTest(TestCase):
+    def setUp(self):
+        for name in ['Jeep', 'Dodge']:
+            manufacturer = Manufacturer.objects.create(name=name)
+            manufacturer.car_set.create(name='%s 1' % name)
+
+    def test_value_lookups(self):
+        serialize = ColumnSerializer(['pk', 'name', 'manufacturer.name'])
+        self.assertEqual(serialize.get_value_lookups(Car.objects.all()),
+                         ['pk', 'name', 'manufacturer__name'])
+
+    def test_needs_instances(self):
+        for column in ['manufacturer', 'get_display_name', 'manufacturer.car_set.exists',
+                       (lambda x: x.name, 'Name')]:
+            serialize = ColumnSerializer(['name', column])
+            self.assertIsNone(serialize.get_value_lookups(Car.objects.all()))
+
+    def test_nested_getters(self):
+        serialize = ColumnSerializer([
+            Getter(Getter('name', normalizer=lambda x: x.upper()), normalizer=len),
+        ], output_headers=False)
+        self.assertEqual(serialize.get_value_lookups(Car.objects.all()), ['name'])
+        self.assertEqual(serialize(Car.objects.order_by('pk')), '6\r\n7\r\n')
+
+    def test_values_output(self):
+        serialize = ColumnSerializer([
+            'name',
+            ('manufacturer.name', 'Manufacturer'),
+            Getter('manufacturer.name', normalizer=lambda x: x.upper()),
+        ])
+        with self.assertNumQueries(1):
+            output = serialize(Car.objects.order_by('pk'))
+        self.assertEqual(output, (
+            'Name,Manufacturer,Manufacturer name\r\n'
+            'Jeep 1,Jeep,JEEP\r\n'
+            'Dodge 1,Dodge,DODGE\r\n'
+        ))
+
+    def test_values_output_chunked(self):
+        serialize = ColumnSerializer(['name', 'manufacturer.name'], output_headers=False,
+                                     chunk_size=1)
+        with self.assertNumQueries(3):
+            output = serialize(Car.objects.all())
+        self.assertEqual(output, 'Jeep 1,Jeep\r\nDodge 1,Dodge\r\n')
+
+    def test_disabled(self):
+        serialize = ColumnSerializer(['name'], output_headers=False, use_values=False)
+        # This would blow up if it were used.
+        serialize.iterate_values = None
+        self.assertEqual(serialize(Manufacturer.objects.order_by('pk')), 'Jeep\r\nDodge\r\n')
+
+
+class CompiledRowGetterTest(TestCase):
+    def setUp(self):
+        manufacturer = Manufacturer.objects.create(name='Jeep')
+        self.car = manufacturer.car_set.create(name='Grand Cherokee')
+
+    def test_matches_get_row(self):
+        serialize = ColumnSerializer([
+            'name',
+            'pk',
+            'get_display_name',
+            'manufacturer',
+            'manufacturer.car_set.count',
+            Getter('name', normalizer=len),
+            Getter(Getter('manufacturer.name')),
+            (lambda x: x.name.lower(), 'Lower'),
+        ])
+        queryset = Car.objects.all()
+        get_row = serialize.compile_row_getter(queryset)
+        # The compiled getter reads the count off of the annotation.
+        car = serialize.optimize_queryset(queryset).get()
+        self.assertEqual(get_row(car), serialize.get_row(self.car))
+        self.assertEqual(get_row(car), [
+            'Grand Cherokee', str(self.car.pk), 'GRAND CHEROKEE', 'Jeep', '1', '14',
+            'Jeep', 'grand cherokee',
+        ])
+
+    def test_single_column(self):
+        serialize = ColumnSerializer(['name'])
+        get_row = serialize.compile_row_getter(Car.objects.all())
+        self.assertEqual(get_row(self.car), ['Grand Cherokee'])
+
+    def test_values(self):
+        serialize = ColumnSerializer(['name', Getter('manufacturer.name', normalizer=len)])
+        get_row = serialize.compile_row_getter(Car.objects.all(), values=True)
+        self.assertEqual(get_row(('Grand Cherokee', 'Jeep')), ['Grand Cherokee', '4'])
+
+
+class MemoizeTest(TestCase):
+    def setUp(self):
+        jeep = Manufacturer.objects.create(name='Jeep')
+        tesla = Manufacturer.objects.create(name='Tesla')
+        jeep.car_set.create(name='Wrangler')
+        jeep.car_set.create(name='Cherokee')
+        tesla.car_set.create(name='Model S')
+        self.calls = []
+        get_absolute_url = Manufacturer.get_absolute_url
+
+        def counting_get_absolute_url(manufacturer):
+            self.calls.append(manufacturer.pk)
+            return get_absolute_url(manufacturer)
+
+        Manufacturer.get_absolute_url = counting_get_absolute_url
+        self.addCleanup(setattr, Manufacturer, 'get_absolute_url', get_absolute_url)
+
+    def test_memoize(self):
+        columns = ['name', 'manufacturer.get_absolute_url']
+        expected = ColumnSerializer(columns)(Car.objects.order_by('pk'))
+        self.assertEqual(len(self.calls), 3)
+        self.calls = []
+        serialize = ColumnSerializer(columns, memoize=True)
+        self.assertEqual(serialize(Car.objects.order_by('pk')), expected)
+        # Once for every manufacturer.
+        self.assertEqual(len(self.calls), 2)
+
+    def test_every_export_starts_over(self):
+        serialize = ColumnSerializer(['manufacturer.get_absolute_url'], memoize=True)
+        serialize(Car.objects.all())
+        serialize(Car.objects.all())
+        self.assertEqual(len(self.calls), 4)
+
+    def test_normalizer(self):
+        serialize = ColumnSerializer([Getter('manufacturer.get_absolute_url', normalizer=len)],
+                                     memoize=True, output_headers=False)
+        jeep = Manufacturer.objects.get(name='Jeep')
+        self.assertEqual(serialize(Car.objects.filter(manufacturer=jeep)),
+                         '%d\r\n' % len(jeep.get_absolute_url()) * 2)
+
+    def test_memoize_columns(self):
+        columns = ['manufacturer.get_absolute_url', 'manufacturer.get_slug']
+        serialize = ColumnSerializer(columns, memoize=['manufacturer.get_slug'])
+        self.assertEqual(serialize(Car.objects.order_by('pk')),
+                         ColumnSerializer(columns)(Car.objects.order_by('pk')))
+        # Only the column that is marked is memoized.
+        self.assertEqual(len(self.calls), 6)
+
+    def test_memoize_path(self):
+        memo = Memo()
+        self.assertIsNone(memoize_path(Car, 'name', memo))
+        self.assertIsNone(memoize_path(Car, 'get_display_name', memo))
+        self.assertIsNone(memoize_path(Car, 'manufacturer.name', memo))
+        self.assertIsNone(memoize_path(Manufacturer, 'car_set.count', memo))
+        getter = memoize_path(Car, 'manufacturer.get_absolute_url', memo)
+        car = Car.objects.select_related('manufacturer').get(name='Wrangler')
+        self.assertEqual(getter(car), car.manufacturer.get_absolute_url())
+        self.assertEqual(getter(car), car.manufacturer.get_absolute_url())
+        self.assertEqual((memo.hits, memo.misses), (1, 1))
+
+    def test_bounded(self):
+        memo = Memo(1)
+        getter = memoize_path(Car, 'manufacturer.get_absolute_url', memo)
+        cars = dict((car.name, car) for car in Car.objects.select_related('manufacturer'))
+        for name in ['Wrangler', 'Model S', 'Cherokee']:
+            getter(cars[name])
+        # Jeep was pushed out by Tesla.
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual(len(memo), 1)
+
+    def test_metrics(self):
+        received = []
+
+        def receiver(sender, serializer, metrics, **kwargs):
+            received.append(metrics)
+
+        export_finished.connect(receiver)
+        self.addCleanup(export_finished.disconnect, receiver)
+        ColumnSerializer(['name', 'manufacturer.get_absolute_url'], memoize=True,
+                         instrument=True)(Car.objects.all())
+        data = received[0].to_dict()
+        self.assertEqual((data['memo_hits'], data['memo_misses']), (1, 2))
+        ColumnSerializer(['name'], instrument=True)(Car.objects.all())
+        self.assertNotIn('memo_hits', received[1].to_dict())
+
+
+class LRUCacheTest(TestCase):
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        # b was used least recently.
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.get('b', 'missing'), 'missing')
+        self.assertEqual([cache.get('a'), cache.get('c')], [1, 3])
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+    def test_unhashable(self):
+        cache = LRUCache()
+        self.assertEqual(cache.get_or_set([], lambda: 1), 1)
+        self.assertEqual(len(cache), 0)
+
+    def test_weak_callables(self):
+        cache = LRUCache(weak_callables=True)
+
+        def accessor(obj):
+            return obj
+
+        getter = Getter(accessor)
+        cache.set(accessor, getter)
+        self.assertIs(cache.get(accessor), getter)
+        # Nothing else uses the value.
+        del getter
+        gc.collect()
+        self.assertNotIn(accessor, cache)
+        self.assertEqual(len(cache), 0)
+
+        cache.set(accessor, 'a string')
+        self.assertEqual(cache.get(accessor), 'a string')
+        # The key is gone.
+        del accessor
+        gc.collect()
+        self.assertEqual(len(cache), 0)
+
+    def test_threads(self):
+        cache = LRUCache()
+        results = []
+
+        def create():
+            time.sleep(0.01)
+            return object()
+
+        def run():
+            results.append(cache.get_or_set('key', create))
+
+        threads = [threading.Thread(target=run) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 8)
+        self.assertEqual(len(set(map(id, results))), 1)
+        self.assertEqual(len(cache), 1)
+
+
+class ColumnPlanCacheTest(TestCase):
+    def test_getters_are_shared(self):
+        first = ColumnSerializer(['name', 'manufacturer.name'])
+        second = ColumnSerializer([('name', 'Name'), 'manufacturer.name'])
+        self.assertIs(first.normalized_columns[0][0], second.normalized_columns[0][0])
+        self.assertIs(first.get_column_plans(Car), second.get_column_plans(Car))
+        plans = first.get_column_plans(Car)
+        self.assertEqual(plans[0].lookup, 'name')
+        self.assertEqual(plans[1].lookup, 'manufacturer__name')
+        self.assertEqual(plans[1].related_lookups, ('manufacturer', None))
+
+    def test_getters_are_not_wrapped_again(self):
+        getter = BooleanGetter('is_electric')
+        serializer = ColumnSerializer([getter])
+        self.assertIs(serializer.normalized_columns[0][0], getter)
+
+    def test_callables_are_let_go(self):
+        serializer = ColumnSerializer([(lambda car: car.name.lower(), 'Lower')])
+        cache = ColumnSerializer.getter_cache
+        # Don't count what earlier tests left for the collector.
+        gc.collect()
+        size = len(cache)
+        del serializer
+        gc.collect()
+        self.assertEqual(len(cache), size - 1)
+
+    def test_plans(self):
+        serializer = ColumnSerializer(['manufacturer.car_set.count', 'get_display_name',
+                                       (lambda car: car.name, 'Name')])
+        count, method, function = serializer.get_column_plans(Car)
+        self.assertEqual(count.count_lookup, 'manufacturer__car')
+        self.assertIsNone(count.field)
+        self.assertIsNone(method.field)
+        self.assertIsNone(method.lookup)
+        self.assertIsNone(function.path)
+
+
+class FormatterTest(TestCase):
+    def format(self, field, value, **kwargs):
+        serializer = ColumnSerializer(['name'], **kwargs)
+        return serializer.get_formatter(field)(value)
+
+    def test_matches_force_text(self):
+        values = [
+            (models.CharField(), 'Jeep'),
+            (models.IntegerField(), 12345),
+            (models.AutoField(), 3),
+            (models.DecimalField(), Decimal('1.50')),
+            (models.FloatField(), 0.5),
+            (models.BooleanField(), True),
+            (models.NullBooleanField(), None),
+            (models.DateField(), datetime.date(2016, 4, 15)),
+            (models.DateTimeField(), datetime.datetime(2016, 4, 15, 13, 30)),
+            (models.TimeField(), datetime.time(13, 30)),
+            (models.DateField(), None),
+        ]
+        for field, value in values:
+            self.assertEqual(self.format(field, value), force_text(value))
+
+    def test_date_formats(self):
+        formats = {
+            'date_format': 'd/m/Y',
+            'datetime_format': 'd/m/Y H:i',
+            'time_format': 'H:i',
+        }
+        self.assertEqual(self.format(models.DateField(), datetime.date(2016, 4, 15), **formats),
+                         '15/04/2016')
+        self.assertEqual(self.format(models.DateTimeField(),
+                                     datetime.datetime(2016, 4, 15, 13, 30), **formats),
+                         '15/04/2016 13:30')
+        self.assertEqual(self.format(models.TimeField(), datetime.time(13, 30), **formats),
+                         '13:30')
+        self.assertEqual(self.format(models.DateField(), None, **formats), 'None')
+
+    @override_settings(USE_L10N=True, USE_THOUSAND_SEPARATOR=True)
+    def test_localize(self):
+        self.assertEqual(self.format(models.DecimalField(), Decimal('1234.5'),
+                                     localize=True, locale='de'), '1.234,5')
+        self.assertEqual(self.format(models.IntegerField(), 1234,
+                                     localize=True, locale='en'), '1,234')
+        self.assertEqual(self.format(models.DateField(), datetime.date(2016, 4, 15),
+                                     localize=True, locale='de'), '15. April 2016')
+
+    def test_custom_formatter(self):
+        class UpperSerializer(ColumnSerializer):
+            field_formatters = ColumnSerializer.field_formatters.copy()
+            field_formatters[models.CharField] = lambda serializer, field: six.text_type.upper
+
+        serialize = UpperSerializer(['name'], output_headers=False)
+        Manufacturer.objects.create(name='Jeep')
+        self.assertEqual(serialize(Manufacturer.objects.all()), 'JEEP\r\n')
+
+
+class ChunkedIterationTest(TestCase):
+    def setUp(self):
+        for name in ['A', 'B', 'C']:
+            Manufacturer.objects.create(name=name)
+
+    def test_chunks_by_pk(self):
+        serialize = ColumnSerializer(['name'], output_headers=False, chunk_size=2)
+        queryset = Manufacturer.objects.all()
+        with self.assertNumQueries(2):
+            output = serialize(queryset)
+        self.assertEqual(output, 'A\r\nB\r\nC\r\n')
+        self.assertIsNone(queryset._result_cache)
+
+    def test_exact_multiple_of_chunk_size(self):
+        serialize = ColumnSerializer(['name'], output_headers=False, chunk_size=3)
+        with self.assertNumQueries(2):
+            output = serialize(Manufacturer.objects.all())
+        self.assertEqual(output, 'A\r\nB\r\nC\r\n')
+
+    def test_keeps_ordering(self):
+        serialize = ColumnSerializer(['name'], output_headers=False, chunk_size=2)
+        output = serialize(Manufacturer.objects.order_by('-name'))
+        self.assertEqual(output, 'C\r\nB\r\nA\r\n')
+
+    def test_chunks_by_descending_pk(self):
+        serialize = ColumnSerializer(['name'], output_headers=False, chunk_size=2)
+        with self.assertNumQueries(2):
+            output = serialize(Manufacturer.objects.order_by('-pk'))
+        self.assertEqual(output, 'C\r\nB\r\nA\r\n')
+
+    def test_to_many_joins(self):
+        # Every manufacturer comes back once per car, paging by primary key
+        # would skip the repeats.
+        for manufacturer in Manufacturer.objects.all():
+            manufacturer.car_set.create(name='One')
+            manufacturer.car_set.create(name='Two')
+        queryset = Manufacturer.objects.filter(car__name__contains='')
+        expected = ColumnSerializer(['name'], output_headers=False)(queryset)
+        self.assertEqual(len(expected.splitlines()), 6)
+
+        serialize = ColumnSerializer(['name'], output_headers=False, chunk_size=2)
+        self.assertEqual(serialize(queryset), expected)
+        self.assertEqual(b''.join(serialize.stream(queryset)).decode('utf-8'), expected)
+        serialize = ColumnSerializer(['name', 'get_absolute_url'], output_headers=False,
+                                     chunk_size=2)
+        self.assertEqual(len(serialize(queryset).splitlines()), 6)
+
+        # Distinct rows have distinct primary keys.
+        with self.assertNumQueries(2):
+            output = serialize(queryset.distinct())
+        self.assertEqual(len(output.splitlines()), 3)
+
+    def test_iterables(self):
+        serialize = ColumnSerializer(['name'], output_headers=False, chunk_size=2)
+        output = serialize(list(Manufacturer.objects.all()))
+        self.assertEqual(output, 'A\r\nB\r\nC\r\n')
+
+    def test_stream_chunks_by_default(self):
+        # Streaming without a chunk_size still reads the queryset in chunks,
+        # so that the whole table never ends up in memory at once.
+        serialize = ColumnSerializer(['name'], output_headers=False, stream_chunk_size=2)
+        queryset = Manufacturer.objects.all()
+        with self.assertNumQueries(2):
+            output = b''.join(serialize.stream(queryset))
+        self.assertEqual(output, b'A\r\nB\r\nC\r\n')
+        self.assertIsNone(queryset._result_cache)
+
+        queryset = Manufacturer.objects.order_by('-name')
+        self.assertEqual(b''.join(serialize.stream(queryset)), b'C\r\nB\r\nA\r\n')
+        self.assertIsNone(queryset._result_cache)
+
+
+class ShardedSerializerTest(TestCase):
+    def setUp(self):
+        for i in range(10):
+            Manufacturer.objects.create(name='Manufacturer %d' % i)
+        self.expected = 'Name\r\n' + ''.join('Manufacturer %d\r\n' % i for i in range(10))
+
+    def test_shards(self):
+        serialize = ShardedColumnSerializer(['name'], processes=2, shards_per_process=2)
+        shards = serialize.get_shards(Manufacturer.objects.all())
+        self.assertEqual(len(shards), 4)
+        first = Manufacturer.objects.order_by('pk').first().pk
+        self.assertEqual(shards[0][0], first)
+        self.assertEqual(shards[-1][1], first + 9)
+        for (a, b), (c, d) in zip(shards, shards[1:]):
+            self.assertEqual(b + 1, c)
+
+    def test_balanced_shards(self):
+        # A gap in the primary keys doesn't leave the rows in one shard.
+        last = Manufacturer.objects.order_by('pk').last().pk
+        for i in range(10, 20):
+            Manufacturer.objects.create(pk=last + 1000 + i, name='Manufacturer %d' % i)
+        serialize = ShardedColumnSerializer(['name'], processes=2, shards_per_process=2)
+        shards = serialize.get_shards(Manufacturer.objects.all())
+        self.assertEqual(
+            [Manufacturer.objects.filter(pk__gte=a, pk__lte=b).count() for a, b in shards],
+            [5, 5, 5, 5])
+
+    def test_cannot_shard(self):
+        serialize = ShardedColumnSerializer(['name'])
+        self.assertIsNone(serialize.get_shards(Manufacturer.objects.order_by('name')))
+        self.assertIsNone(serialize.get_shards(Manufacturer.objects.all()[:5]))
+        self.assertIsNone(serialize.get_shards(list(Manufacturer.objects.all())))
+        self.assertEqual(serialize.get_shards(Manufacturer.objects.none()), [])
+
+    def test_in_transaction(self):
+        serialize = ShardedColumnSerializer(['name'], processes=3)
+        self.assertEqual(serialize(Manufacturer.objects.all()), self.expected)
+        self.assertEqual(b''.join(serialize.stream(Manufacturer.objects.all())),
+                         self.expected.encode('utf-8'))
+
+    def test_fallback(self):
+        serialize = ShardedColumnSerializer(['name'], processes=3)
+        output = serialize(Manufacturer.objects.order_by('-name'), file=None)
+        self.assertEqual(output.splitlines()[1], 'Manufacturer 9')
+
+    def test_compression(self):
+        serialize = ShardedColumnSerializer(['name'], processes=3, compression='gzip')
+        self.assertEqual(gunzip(serialize(Manufacturer.objects.all())),
+                         self.expected.encode('utf-8'))
+        self.assertEqual(gunzip(b''.join(serialize.stream(Manufacturer.objects.all()))),
+                         self.expected.encode('utf-8'))
+
+
+class ShardedSerializerProcessTest(TransactionTestCase):
+    def test_processes(self):
+        for i in range(10):
+            Manufacturer.objects.create(name='Manufacturer %d' % i)
+        serialize = ShardedColumnSerializer(['name'], processes=3)
+        with tempfile.TemporaryFile() as f:
+            serialize(Manufacturer.objects.all(), file=f)
+            f.seek(0)
+            expected = 'Name\r\n' + ''.join('Manufacturer %d\r\n' % i for i in range(10))
+            self.assertEqual(f.read(), expected.encode('utf-8'))
+
+
+class ExportBundleTest(TestCase):
+    def setUp(self):
+        manufacturer = Manufacturer.objects.create(name='Jeep')
+        manufacturer.car_set.create(name='Wrangler')
+        manufacturer.car_set.create(name='Cherokee')
+        self.exports = [
+            ('manufacturers', Manufacturer.objects.all(), ['name']),
+            ('cars', Car.objects.order_by('pk'), ['name', 'manufacturer.name']),
+        ]
+
+    def test_zip(self):
+        data = ExportBundle(self.exports)()
+        with zipfile.ZipFile(BytesIO(data)) as f:
+            self.assertEqual(f.namelist(), ['manufacturers.csv', 'cars.csv'])
+            self.assertEqual(f.read('manufacturers.csv'), b'Name\r\nJeep\r\n')
+            self.assertEqual(f.read('cars.csv'),
+                             b'Name,Manufacturer name\r\nWrangler,Jeep\r\nCherokee,Jeep\r\n')
+
+    def test_serializer(self):
+        exports = [('cars', Car.objects.order_by('pk'), ColumnSerializer(['name'], format='tsv'))]
+        with zipfile.ZipFile(BytesIO(ExportBundle(exports, output_headers=False)())) as f:
+            self.assertEqual(f.read('cars.tsv'), b'Name\r\nWrangler\r\nCherokee\r\n')
+        with zipfile.ZipFile(BytesIO(ExportBundle(self.exports, output_headers=False)())) as f:
+            self.assertEqual(f.read('manufacturers.csv'), b'Jeep\r\n')
+
+    @skipIf(sys.version_info < (3, 6), 'XLSX output requires Python 3.6 or later')
+    def test_xlsx(self):
+        data = b''.join(ExportBundle(self.exports, format='xlsx').stream())
+        with zipfile.ZipFile(BytesIO(data)) as f:
+            workbook = f.read('xl/workbook.xml').decode('utf-8')
+            cars = f.read('xl/worksheets/sheet2.xml').decode('utf-8')
+            self.assertIn('sheet2.xml', f.read('[Content_Types].xml').decode('utf-8'))
+        self.assertIn('<sheet name="manufacturers" sheetId="1" r:id="rId1"/>', workbook)
+        self.assertIn('<sheet name="cars" sheetId="2" r:id="rId2"/>', workbook)
+        self.assertIn('<row r="3"><c t="inlineStr"><is><t xml:space="preserve">Cherokee</t>',
+                      cars)
+
+    def test_sheet_name(self):
+        self.assertEqual(get_sheet_name('Cars/Trucks [2016]: all of them, and more'),
+                         'CarsTrucks 2016 all of them, an')
+        self.assertEqual(get_sheet_name('?'), 'Sheet')
+
+    def test_same_database(self):
+        exports = self.exports + [('other', Car.objects.using('other'), ['name'])]
+        with self.assertRaises(ImproperlyConfigured):
+            ExportBundle(exports)()
+
+    def test_unknown_format(self):
+        with self.assertRaises(ImproperlyConfigured):
+            ExportBundle(self.exports, format='tar')
+
+    def test_view(self):
+        view = ExportBundleView.as_view(exports=self.exports, filename='finance.{extension}')
+        response = view(RequestFactory().get('/'))
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="finance.zip"')
+        with zipfile.ZipFile(BytesIO(b''.join(response.streaming_content))) as f:
+            self.assertEqual(f.read('manufacturers.csv'), b'Name\r\nJeep\r\n')
+
+
+class ExportBundleTransactionTest(TransactionTestCase):
+    def test_single_transaction(self):
+        Manufacturer.objects.create(name='Jeep')
+        columns = ['name', (lambda obj: connection.in_atomic_block, 'Atomic')]
+        bundle = ExportBundle([
+            ('first', Manufacturer.objects.all(), columns),
+            ('second', Manufacturer.objects.all(), columns),
+        ])
+        with zipfile.ZipFile(BytesIO(bundle())) as f:
+            self.assertEqual(f.read('first.csv'), b'Name,Atomic\r\nJeep,True\r\n')
+            self.assertEqual(f.read('second.csv'), b'Name,Atomic\r\nJeep,True\r\n')
+        self.assertFalse(connection.in_atomic_block)
+
 
 class CsvViewTest(TestCase):
     def setUp(self):
@@ -199,6 +916,1061 @@ class CsvViewTest(TestCase):
         expected = encode_header('attachment; filename="áèïôų.csv"')
         self.assertEqual(response['Content-Disposition'], expected)
 
+    def test_streaming(self):
+        response = self.client.get(reverse('streaming_manufacturers'))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        expected = utf8("Name,Number of models\r\n你好凯兰,0\r\n")
+        self.assertEqual(b''.join(response.streaming_content), expected)
+
+
+@skipIf(AsyncColumnSerializer is None, 'asgiref is not installed')
+class AsyncExportTest(TransactionTestCase):
+    def setUp(self):
+        manufacturer = Manufacturer.objects.create(name='Jeep')
+        for name in ['Wrangler', 'Cherokee', 'Compass']:
+            manufacturer.car_set.create(name=name)
+        self.columns = ['name', 'manufacturer.name']
+        self.expected = ColumnSerializer(self.columns)(Car.objects.order_by('pk'))
+
+    def test_aserialize(self):
+        serialize = AsyncColumnSerializer(self.columns, chunk_size=2)
+        output = async_to_sync(serialize.aserialize)(Car.objects.order_by('pk'))
+        self.assertEqual(output, self.expected)
+
+    def test_chunks(self):
+        serialize = AsyncColumnSerializer(self.columns, chunk_size=2)
+        chunks = list(serialize.iter_chunks(Car.objects.order_by('pk')))
+        self.assertEqual(chunks, [
+            b'Name,Manufacturer name\r\n',
+            b'Wrangler,Jeep\r\nCherokee,Jeep\r\n',
+            b'Compass,Jeep\r\n',
+            b'',
+        ])
+
+    def test_compression(self):
+        serialize = AsyncColumnSerializer(self.columns, compression='gzip')
+        output = async_to_sync(serialize.aserialize)(Car.objects.order_by('pk'))
+        self.assertEqual(gunzip(output), utf8(self.expected))
+
+    def test_interrupted(self):
+        received = []
+
+        def receiver(sender, serializer, metrics, **kwargs):
+            received.append(metrics)
+
+        export_finished.connect(receiver)
+        self.addCleanup(export_finished.disconnect, receiver)
+        serialize = AsyncColumnSerializer(self.columns, chunk_size=1, instrument=True)
+        chunks = serialize.iter_chunks(Car.objects.order_by('pk'))
+        next(chunks)
+        next(chunks)
+        chunks.close()
+        self.assertEqual(received[0].rows, 1)
+
+    def test_worker_threads(self):
+        # Every export is read in one of the export threads, not in the one
+        # thread that sync_to_async(thread_sensitive=True) uses, and the
+        # exports share them.
+        threads = []
+
+        def get_name(car):
+            threads.append(threading.current_thread())
+            return car.name
+
+        serialize = AsyncColumnSerializer([(get_name, 'Name')], chunk_size=1)
+        serialize.export_threads = ExportThreads(1)
+        output = async_to_sync(serialize.aserialize)(Car.objects.order_by('pk'))
+        self.assertEqual(output, 'Name\r\nWrangler\r\nCherokee\r\nCompass\r\n')
+        self.assertEqual(len(set(threads)), 1)
+        self.assertNotIn(threading.current_thread(), threads)
+
+        async_to_sync(serialize.aserialize)(Car.objects.order_by('pk'))
+        self.assertEqual(len(threads), 6)
+        self.assertEqual(len(set(threads)), 1)
+        self.assertEqual(serialize.export_threads.exports, [0])
+
+    def test_export_threads(self):
+        export_threads = ExportThreads(2)
+        self.assertEqual([export_threads.acquire()[0] for i in range(3)], [0, 1, 0])
+        export_threads.release(1)
+        self.assertEqual(export_threads.acquire()[0], 1)
+
+
+class CachedCsvViewTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        self.manufacturer = Manufacturer.objects.create(name='Jeep')
+
+    def test_cache_hit(self):
+        response = self.client.get(reverse('cached_manufacturers'))
+        self.assertEqual(response.content, b"Name,Number of models\r\nJeep,0\r\n")
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('cached_manufacturers'))
+        self.assertEqual(response.content, b"Name,Number of models\r\nJeep,0\r\n")
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename="manufacturer_list.csv"')
+
+    def test_invalidated_on_save(self):
+        self.client.get(reverse('cached_manufacturers'))
+        Manufacturer.objects.create(name='Dodge')
+        response = self.client.get(reverse('cached_manufacturers'))
+        self.assertEqual(response.content,
+                         b"Name,Number of models\r\nJeep,0\r\nDodge,0\r\n")
+
+    def test_invalidated_by_related_models(self):
+        self.client.get(reverse('cached_manufacturers'))
+        car = self.manufacturer.car_set.create(name='Wrangler')
+        response = self.client.get(reverse('cached_manufacturers'))
+        self.assertEqual(response.content, b"Name,Number of models\r\nJeep,1\r\n")
+        car.delete()
+        response = self.client.get(reverse('cached_manufacturers'))
+        self.assertEqual(response.content, b"Name,Number of models\r\nJeep,0\r\n")
+
+    def test_streaming(self):
+        response = self.client.get(reverse('cached_streaming_manufacturers'))
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.streaming_content),
+                         b"Name,Number of models\r\nJeep,0\r\n")
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('cached_streaming_manufacturers'))
+        self.assertEqual(response.content, b"Name,Number of models\r\nJeep,0\r\n")
+
+    def test_keys(self):
+        view = ManufacturerView()
+        serializer = view.get_column_serializer(Manufacturer)
+        key = view.get_cache_key(Manufacturer.objects.all(), serializer)
+        self.assertEqual(key, view.get_cache_key(Manufacturer.objects.all(), serializer))
+        self.assertNotEqual(key, view.get_cache_key(Manufacturer.objects.filter(pk=1),
+                                                    serializer))
+        self.assertNotEqual(key, view.get_cache_key(Manufacturer.objects.all(),
+                                                    ColumnSerializer(['name'])))
+        view.get_cache_key(Manufacturer.objects.none(), serializer)
+
+    def test_callable_columns(self):
+        view = ManufacturerView()
+        queryset = Manufacturer.objects.all()
+        public = ColumnSerializer([(lambda m: m.name, 'Name')])
+        secret = ColumnSerializer([(lambda m: 'SECRET-' + m.name, 'Name')])
+        self.assertNotEqual(view.get_cache_key(queryset, public),
+                            view.get_cache_key(queryset, secret))
+
+        def prefixed(prefix):
+            return lambda m: prefix + m.name
+
+        self.assertNotEqual(
+            view.get_cache_key(queryset, ColumnSerializer([(prefixed('a'), 'Name')])),
+            view.get_cache_key(queryset, ColumnSerializer([(prefixed('b'), 'Name')])))
+
+        class Prefix(object):
+            def __call__(self, manufacturer):
+                return manufacturer.name
+
+        self.assertIsNone(view.get_cache_key(queryset, ColumnSerializer([(Prefix(), 'Name')])))
+        self.assertIsNone(view.get_cache_key(
+            queryset, ColumnSerializer([(prefixed(Prefix()), 'Name')])))
+
+    def test_callable_columns_per_request(self):
+        class StaffView(ManufacturerView):
+            cache_exports = True
+
+            def get_columns(self, model):
+                if self.request.user.is_staff:
+                    return [(lambda m: 'SECRET-' + m.name, 'Name')]
+                return [(lambda m: m.name, 'Name')]
+
+        factory = RequestFactory()
+        request = factory.get('/')
+        request.user = User(is_staff=True)
+        self.assertIn(b'SECRET-Jeep', StaffView.as_view()(request).content)
+        request = factory.get('/')
+        request.user = User(is_staff=False)
+        self.assertNotIn(b'SECRET', StaffView.as_view()(request).content)
+
+    def test_invalidated_before_first_render(self):
+        # The receivers are connected when the app is ready, so a process
+        # that never rendered the export still bumps the version.
+        self.assertTrue(post_save.has_listeners(Car))
+        versions = get_versions(caches['default'], [Car])
+        Car.objects.create(manufacturer=self.manufacturer, name='Wrangler')
+        self.assertNotEqual(versions, get_versions(caches['default'], [Car]))
+
+    def test_invalidation_is_opt_in(self):
+        config = apps.get_app_config('separated')
+        self.addCleanup(config.ready)
+        for signal in (post_save, post_delete):
+            signal.disconnect(dispatch_uid='separated-export-version:*')
+        with override_settings(SEPARATED_EXPORT_CACHES=()):
+            config.ready()
+        versions = get_versions(caches['default'], [Car])
+        with self.assertNumQueries(1):
+            Car.objects.create(manufacturer=self.manufacturer, name='Wrangler')
+        self.assertEqual(versions, get_versions(caches['default'], [Car]))
+
+    def test_needs_export_cache(self):
+        view = ManufacturerView(cache_alias='other')
+        serializer = view.get_column_serializer(Manufacturer)
+        with self.assertRaises(ImproperlyConfigured):
+            view.get_cache_key(Manufacturer.objects.all(), serializer)
+
+    def test_needs_shared_cache(self):
+        view = ManufacturerView(cache_alias='local')
+        serializer = view.get_column_serializer(Manufacturer)
+        with self.assertRaises(ImproperlyConfigured):
+            view.get_cache_key(Manufacturer.objects.all(), serializer)
+
+
+class CompressionTest(TestCase):
+    def setUp(self):
+        for i in range(100):
+            Manufacturer.objects.create(name='Manufacturer %d' % i)
+        self.expected = utf8('Name\r\n' + ''.join(
+            'Manufacturer %d\r\n' % i for i in range(100)))
+
+    def test_serializer(self):
+        serialize = ColumnSerializer([('name', 'Name')], compression='gzip')
+        output = serialize(Manufacturer.objects.all())
+        self.assertIsInstance(output, bytes)
+        self.assertLess(len(output), len(self.expected))
+        self.assertEqual(gunzip(output), self.expected)
+
+    def test_file(self):
+        serialize = ColumnSerializer([('name', 'Name')], compression='gzip')
+        with tempfile.NamedTemporaryFile(suffix='.csv.gz') as f:
+            serialize(Manufacturer.objects.all(), file=f)
+            f.flush()
+            with gzip.open(f.name, 'rb') as g:
+                self.assertEqual(g.read(), self.expected)
+
+    def test_stream(self):
+        serialize = ColumnSerializer([('name', 'Name')], compression='gzip')
+        chunks = list(serialize.stream(Manufacturer.objects.all()))
+        # The compressor holds on to the data instead of yielding a chunk per
+        # row.
+        self.assertLess(len(chunks), 100)
+        self.assertEqual(gunzip(b''.join(chunks)), self.expected)
+
+    def test_unknown(self):
+        with self.assertRaises(ImproperlyConfigured):
+            ColumnSerializer(['name'], compression='rar')(Manufacturer.objects.all())
+
+    @skipIf(zstandard is None, 'zstandard is not installed')
+    def test_zstd(self):
+        serialize = ColumnSerializer([('name', 'Name')], compression='zstd')
+        output = serialize(Manufacturer.objects.all())
+        self.assertEqual(zstandard.ZstdDecompressor().decompressobj().decompress(output),
+                         self.expected)
+
+    def test_negotiate_encoding(self):
+        self.assertEqual(negotiate_encoding('gzip, deflate', ('zstd', 'gzip')), 'gzip')
+        self.assertEqual(negotiate_encoding('gzip, zstd', ('zstd', 'gzip')), 'zstd')
+        self.assertEqual(negotiate_encoding('gzip;q=1.0, zstd;q=0.5', ('zstd', 'gzip')),
+                         'gzip')
+        self.assertEqual(negotiate_encoding('gzip;q=0', ('gzip',)), None)
+        self.assertEqual(negotiate_encoding('*', ('gzip',)), 'gzip')
+        self.assertEqual(negotiate_encoding('identity', ('gzip',)), None)
+        self.assertEqual(negotiate_encoding(None, ('gzip',)), None)
+
+    def test_view(self):
+        response = self.client.get(reverse('compressed_manufacturers'),
+                                   HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(gunzip(response.content), self.expected)
+
+        response = self.client.get(reverse('compressed_manufacturers'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(response.content, self.expected)
+
+    def test_streaming_view(self):
+        response = self.client.get(reverse('compressed_streaming_manufacturers'),
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gunzip(b''.join(response.streaming_content)), self.expected)
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        manufacturer = Manufacturer.objects.create(name='Jeep')
+        manufacturer.car_set.create(name='Wrangler')
+        manufacturer.car_set.create(name='Cherokee')
+        self.received = []
+        export_finished.connect(self.receiver)
+        self.addCleanup(export_finished.disconnect, self.receiver)
+
+    def receiver(self, sender, serializer, metrics, **kwargs):
+        self.received.append(metrics)
+
+    def test_metrics(self):
+        serialize = ColumnSerializer(['name', 'manufacturer.name'], instrument=True)
+        output = serialize(Car.objects.all())
+        metrics, = self.received
+        self.assertIs(metrics.serializer, serialize)
+        self.assertEqual(metrics.rows, 2)
+        self.assertEqual(metrics.bytes, len(utf8(output)))
+        self.assertEqual(metrics.queries, 1)
+        self.assertGreater(metrics.time, 0)
+        self.assertGreaterEqual(metrics.time, metrics.iteration_time + metrics.extraction_time)
+        data = metrics.to_dict()
+        self.assertEqual(data['model'], 'testproject.car')
+        self.assertEqual(data['format'], 'csv')
+        self.assertNotIn('columns', data)
+
+    def test_full_query_log(self):
+        # The query log of a long-lived connection is full, counting its
+        # entries would always give 0.
+        serialize = ColumnSerializer(['name', 'manufacturer.name'], instrument=True,
+                                     optimize_queries=False, use_values=False)
+        with self.settings(DEBUG=True):
+            connection.queries_log.extend(
+                {'sql': 'SELECT 1', 'time': '0.000'}
+                for i in range(connection.queries_limit + 1))
+            serialize(Car.objects.all())
+            serialize(Car.objects.all())
+        self.assertEqual([metrics.queries for metrics in self.received], [3, 3])
+        self.assertNotIsInstance(connection.cursor(), CountingCursor)
+
+    def test_stream(self):
+        serialize = ColumnSerializer(['name'], instrument=True)
+        output = b''.join(serialize.stream(Car.objects.all()))
+        metrics, = self.received
+        self.assertEqual(metrics.rows, 2)
+        self.assertEqual(metrics.bytes, len(output))
+
+    def test_not_instrumented(self):
+        ColumnSerializer(['name'])(Car.objects.all())
+        self.assertEqual(self.received, [])
+
+    def test_profile_columns(self):
+        serialize = ColumnSerializer(['name', 'manufacturer.name'], instrument=True,
+                                     profile_columns=True, optimize_queries=False,
+                                     use_values=False)
+        self.assertEqual(serialize(Car.objects.all()),
+                         'Name,Manufacturer name\r\nWrangler,Jeep\r\nCherokee,Jeep\r\n')
+        metrics, = self.received
+        self.assertEqual(metrics.queries, 3)
+        columns = metrics.to_dict()['columns']
+        self.assertEqual([column['header'] for column in columns],
+                         ['Name', 'Manufacturer name'])
+        # The manufacturer is fetched for every car.
+        self.assertEqual([column['queries'] for column in columns], [0, 2])
+
+    def test_profile_values(self):
+        serialize = ColumnSerializer(['name', 'manufacturer.name'], instrument=True,
+                                     profile_columns=True)
+        self.assertEqual(serialize(Car.objects.all()),
+                         'Name,Manufacturer name\r\nWrangler,Jeep\r\nCherokee,Jeep\r\n')
+        self.assertEqual([column['queries'] for column in self.received[0].columns], [0, 0])
+
+    def test_hook(self):
+        class Client(object):
+            def __init__(self):
+                self.calls = []
+
+            def __getattr__(self, name):
+                return lambda *args: self.calls.append((name,) + args)
+
+        client = Client()
+        serialize = ColumnSerializer(['name'], instrument=True, metrics_hook=StatsdHook(client))
+        serialize(Car.objects.all())
+        self.assertIn(('incr', 'separated.export.testproject.car.rows', 2), client.calls)
+        self.assertIn(('gauge', 'separated.export.testproject.car.queries', 1), client.calls)
+        self.assertIn('separated.export.testproject.car.time',
+                      [call[1] for call in client.calls if call[0] == 'timing'])
+
+    def test_view(self):
+        self.client.get(reverse('instrumented_manufacturers'))
+        metrics, = self.received
+        self.assertEqual(metrics.rows, 1)
+        self.assertEqual(metrics.model, Manufacturer)
+
+
+class WriterTest(TestCase):
+    def setUp(self):
+        manufacturer = Manufacturer.objects.create(name='Jeep & <Co>')
+        manufacturer.car_set.create(name='Wrangler')
+        Manufacturer.objects.create(name='你好凯兰')
+        self.columns = [('name', 'Name'), ('car_set.count', 'Number of models')]
+
+    def test_tsv(self):
+        serialize = ColumnSerializer(self.columns, format='tsv')
+        self.assertEqual(serialize(Manufacturer.objects.all()),
+                         'Name\tNumber of models\r\nJeep & <Co>\t1\r\n你好凯兰\t0\r\n')
+
+    def test_jsonl(self):
+        serialize = ColumnSerializer(self.columns, format='jsonl')
+        output = serialize(Manufacturer.objects.all())
+        self.assertEqual(output.splitlines(), [
+            '{"Name":"Jeep & <Co>","Number of models":"1"}',
+            '{"Name":"你好凯兰","Number of models":"0"}',
+        ])
+        self.assertEqual(list(map(json.loads, output.splitlines()))[1]['Name'], '你好凯兰')
+
+        serialize = ColumnSerializer(self.columns, format='jsonl', output_headers=False)
+        self.assertEqual(serialize(Manufacturer.objects.all()).splitlines()[0],
+                         '["Jeep & <Co>","1"]')
+
+    def test_jsonl_stream(self):
+        serialize = ColumnSerializer(self.columns, format='jsonl')
+        self.assertEqual(list(serialize.stream(Manufacturer.objects.all())), [
+            utf8('{"Name":"Jeep & <Co>","Number of models":"1"}\n'
+                 '{"Name":"你好凯兰","Number of models":"0"}\n'),
+        ])
+
+    def assertXlsx(self, data):
+        with zipfile.ZipFile(BytesIO(data)) as f:
+            self.assertIn('[Content_Types].xml', f.namelist())
+            sheet = f.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        self.assertIn('<row r="1"><c t="inlineStr"><is><t xml:space="preserve">Name</t>', sheet)
+        self.assertIn('<t xml:space="preserve">Jeep &amp; &lt;Co&gt;</t>', sheet)
+        self.assertIn('<row r="3"><c t="inlineStr"><is><t xml:space="preserve">你好凯兰</t>',
+                      sheet)
+        self.assertTrue(sheet.endswith('</sheetData></worksheet>'))
+
+    @skipIf(sys.version_info < (3, 6), 'XLSX output requires Python 3.6 or later')
+    def test_xlsx(self):
+        serialize = ColumnSerializer(self.columns, format='xlsx')
+        output = serialize(Manufacturer.objects.all())
+        self.assertIsInstance(output, bytes)
+        self.assertXlsx(output)
+        self.assertXlsx(b''.join(serialize.stream(Manufacturer.objects.all())))
+
+    @skipIf(sys.version_info >= (3, 6), 'XLSX output works on Python 3.6 or later')
+    def test_xlsx_python_2(self):
+        with six.assertRaisesRegex(self, ImproperlyConfigured, 'Python 3.6 or later'):
+            ColumnSerializer(self.columns, format='xlsx')(Manufacturer.objects.all())
+
+    def test_unknown_format(self):
+        with self.assertRaises(ImproperlyConfigured):
+            ColumnSerializer(self.columns, format='xls')(Manufacturer.objects.all())
+
+    def test_sharded(self):
+        serialize = ShardedColumnSerializer(self.columns, format='jsonl', processes=2)
+        self.assertEqual(len(serialize.get_shards(Manufacturer.objects.all())), 2)
+        self.assertEqual(serialize(Manufacturer.objects.all()),
+                         ColumnSerializer(self.columns, format='jsonl')(
+                             Manufacturer.objects.all()))
+
+        serialize = ShardedColumnSerializer(self.columns, format='xlsx', processes=2)
+        self.assertIsNone(serialize.get_shards(Manufacturer.objects.all()))
+
+    def test_view(self):
+        response = self.client.get(reverse('multi_format_manufacturers'))
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename="manufacturer_list.csv"')
+
+        response = self.client.get(reverse('multi_format_manufacturers'), {'format': 'tsv'})
+        self.assertEqual(response['Content-Type'], 'text/tab-separated-values')
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename="manufacturer_list.tsv"')
+        self.assertTrue(response.content.startswith(b'Name\tNumber of models\r\n'))
+
+        response = self.client.get(reverse('multi_format_manufacturers_by_extension',
+                                           kwargs={'format': 'jsonl'}))
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(len(response.content.splitlines()), 2)
+
+        response = self.client.get(reverse('multi_format_manufacturers'), {'format': 'exe'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_single_format_view(self):
+        # Without formats, the format parameter is ignored.
+        response = self.client.get(reverse('manufacturers'), {'format': 'tsv'})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+
+
+@skipIf(pa is None, 'pyarrow is not installed')
+class ArrowSerializerTest(TestCase):
+    def setUp(self):
+        manufacturer = Manufacturer.objects.create(name='Jeep')
+        manufacturer.car_set.create(name='Wrangler')
+        manufacturer.car_set.create(name='Cherokee')
+        self.columns = [
+            ('pk', 'ID'),
+            ('name', 'Name'),
+            ('updated_at', 'Updated'),
+            ('manufacturer.car_set.count', 'Models'),
+            ('get_display_name', 'Display name'),
+        ]
+
+    def test_schema(self):
+        serialize = ArrowSerializer(self.columns)
+        schema = serialize.get_schema(Car.objects.all())
+        self.assertEqual(schema.names, ['ID', 'Name', 'Updated', 'Models', 'Display name'])
+        self.assertEqual(schema.types, [
+            pa.int32(), pa.string(), pa.timestamp('us'), pa.int32(), pa.string(),
+        ])
+        with override_settings(USE_TZ=True):
+            schema = serialize.get_schema(Car.objects.all())
+        self.assertEqual(schema.types[2], pa.timestamp('us', tz='UTC'))
+
+    def test_parquet(self):
+        serialize = ArrowSerializer(self.columns, batch_size=1)
+        table = pq.read_table(pa.BufferReader(serialize(Car.objects.order_by('pk'))))
+        self.assertEqual(table.num_rows, 2)
+        self.assertEqual(table.column('Name').to_pylist(), ['Wrangler', 'Cherokee'])
+        self.assertEqual(table.column('Models').to_pylist(), [2, 2])
+        self.assertEqual(table.column('Display name').to_pylist(), ['WRANGLER', 'CHEROKEE'])
+
+    def test_arrow_stream(self):
+        serialize = ArrowSerializer(self.columns, format='arrow', batch_size=1)
+        data = b''.join(serialize.stream(Car.objects.order_by('pk')))
+        reader = pa.RecordBatchFileReader(pa.BufferReader(data))
+        self.assertEqual(reader.num_record_batches, 2)
+        table = reader.read_all()
+        self.assertEqual(table.column('ID').to_pylist(),
+                         list(Car.objects.order_by('pk').values_list('pk', flat=True)))
+
+    def test_empty(self):
+        serialize = ArrowSerializer(self.columns)
+        table = pq.read_table(pa.BufferReader(serialize(Car.objects.none())))
+        self.assertEqual(table.num_rows, 0)
+        self.assertEqual(table.schema.names[0], 'ID')
+
+    def test_list(self):
+        serialize = ArrowSerializer([('name', 'Name')], format='arrow')
+        data = serialize(list(Car.objects.order_by('pk')))
+        table = pa.RecordBatchFileReader(pa.BufferReader(data)).read_all()
+        self.assertEqual(table.column('Name').to_pylist(), ['Wrangler', 'Cherokee'])
+
+    def test_write_rows(self):
+        writer = ArrowSerializer(self.columns).get_writer()
+        with self.assertRaises(ImproperlyConfigured):
+            writer.write_rows([[1, 'Wrangler']])
+
+    def test_bundle(self):
+        serialize = ArrowSerializer([('name', 'Name')])
+        bundle = ExportBundle([('cars', Car.objects.order_by('pk'), serialize)])
+        with zipfile.ZipFile(BytesIO(bundle())) as f:
+            table = pq.read_table(pa.BufferReader(f.read('cars.parquet')))
+        self.assertEqual(table.column('Name').to_pylist(), ['Wrangler', 'Cherokee'])
+
+    def test_job(self):
+        storage = FileSystemStorage(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, storage.location)
+        backend = SynchronousExportBackend()
+        backend.storage = storage
+        serialize = ArrowSerializer([('name', 'Name')], format='arrow')
+        job = backend.submit(Car.objects.order_by('pk'), serialize, 'cars.arrow')
+        job = backend.get_job(job.id)
+        self.assertEqual((job.status, job.rows), (ExportJob.DONE, 2))
+        with storage.open(job.path) as f:
+            table = pa.RecordBatchFileReader(pa.BufferReader(f.read())).read_all()
+        self.assertEqual(table.column('Name').to_pylist(), ['Wrangler', 'Cherokee'])
+
+    def test_view(self):
+        response = self.client.get(reverse('parquet_cars'))
+        self.assertEqual(response['Content-Type'], 'application/vnd.apache.parquet')
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename="car_list.parquet"')
+        table = pq.read_table(pa.BufferReader(response.content))
+        self.assertEqual(table.column('Manufacturer name').to_pylist(), ['Jeep', 'Jeep'])
+
+        response = self.client.get(reverse('arrow_cars'))
+        self.assertEqual(response['Content-Type'], 'application/vnd.apache.arrow.file')
+        table = pa.RecordBatchFileReader(pa.BufferReader(response.content)).read_all()
+        self.assertEqual(table.num_rows, 2)
+
+    def test_compressed_view(self):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+        for streaming in (False, True):
+            view = ParquetView.as_view(model=Car, columns=self.columns, compress=True,
+                                       streaming=streaming)
+            response = view(request)
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            content = b''.join(response) if streaming else response.content
+            data = gzip.GzipFile(fileobj=BytesIO(content)).read()
+            self.assertEqual(data[:4], b'PAR1')
+            self.assertEqual(pq.read_table(pa.BufferReader(data)).num_rows, 2)
+
+    def test_compressed_job(self):
+        storage = FileSystemStorage(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, storage.location)
+        backend = SynchronousExportBackend()
+        backend.storage = storage
+        serialize = ArrowSerializer([('name', 'Name')], format='arrow', compression='gzip')
+        job = backend.submit(Car.objects.order_by('pk'), serialize, 'cars.arrow.gz')
+        with storage.open(backend.get_job(job.id).path) as f:
+            data = gzip.GzipFile(fileobj=f).read()
+        table = pa.RecordBatchFileReader(pa.BufferReader(data)).read_all()
+        self.assertEqual(table.column('Name').to_pylist(), ['Wrangler', 'Cherokee'])
+
+
+class ConditionalCsvViewTest(TestCase):
+    def setUp(self):
+        caches['default'].clear()
+        manufacturer = Manufacturer.objects.create(name='Jeep')
+        self.car = manufacturer.car_set.create(name='Wrangler')
+
+    def test_validators(self):
+        response = self.client.get(reverse('cars'))
+        self.assertEqual(response.content, b"Name\r\nWrangler\r\n")
+        self.assertTrue(response['ETag'].startswith('"'))
+        self.assertEqual(response['Last-Modified'],
+                         http_date(timegm(self.car.updated_at.utctimetuple())))
+
+    def test_if_none_match(self):
+        etag = self.client.get(reverse('cars'))['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('cars'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        self.car.manufacturer.car_set.create(name='Cherokee')
+        response = self.client.get(reverse('cars'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_changes_on_delete(self):
+        other = self.car.manufacturer.car_set.create(name='Cherokee')
+        Car.objects.filter(pk=other.pk).update(updated_at=self.car.updated_at)
+        etag = self.client.get(reverse('cars'))['ETag']
+        other.delete()
+        response = self.client.get(reverse('cars'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_related_model_changes(self):
+        columns = [('name', 'Name'), ('manufacturer.name', 'Make')]
+        with self.assertRaises(ImproperlyConfigured):
+            CarView.as_view(columns=columns, cache_alias='local')(RequestFactory().get('/'))
+
+        view = CarView.as_view(columns=columns)
+        response = view(RequestFactory().get('/'))
+        self.assertFalse(response.has_header('Last-Modified'))
+        etag = response['ETag']
+        response = view(RequestFactory().get('/', HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, 304)
+
+        # The cars are untouched, only what their column reads changed.
+        manufacturer = self.car.manufacturer
+        manufacturer.name = 'Willys'
+        manufacturer.save()
+        response = view(RequestFactory().get('/', HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"Name,Make\r\nWrangler,Willys\r\n")
+
+    def test_if_modified_since(self):
+        last_modified = self.client.get(reverse('cars'))['Last-Modified']
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('cars'), HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_cached_export_etag(self):
+        etag = self.client.get(reverse('cached_manufacturers'))['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('cached_manufacturers'),
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Manufacturer.objects.create(name='Dodge')
+        response = self.client.get(reverse('cached_manufacturers'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_no_validators(self):
+        response = self.client.get(reverse('manufacturers'))
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+
+
+class ResumableExportTest(TestCase):
+    expected = b"Name\r\nCar 0\r\nCar 1\r\nCar 2\r\nCar 3\r\nCar 4\r\n"
+
+    def setUp(self):
+        caches['default'].clear()
+        manufacturer = Manufacturer.objects.create(name='Jeep')
+        for i in range(5):
+            manufacturer.car_set.create(name='Car %d' % i)
+        self.media_root = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media_root)
+
+    def get(self, **kwargs):
+        response = self.client.get(reverse('resumable_cars'), **kwargs)
+        if response.streaming:
+            response.content_bytes = b''.join(response.streaming_content)
+        return response
+
+    def get_saved_chunks(self):
+        directory, = default_storage.listdir('exports/resumable')[0]
+        return sorted(default_storage.listdir('exports/resumable/' + directory)[1])
+
+    def test_pk_ranges(self):
+        # The ranges follow the rows, not the values of the keys.
+        jeep = Manufacturer.objects.get()
+        Manufacturer.objects.create(pk=jeep.pk + 200000, name='Dodge')
+        queryset = Manufacturer.objects.all()
+        self.assertEqual(get_pk_ranges(queryset, 1),
+                         [(jeep.pk, jeep.pk), (jeep.pk + 200000, jeep.pk + 200000)])
+        with self.assertNumQueries(2):
+            self.assertEqual(get_pk_ranges(queryset, 2), [(jeep.pk, jeep.pk + 200000)])
+        with self.assertNumQueries(3):
+            self.assertEqual(get_pk_ranges(queryset, 10000), [(jeep.pk, jeep.pk + 200000)])
+        self.assertEqual(get_pk_ranges(queryset.filter(name='Dodge'), 10000),
+                         [(jeep.pk + 200000, jeep.pk + 200000)])
+        self.assertEqual(get_pk_ranges(queryset.none(), 10000), [])
+
+    def test_full_download(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response.content_bytes, self.expected)
+        # Nothing was saved yet when the response started.
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(len(self.get_saved_chunks()), 3)
+
+        # Only the validators, the ranges are cached and the rows come from
+        # the saved chunks.
+        with self.assertNumQueries(1):
+            response = self.get()
+            self.assertEqual(response.content_bytes, self.expected)
+        self.assertEqual(response['Content-Length'], str(len(self.expected)))
+
+    def test_resume(self):
+        etag = self.get()['ETag']
+        response = self.get(HTTP_RANGE='bytes=10-', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content_bytes, self.expected[10:])
+        self.assertEqual(response['Content-Range'], 'bytes 10-40/41')
+        self.assertEqual(response['Content-Length'], '31')
+
+    def test_range_only_serializes_needed_chunks(self):
+        response = self.get(HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content_bytes, self.expected[:10])
+        self.assertEqual(response['Content-Range'], 'bytes 0-9/*')
+        self.assertEqual(len(self.get_saved_chunks()), 1)
+
+        response = self.get(HTTP_RANGE='bytes=13-26')
+        self.assertEqual(response.content_bytes, self.expected[13:27])
+        self.assertEqual(len(self.get_saved_chunks()), 2)
+
+    def test_suffix_range(self):
+        response = self.get(HTTP_RANGE='bytes=-7')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content_bytes, b"Car 4\r\n")
+        self.assertEqual(response['Content-Range'], 'bytes 34-40/41')
+
+    def test_unsatisfiable_range(self):
+        response = self.get(HTTP_RANGE='bytes=41-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */41')
+
+    def test_if_range_mismatch(self):
+        response = self.get(HTTP_RANGE='bytes=10-', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_bytes, self.expected)
+
+    def test_multiple_ranges_are_ignored(self):
+        response = self.get(HTTP_RANGE='bytes=0-1,5-6')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_bytes, self.expected)
+
+    def test_new_data_gets_new_chunks(self):
+        etag = self.get()['ETag']
+        Car.objects.create(manufacturer=Manufacturer.objects.get(), name='Car 5')
+        response = self.get(HTTP_RANGE='bytes=10-', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_bytes, self.expected + b"Car 5\r\n")
+
+    def test_needs_etag(self):
+        request = RequestFactory().get('/')
+        view = CsvView.as_view(model=Car, columns=['name'], resumable=True)
+        with self.assertRaises(ImproperlyConfigured):
+            view(request)
+
+    def test_parse_range_header(self):
+        self.assertEqual(parse_range_header('bytes=0-499'), (0, 499))
+        self.assertEqual(parse_range_header('bytes=500-'), (500, None))
+        self.assertEqual(parse_range_header('bytes=-500'), (None, 500))
+        self.assertIsNone(parse_range_header('bytes=500-499'))
+        self.assertIsNone(parse_range_header('bytes=0-1,5-6'))
+        self.assertIsNone(parse_range_header('items=0-1'))
+        self.assertIsNone(parse_range_header(None))
+
+
+class DeltaExportTest(TestCase):
+    def setUp(self):
+        manufacturer = Manufacturer.objects.create(name='Jeep')
+        self.wrangler = manufacturer.car_set.create(name='Wrangler')
+        self.cherokee = manufacturer.car_set.create(name='Cherokee')
+        Car.objects.filter(pk=self.wrangler.pk).update(
+            updated_at=datetime.datetime(2016, 4, 15, 12, 0))
+        Car.objects.filter(pk=self.cherokee.pk).update(
+            updated_at=datetime.datetime(2016, 4, 16, 12, 0))
+
+    def test_get_delta(self):
+        serialize = ColumnSerializer(['name'], output_headers=False, watermark_field='pk')
+        queryset, watermark = serialize.get_delta(Car.objects.all())
+        self.assertEqual(serialize(queryset), 'Wrangler\r\nCherokee\r\n')
+        self.assertEqual(watermark, self.cherokee.pk)
+
+        compass = Car.objects.create(manufacturer=self.wrangler.manufacturer, name='Compass')
+        queryset, watermark = serialize.get_delta(Car.objects.all(), watermark)
+        self.assertEqual(serialize(queryset), 'Compass\r\n')
+        self.assertEqual(watermark, compass.pk)
+
+        queryset, new_watermark = serialize.get_delta(Car.objects.all(), str(watermark))
+        self.assertEqual(serialize(queryset), '')
+        self.assertEqual(new_watermark, compass.pk)
+
+    def test_watermark_lag(self):
+        serialize = ColumnSerializer(['name'], output_headers=False, watermark_field='updated_at',
+                                     watermark_lag=datetime.timedelta(hours=1))
+        queryset, watermark = serialize.get_delta(Car.objects.all())
+        self.assertEqual(serialize(queryset), 'Wrangler\r\nCherokee\r\n')
+        self.assertEqual(watermark, datetime.datetime(2016, 4, 16, 11, 0))
+
+        # Committed after the export, but with an older timestamp.
+        late = Car.objects.create(manufacturer=self.wrangler.manufacturer, name='Compass')
+        Car.objects.filter(pk=late.pk).update(updated_at=datetime.datetime(2016, 4, 16, 11, 30))
+        queryset, watermark = serialize.get_delta(Car.objects.all(), watermark)
+        self.assertEqual(serialize(queryset.order_by('pk')), 'Cherokee\r\nCompass\r\n')
+        # The watermark never goes back.
+        self.assertEqual(watermark, datetime.datetime(2016, 4, 16, 11, 0))
+
+    def test_watermark_must_be_a_field(self):
+        serialize = ColumnSerializer(['name'], watermark_field='get_display_name')
+        with self.assertRaises(ImproperlyConfigured):
+            serialize.get_delta(Car.objects.all())
+
+    def test_view(self):
+        response = self.client.get(reverse('delta_cars'))
+        self.assertEqual(response.content, b"Name\r\nWrangler\r\nCherokee\r\n")
+        self.assertEqual(response['X-Watermark'], '2016-04-16T12:00:00')
+
+        Car.objects.filter(pk=self.wrangler.pk).update(
+            updated_at=datetime.datetime(2016, 4, 17, 12, 0))
+        response = self.client.get(reverse('delta_cars'), {'since': response['X-Watermark']})
+        self.assertEqual(response.content, b"Name\r\nWrangler\r\n")
+        self.assertEqual(response['X-Watermark'], '2016-04-17T12:00:00')
+
+        response = self.client.get(reverse('delta_cars'), {'since': response['X-Watermark']})
+        self.assertEqual(response.content, b"Name\r\n")
+        self.assertEqual(response['X-Watermark'], '2016-04-17T12:00:00')
+
+    def test_invalid_since(self):
+        response = self.client.get(reverse('delta_cars'), {'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ColumnDeserializerTest(TestCase):
+    columns = CarAdmin.csv_export_columns
+
+    def setUp(self):
+        self.jeep = Manufacturer.objects.create(name='Jeep')
+        self.ford = Manufacturer.objects.create(name='Ford')
+        self.wrangler = self.jeep.car_set.create(name='Wrangler', body_style='suv')
+        self.focus = self.ford.car_set.create(
+            name='Focus', is_electric=True, body_style='hatchback')
+
+    def export(self):
+        return ColumnSerializer(self.columns)(Car.objects.order_by('pk'))
+
+    def test_round_trip(self):
+        exported = self.export()
+        Car.objects.all().delete()
+        result = ColumnDeserializer(self.columns)(BytesIO(utf8(exported)), Car)
+        self.assertEqual((result.rows, result.created, result.updated), (2, 2, 0))
+        self.assertEqual(self.export(), exported)
+        focus = Car.objects.get(name='Focus')
+        self.assertEqual((focus.manufacturer, focus.is_electric, focus.body_style),
+                         (self.ford, True, 'hatchback'))
+
+    def test_invalidates_every_export_cache(self):
+        exported = self.export()
+        Car.objects.all().delete()
+        aliases = ['default', 'local']
+        versions = [get_versions(caches[alias], [Car]) for alias in aliases]
+        ColumnDeserializer(self.columns)(BytesIO(utf8(exported)), Car)
+        for alias, old in zip(aliases, versions):
+            self.assertNotEqual(get_versions(caches[alias], [Car]), old)
+
+    def test_upsert(self):
+        data = (
+            'Pk,Name,Manufacturer name,Is electric,Body style\r\n'
+            '%d,Wrangler Unlimited,Jeep,No,SUV\r\n'
+            ',Mustang,Ford,No,Sedan\r\n'
+            ',Mach-E,Ford,Yes,SUV\r\n'
+        ) % self.wrangler.pk
+        deserialize = ColumnDeserializer(self.columns, key_fields=['pk'])
+        result = deserialize(BytesIO(utf8(data)), Car)
+        self.assertEqual((result.rows, result.created, result.updated), (3, 2, 1))
+        self.assertEqual(Car.objects.get(pk=self.wrangler.pk).name, 'Wrangler Unlimited')
+        self.assertEqual(Car.objects.get(name='Mach-E').is_electric, True)
+        self.assertEqual(Car.objects.count(), 4)
+
+    def test_natural_key(self):
+        data = 'Name,Manufacturer name,Body style\r\nFocus,Jeep,Sedan\r\nRanger,Ford,Sedan\r\n'
+        deserialize = ColumnDeserializer(self.columns, key_fields=['name'])
+        result = deserialize(BytesIO(utf8(data)), Car)
+        self.assertEqual((result.created, result.updated), (1, 1))
+        focus = Car.objects.get(pk=self.focus.pk)
+        self.assertEqual((focus.manufacturer, focus.body_style), (self.jeep, 'sedan'))
+        # Columns that aren't in the file aren't touched.
+        self.assertTrue(focus.is_electric)
+        self.assertGreater(focus.updated_at, self.focus.updated_at)
+
+    def test_missing_required_column(self):
+        data = 'Name,Manufacturer\r\nMustang,Ford\r\n'
+        with self.assertRaises(ValidationError) as cm:
+            ColumnDeserializer(self.columns)(BytesIO(utf8(data)), Car)
+        self.assertIn('manufacturer', cm.exception.messages[0])
+        self.assertEqual(Car.objects.count(), 2)
+
+        # Existing rows can still be updated, new ones are reported.
+        data = 'Pk,Name\r\n%d,Wrangler Unlimited\r\n,Mustang\r\n' % self.wrangler.pk
+        deserialize = ColumnDeserializer(self.columns, key_fields=['pk'], skip_errors=True)
+        result = deserialize(BytesIO(utf8(data)), Car)
+        self.assertEqual((result.created, result.updated, result.skipped), (0, 1, 1))
+        self.assertEqual(result.errors[0][0], 3)
+        self.assertEqual(Car.objects.get(pk=self.wrangler.pk).name, 'Wrangler Unlimited')
+
+    def test_integrity_error(self):
+        data = 'Pk,Name,Manufacturer name\r\n,Mustang,Ford\r\n%d,Dup,Jeep\r\n' % (
+            self.wrangler.pk)
+        with self.assertRaises(ValidationError):
+            ColumnDeserializer(self.columns)(BytesIO(utf8(data)), Car)
+        self.assertEqual(Car.objects.count(), 2)
+
+        data += ',Mach-E,Ford\r\n'
+        deserialize = ColumnDeserializer(self.columns, batch_size=2, skip_errors=True)
+        result = deserialize(BytesIO(utf8(data)), Car)
+        # The whole first batch is rolled back.
+        self.assertEqual((result.created, result.skipped), (1, 2))
+        self.assertEqual([line for line, message in result.errors], [2, 3])
+        self.assertEqual(Car.objects.filter(name__in=['Mustang', 'Dup']).count(), 0)
+        self.assertTrue(Car.objects.filter(name='Mach-E').exists())
+
+    def test_update_existing(self):
+        data = 'Name,Manufacturer name\r\nFocus,Jeep\r\n'
+        deserialize = ColumnDeserializer(self.columns, key_fields=['name'], update_existing=False)
+        result = deserialize(BytesIO(utf8(data)), Car)
+        self.assertEqual((result.created, result.updated, result.skipped), (0, 0, 1))
+        self.assertEqual(Car.objects.get(pk=self.focus.pk).manufacturer, self.ford)
+
+    def test_batches(self):
+        data = 'Name,Manufacturer name\r\n' + ''.join(
+            'Car %d,Jeep\r\n' % i for i in range(5))
+        deserialize = ColumnDeserializer(self.columns, batch_size=2)
+        # One manufacturer lookup, and an INSERT inside of a savepoint for each
+        # of the 3 batches.
+        with self.assertNumQueries(10):
+            result = deserialize(BytesIO(utf8(data)), Car)
+        self.assertEqual(result.created, 5)
+
+    def test_invalid_rows(self):
+        data = (
+            'Name,Manufacturer name,Is electric\r\n'
+            'Mustang,Ford,Maybe\r\n'
+            'Model T,Tesla,No\r\n'
+            'Bronco,Ford,Yes\r\n'
+        )
+        with self.assertRaises(ValidationError) as cm:
+            ColumnDeserializer(self.columns)(BytesIO(utf8(data)), Car)
+        self.assertEqual(len(cm.exception.messages), 2)
+        self.assertTrue(cm.exception.messages[0].startswith('Line 2: is_electric:'))
+        self.assertFalse(Car.objects.filter(name='Bronco').exists())
+
+        result = ColumnDeserializer(self.columns, skip_errors=True)(BytesIO(utf8(data)), Car)
+        self.assertEqual((result.created, result.skipped), (1, 2))
+        self.assertEqual([line for line, message in result.errors], [2, 3])
+        self.assertIn("No manufacturer with name 'Tesla'", result.errors[1][1])
+        self.assertTrue(Car.objects.filter(name='Bronco').exists())
+
+    def test_text_file_with_bom(self):
+        data = '\ufeffName,Manufacturer name\r\nMustang,Ford\r\n'
+        result = ColumnDeserializer(self.columns)(six.StringIO(data), Car)
+        self.assertEqual(result.created, 1)
+        result = ColumnDeserializer(self.columns)(BytesIO(utf8(data)), Car)
+        self.assertEqual(result.created, 1)
+
+    def test_without_headers(self):
+        data = ',Mustang,Ford,No,Sedan\r\n'
+        deserialize = ColumnDeserializer(self.columns, output_headers=False)
+        self.assertEqual(deserialize(BytesIO(utf8(data)), Car).created, 1)
+
+    def test_header_must_match(self):
+        with self.assertRaises(ValidationError):
+            ColumnDeserializer(self.columns)(BytesIO(b'Foo,Bar\r\n1,2\r\n'), Car)
+
+    def test_bulk_update(self):
+        self.wrangler.name = 'Gladiator'
+        self.focus.name = 'Fiesta'
+        bulk_update(Car.objects.all(), [self.wrangler, self.focus], ['name'])
+        self.assertEqual(sorted(Car.objects.values_list('name', flat=True)),
+                         ['Fiesta', 'Gladiator'])
+
+
+class CsvImportAdminTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.jeep = Manufacturer.objects.create(name='Jeep')
+        self.admin = site._registry[Car]
+        self.factory = RequestFactory()
+
+    def request(self, method='get', **kwargs):
+        request = getattr(self.factory, method)('/', **kwargs)
+        request.user = self.user
+        request._messages = CookieStorage(request)
+        return request
+
+    def test_form(self):
+        response = self.admin.import_csv_view(self.request())
+        response.render()
+        self.assertContains(response, 'enctype="multipart/form-data"')
+
+    def test_import(self):
+        upload = BytesIO(b'Name,Manufacturer name\r\nWrangler,Jeep\r\n')
+        upload.name = 'cars.csv'
+        request = self.request('post', data={'file': upload})
+        response = self.admin.import_csv_view(request)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], '/admin/testproject/car/')
+        self.assertEqual(Car.objects.get().name, 'Wrangler')
+        message, = list(request._messages)
+        self.assertIn('1 created', message.message)
+
+    def test_import_errors(self):
+        upload = BytesIO(b'Name,Manufacturer name\r\nWrangler,Jeep\r\nModel T,Tesla\r\n')
+        upload.name = 'cars.csv'
+        request = self.request('post', data={'file': upload})
+        self.admin.import_csv_view(request)
+        summary, error = list(request._messages)
+        self.assertIn('1 skipped', summary.message)
+        self.assertEqual(error.level, messages.WARNING)
+        self.assertTrue(error.message.startswith('Line 3:'))
+
+    def test_import_database_errors(self):
+        car = self.jeep.car_set.create(name='Wrangler')
+        upload = BytesIO(utf8('Name,Manufacturer\r\nCherokee,Jeep\r\n'))
+        upload.name = 'cars.csv'
+        request = self.request('post', data={'file': upload})
+        self.assertEqual(self.admin.import_csv_view(request).status_code, 302)
+        summary, error = list(request._messages)
+        self.assertIn('manufacturer', error.message)
+
+        admin = CarAdmin(Car, site)
+        admin.csv_import_key_fields = None
+        upload = BytesIO(utf8('Pk,Name,Manufacturer name\r\n%d,Dup,Jeep\r\n' % car.pk))
+        upload.name = 'cars.csv'
+        request = self.request('post', data={'file': upload})
+        self.assertEqual(admin.import_csv_view(request).status_code, 302)
+        summary, error = list(request._messages)
+        self.assertIn('1 skipped', summary.message)
+
+    def test_permission(self):
+        request = self.request()
+        request.user = User.objects.create_user('staff', 'staff@example.com', 'password')
+        with self.assertRaises(PermissionDenied):
+            self.admin.import_csv_view(request)
+
 
 class CsvExportAdminTest(TestCase):
     def setUp(self):
@@ -218,7 +1990,7 @@ class CsvExportAdminTest(TestCase):
         response = admin.export_csv_action(request, queryset)
         self.assertEqual(response.status_code, 200)
         expected = utf8("Name,Number of models\r\nManufacturer A,0\r\nManufacturer B,0\r\n")
-        self.assertEqual(response.content, expected)
+        self.assertEqual(b''.join(response.streaming_content), expected)
 
     def test_csv_export_view_class(self):
         admin = OverrideExportViewAdmin(Manufacturer, 'testproject')
@@ -226,8 +1998,14 @@ class CsvExportAdminTest(TestCase):
         queryset = Manufacturer.objects.all()
         response = admin.export_csv_action(request, queryset)
         expected = utf8("0,Manufacturer A\r\n0,Manufacturer B\r\n")
+        # The view's own settings aren't overridden.
+        self.assertFalse(response.streaming)
         self.assertEqual(response.content, expected)
 
+        admin.csv_export_streaming = True
+        response = admin.export_csv_action(request, queryset)
+        self.assertEqual(b''.join(response.streaming_content), expected)
+
     def test_csv_export_columns_overrides_views_columns(self):
         admin = ExportColumnsAndExportViewAdmin(Manufacturer, 'testproject')
         request = self.factory.post('/')
@@ -242,3 +2020,123 @@ class CsvExportAdminTest(TestCase):
         queryset = Manufacturer.objects.all()
         with self.assertRaises(ImproperlyConfigured):
             admin.export_csv_action(request, queryset)
+
+    def test_select_across_is_streamed_in_chunks(self):
+        admin = OverrideExportColumnsAdmin(Manufacturer, 'testproject')
+        admin.csv_export_chunk_size = 1
+        request = self.factory.post('/')
+        # What the changelist passes when all of the rows are selected.
+        queryset = Manufacturer.objects.filter(name__startswith='Manufacturer').order_by('-pk')
+        response = admin.export_csv_action(request, queryset)
+        self.assertTrue(response.streaming)
+        with self.assertNumQueries(3):
+            content = b''.join(response.streaming_content)
+        expected = utf8("Name,Number of models\r\nManufacturer B,0\r\nManufacturer A,0\r\n")
+        self.assertEqual(content, expected)
+
+    def test_max_rows(self):
+        admin = OverrideExportColumnsAdmin(Manufacturer, 'testproject')
+        admin.csv_export_max_rows = 1
+        request = self.factory.post('/')
+        request._messages = CookieStorage(request)
+        response = admin.export_csv_action(request, Manufacturer.objects.all())
+        self.assertIsNone(response)
+        message, = list(request._messages)
+        self.assertEqual(message.level, messages.ERROR)
+        self.assertIn('Cannot export 2 rows, the limit is 1.', message.message)
+
+        queryset = Manufacturer.objects.filter(name='Manufacturer A')
+        response = admin.export_csv_action(request, queryset)
+        self.assertEqual(response.status_code, 200)
+
+
+class CsvExportJobTest(TestCase):
+    def setUp(self):
+        Manufacturer.objects.create(name='Manufacturer A')
+        Manufacturer.objects.create(name='Manufacturer B')
+        self.user = User.objects.create_user('admin', 'admin@example.com', 'password')
+        self.factory = RequestFactory()
+        self.admin = site._registry[Manufacturer]
+        self.media_root = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.media_root, MEDIA_URL='/media/')
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media_root)
+
+    def request(self, method='post', path='/', **kwargs):
+        request = getattr(self.factory, method)(path, **kwargs)
+        request.user = self.user
+        request._messages = CookieStorage(request)
+        return request
+
+    def test_export_runs_in_background(self):
+        request = self.request()
+        response = self.admin.export_csv_action(request, Manufacturer.objects.all())
+        # Goes back to the changelist.
+        self.assertIsNone(response)
+        message, = list(request._messages)
+        job_id = re.search(r'/admin/testproject/manufacturer/export-csv/(\w+)/',
+                           message.message).group(1)
+
+        job = self.admin.get_csv_export_backend(request).get_job(job_id)
+        self.assertEqual(job.status, ExportJob.DONE)
+        with default_storage.open(job.path) as f:
+            expected = b"Name,Number of models\r\nManufacturer A,0\r\nManufacturer B,0\r\n"
+            self.assertEqual(f.read(), expected)
+
+    def test_over_max_rows_runs_in_background(self):
+        admin = AsyncExportAdmin(Manufacturer, site)
+        admin.csv_export_async = False
+        admin.csv_export_max_rows = 1
+        admin.csv_export_async_over_max_rows = True
+        request = self.request()
+        self.assertIsNone(admin.export_csv_action(request, Manufacturer.objects.all()))
+        message, = list(request._messages)
+        self.assertIn('The export has been started.', message.message)
+
+    def test_job_status(self):
+        backend = self.admin.get_csv_export_backend(None)
+        job = backend.submit(Manufacturer.objects.all(), ColumnSerializer(['name']),
+                             'export.csv', user=self.user)
+        response = self.admin.export_csv_job_view(self.request('get'), job.id)
+        status = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(status['status'], ExportJob.DONE)
+        self.assertEqual(status['rows'], 2)
+        self.assertEqual(status['total'], 2)
+        self.assertTrue(status['url'].startswith('/media/exports/'))
+
+        response = self.admin.export_csv_job_view(self.request('get', data={'download': ''}),
+                                                  job.id)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], status['url'])
+
+    def test_job_belongs_to_user(self):
+        backend = self.admin.get_csv_export_backend(None)
+        job = backend.submit(Manufacturer.objects.all(), ColumnSerializer(['name']),
+                             'export.csv')
+        with self.assertRaises(Http404):
+            self.admin.export_csv_job_view(self.request('get'), job.id)
+
+    def test_thread_pool(self):
+        backend = ThreadPoolExportBackend()
+        result = backend.enqueue(lambda x: x + 1, 1)
+        self.assertEqual(result.get(timeout=5), 2)
+
+    def test_needs_shared_cache(self):
+        backend = ThreadPoolExportBackend()
+        backend.cache_alias = 'local'
+        with self.assertRaises(ImproperlyConfigured):
+            backend.submit(Manufacturer.objects.all(), ColumnSerializer(['name']), 'export.csv')
+        with self.assertRaises(NotImplementedError):
+            ExportBackend().enqueue(len, [])
+
+    def test_missing_job(self):
+        backend = self.admin.get_csv_export_backend(None)
+        # The job expired or was evicted before the worker got to it.
+        self.assertIsNone(backend.run('missing', Manufacturer.objects.all(),
+                                      ColumnSerializer(['name'])))
+        self.assertIsNone(backend.get_job('missing'))
+        with self.assertRaises(Http404):
+            self.admin.export_csv_job_view(self.request('get'), 'missing')
@@ -1,9 +1,22 @@
+import datetime
 from functools import partial
 from io import BytesIO
-from operator import attrgetter
+from itertools import islice
+from operator import attrgetter, itemgetter
+from timeit import default_timer
 
-import unicodecsv as csv
-from django.core.exceptions import ImproperlyConfigured
+import django
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db.models import Count, IntegerField, Max
+from django.db.models.query import QuerySet
+from django.utils import formats, six, timezone
+
+from .compression import CompressedFile, compress_chunks
+from .formatters import FIELD_FORMATTERS
+from .lru import LRUCache
+from .metrics import ExportMetrics
+from .writers import WRITERS
 
 
 try:
@@ -12,23 +25,293 @@ except ImportError:  # Django < 1.4
     from django.utils.encoding import force_unicode as force_text
 
 
+# The ColumnPlans for the columns of every serializer in the process, keyed
+# on the model and the paths of the columns.
+plan_cache = LRUCache(1024)
+
+# The code of the row getters, keyed on their source.
+code_cache = LRUCache(256)
+
+
 def get_pretty_name(accessor):
     return accessor.replace('_', ' ') \
         .replace('.', ' ') \
         .capitalize()
 
 
-def Getter(accessor, normalizer=lambda x: x):
+def get_pk_ordering(queryset):
+    """
+    Returns 'pk' if the rows of the queryset come back in primary key order,
+    or in no particular order at all, '-pk' if they come back in reverse
+    primary key order (like on an admin changelist), and None otherwise.
+    """
+    query = queryset.query
+    if query.extra_order_by:
+        return None
+    if query.order_by:
+        ordering = query.order_by
+    elif query.default_ordering:
+        ordering = queryset.model._meta.ordering
+    else:
+        ordering = ()
+    if not ordering:
+        return 'pk'
+    if len(ordering) > 1 or not isinstance(ordering[0], six.string_types):
+        return None
+    pk = queryset.model._meta.pk
+    names = ('pk', pk.name, pk.attname)
+    if ordering[0] in names:
+        return 'pk'
+    if ordering[0].startswith('-') and ordering[0][1:] in names:
+        return '-pk'
+    return None
+
+
+def is_ordered_by_pk(queryset):
+    """
+    Returns True if the rows of the queryset come back in primary key order,
+    or if they have no particular order at all.
+    """
+    return get_pk_ordering(queryset) == 'pk'
+
+
+INTEGER_FIELD_TYPES = (
+    'AutoField', 'BigAutoField', 'IntegerField', 'BigIntegerField',
+    'PositiveIntegerField', 'SmallIntegerField', 'PositiveSmallIntegerField',
+)
+
+
+def can_split_by_pk(queryset):
+    """
+    Returns True if the queryset can be split into ranges of integer primary
+    keys that, put back together, give the same rows in the same order.
+    """
+    if not isinstance(queryset, QuerySet) or queryset._result_cache is not None:
+        return False
+    query = queryset.query
+    if query.low_mark or query.high_mark is not None or not is_ordered_by_pk(queryset):
+        return False
+    return queryset.model._meta.pk.get_internal_type() in INTEGER_FIELD_TYPES
+
+
+def has_multivalued_joins(queryset):
+    """
+    Returns True if the queryset joins a to-many relation (like a filter on
+    car__name), which can return the same row more than once.
+    """
+    query = queryset.query
+    if (query.distinct and not query.distinct_fields) or query.group_by is not None:
+        # Querysets of models that are annotated with aggregates are grouped
+        # by the primary key.
+        return False
+    for join in query.alias_map.values():
+        field = getattr(join, 'join_field', None)
+        if getattr(field, 'one_to_many', False) or getattr(field, 'many_to_many', False):
+            return True
+    return False
+
+
+def get_relations(opts):
+    """
+    Returns a dict that maps attribute names to the relation fields of a
+    model, including the accessors for reverse relations (like car_set).
+    """
+    relations = {}
+    for field in opts.get_fields():
+        if not field.is_relation:
+            continue
+        if field.auto_created and not field.concrete:
+            relations[field.get_accessor_name()] = field
+        else:
+            relations[field.name] = field
+    return relations
+
+
+def get_related_lookups(model, path):
+    """
+    Works out which relations have to be loaded to follow a dotted attribute
+    path on an instance of model.  Returns a 2-tuple of (select_related lookup,
+    prefetch_related lookup), either of which may be None.
+    """
+    selected = []
+    opts = model._meta
+    for name in path.split('.'):
+        field = get_relations(opts).get(name)
+        if field is None:
+            break
+        if not (field.concrete and (field.many_to_one or field.one_to_one)):
+            # Anything that isn't a forward foreign key can't be joined, it
+            # has to be prefetched.  We don't try to follow the path any
+            # further than that.
+            return '__'.join(selected) or None, '__'.join(selected + [name])
+        selected.append(name)
+        opts = field.related_model._meta
+    return '__'.join(selected) or None, None
+
+
+def get_path_field(model, path):
+    """
+    Returns the concrete field at the end of a dotted attribute path, either on
+    the model itself or on a model reached through forward foreign keys.
+    Returns None for anything else.
+    """
+    names = path.split('.')
+    opts = model._meta
+    for name in names[:-1]:
+        field = get_relations(opts).get(name)
+        if field is None or not (field.concrete and (field.many_to_one or field.one_to_one)):
+            return None
+        opts = field.related_model._meta
+    try:
+        field = opts.pk if names[-1] == 'pk' else opts.get_field(names[-1])
+    except FieldDoesNotExist:
+        return None
+    if not field.concrete or field.is_relation:
+        return None
+    return field
+
+
+def get_field_lookup(model, path):
+    """
+    Translates a dotted attribute path into a queryset lookup (like
+    'manufacturer__name') if get_path_field can resolve it.
+    """
+    if get_path_field(model, path) is None:
+        return None
+    return path.replace('.', '__')
+
+
+def get_count_lookup(model, path):
+    """
+    If a dotted attribute path counts the objects in a to-many relation (like
+    'car_set.count' or 'manufacturer.car_set.count'), returns the lookup that
+    the count can be aggregated over (like 'car').  Returns None otherwise.
+    """
+    names = path.split('.')
+    if len(names) < 2 or names[-1] != 'count':
+        return None
+    lookups = []
+    opts = model._meta
+    for name in names[:-2]:
+        field = get_relations(opts).get(name)
+        if field is None or not (field.concrete and (field.many_to_one or field.one_to_one)):
+            return None
+        lookups.append(field.name)
+        opts = field.related_model._meta
+    field = get_relations(opts).get(names[-2])
+    if field is None or not (field.one_to_many or field.many_to_many):
+        return None
+    lookups.append(field.name)
+    return '__'.join(lookups)
+
+
+class ColumnPlan(object):
+    """
+    How the dotted path of a column resolves on a model: the field it reads
+    (and its queryset lookup), the relation it counts, if any, and the
+    relations that have to be loaded to follow it.  If the column has no
+    value_normalizer (because its accessor is a plain callable), the path
+    is never read straight from the database, so there is no field and
+    nothing to count.
+    """
+    def __init__(self, model, path, has_normalizer=True):
+        self.path = path
+        self.field = None
+        self.lookup = None
+        self.count_lookup = None
+        self.related_lookups = (None, None)
+        if not path:
+            return
+        self.related_lookups = get_related_lookups(model, path)
+        if not has_normalizer:
+            return
+        self.field = get_path_field(model, path)
+        if self.field is not None:
+            self.lookup = path.replace('.', '__')
+        self.count_lookup = get_count_lookup(model, path)
+
+
+def identity(value):
+    return value
+
+
+def compose(outer, inner):
+    def composed(value):
+        return outer(inner(value))
+    return composed
+
+
+def compile_row_getter(cells, unpack=False):
+    """
+    Builds a single function that turns an object into a row.  cells is a
+    list of (path, getter, may_be_callable, normalizer, to_text) tuples, one
+    for each column.  If path is not None, the value is read with attrgetter,
+    otherwise getter is called with the object.  If unpack is True, the
+    function takes a tuple of the values instead of an object.
+
+    All of the attribute paths are fetched with one attrgetter call, and the
+    callable check and normalizer call are only emitted for the columns that
+    need them.
+    """
+    namespace = {'callable': callable}
+    names = ['v%d' % i for i in range(len(cells))]
+    lines = []
+
+    if unpack:
+        lines.append('%s, = obj' % ', '.join(names))
+    else:
+        paths = [(i, cell[0]) for i, cell in enumerate(cells) if cell[0] is not None]
+        if paths:
+            namespace['fetch'] = attrgetter(*[path for i, path in paths])
+            targets = ', '.join(names[i] for i, path in paths)
+            if len(paths) > 1:
+                # attrgetter returns a tuple when it has more than one path.
+                targets += ','
+            lines.append('%s = fetch(obj)' % targets)
+        for i, cell in enumerate(cells):
+            if cell[0] is None:
+                namespace['get%d' % i] = cell[1]
+                lines.append('%s = get%d(obj)' % (names[i], i))
+
+    values = []
+    for i, (path, getter, may_be_callable, normalizer, to_text) in enumerate(cells):
+        value = names[i]
+        if may_be_callable:
+            # handle things like get_absolute_url
+            lines.append('if callable({0}): {0} = {0}()'.format(value))
+        if normalizer is not identity:
+            namespace['normalize%d' % i] = normalizer
+            value = 'normalize%d(%s)' % (i, value)
+        namespace['text%d' % i] = to_text
+        values.append('text%d(%s)' % (i, value))
+    lines.append('return [%s]' % ', '.join(values))
+
+    source = 'def row(obj):\n' + ''.join('    %s\n' % line for line in lines)
+    code = code_cache.get_or_set(source, lambda: compile(source, '<row getter>', 'exec'))
+    exec(code, namespace)
+    return namespace['row']
+
+
+def Getter(accessor, normalizer=identity):
     """
     Returns a function that will access an attribute off of an object.  If that
     attribute is callable, it will call it.  Accepts a normalizer to call on
     the value at the end.
     """
+    original_accessor = accessor
     if not callable(accessor):
         short_description = get_pretty_name(accessor)
+        path = accessor
+        value_normalizer = normalizer
         accessor = attrgetter(accessor)
     else:
         short_description = getattr(accessor, 'short_description', None)
+        path = getattr(accessor, 'path', None)
+        # If we are wrapping a Getter, its normalizer has to run first.  Plain
+        # callables don't have one, they always need a model instance.
+        value_normalizer = getattr(accessor, 'value_normalizer', None)
+        if value_normalizer is not None and normalizer is not identity:
+            value_normalizer = compose(normalizer, value_normalizer)
 
     def getter(obj):
         ret = accessor(obj)
@@ -39,6 +322,86 @@ def Getter(accessor, normalizer=lambda x: x):
 
     if short_description:
         getter.short_description = short_description
+    # ColumnSerializer uses the dotted path to plan the queries.  If the path
+    # turns out to be a plain field, it can read the value straight from the
+    # database and pass it to the value_normalizer.
+    getter.path = path
+    getter.value_normalizer = value_normalizer
+    # What the Getter wraps, so that cached exports can tell Getters apart.
+    getter.accessor = original_accessor
+    getter.normalizer = normalizer
+
+    return getter
+
+
+class Memo(object):
+    """
+    The values of the memoized columns of one export, a dict for every column
+    that maps the primary keys of the related objects to their values.  Only
+    the thread that runs the export uses it, so there is no lock.  When a
+    column has maxsize values, they are all forgotten at once.  hits and
+    misses count the lookups, to show whether memoizing pays off.
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.columns = []
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return sum(len(values) for values in self.columns)
+
+    def add_column(self):
+        values = {}
+        self.columns.append(values)
+        return values
+
+
+def memoize_path(model, path, memo):
+    """
+    If path reads a method or property of an object that is reached through
+    forward foreign keys (like 'manufacturer.get_absolute_url'), returns a
+    function that gets the value off of an instance of model, calling it if
+    it is callable, and remembers it in memo (a Memo).  The value is keyed on
+    the related object's primary key, so it is only computed once for every
+    related object.  Returns None for any other path.
+    """
+    prefix, _, name = path.rpartition('.')
+    if not prefix or get_path_field(model, path) is not None:
+        return None
+    selected, prefetched = get_related_lookups(model, prefix)
+    if prefetched is not None or selected != prefix.replace('.', '__'):
+        return None
+    related_model = model
+    for part in prefix.split('.'):
+        related_model = get_relations(related_model._meta)[part].related_model
+    pk_name = related_model._meta.pk.attname
+    get_related = attrgetter(prefix)
+    get_value = attrgetter(name)
+    values = memo.add_column()
+    maxsize = memo.maxsize
+
+    def getter(obj):
+        related = get_related(obj)
+        # Unsaved objects (and None) can't be told apart.
+        pk = getattr(related, pk_name, None)
+        if pk is not None:
+            try:
+                value = values[pk]
+            except KeyError:
+                pass
+            else:
+                memo.hits += 1
+                return value
+        value = get_value(related)
+        if callable(value):
+            value = value()
+        if pk is not None:
+            memo.misses += 1
+            if len(values) >= maxsize:
+                values.clear()
+            values[pk] = value
+        return value
 
     return getter
 
@@ -60,33 +423,454 @@ def DisplayGetter(accessor, *args, **kwargs):
     return getter
 
 
+class Echo(object):
+    """
+    A file-like object that just hands back whatever is written to it.  This
+    lets a csv writer encode a single row at a time.
+    """
+    def write(self, value):
+        return value
+
+
 class ColumnSerializer(object):
     output_headers = True
+    chunk_size = None
+    # The chunk_size for stream when chunk_size isn't set, so that streamed
+    # exports never fill the queryset's result cache.
+    stream_chunk_size = 2000
+    optimize_queries = True
+    use_values = True
+    localize = False
+    locale = None
+    date_format = None
+    datetime_format = None
+    time_format = None
+    field_formatters = FIELD_FORMATTERS
+    compression = None
+    format = 'csv'
+    writers = WRITERS
+    batch_size = 1000
+    buffer_size = 64 * 1024
+    instrument = False
+    profile_columns = False
+    metrics_hook = None
+    watermark_field = None
+    watermark_lag = None
+    memoize = False
+    memoize_size = 1024
 
     def __init__(self, columns, **kwargs):
         self.output_headers = kwargs.get('output_headers', self.output_headers)
+        self.chunk_size = kwargs.get('chunk_size', self.chunk_size)
+        self.stream_chunk_size = kwargs.get('stream_chunk_size', self.stream_chunk_size)
+        self.optimize_queries = kwargs.get('optimize_queries', self.optimize_queries)
+        self.use_values = kwargs.get('use_values', self.use_values)
+        self.localize = kwargs.get('localize', self.localize)
+        self.locale = kwargs.get('locale', self.locale)
+        self.date_format = kwargs.get('date_format', self.date_format)
+        self.datetime_format = kwargs.get('datetime_format', self.datetime_format)
+        self.time_format = kwargs.get('time_format', self.time_format)
+        self.compression = kwargs.get('compression', self.compression)
+        self.format = kwargs.get('format', self.format)
+        self.batch_size = kwargs.get('batch_size', self.batch_size)
+        self.buffer_size = kwargs.get('buffer_size', self.buffer_size)
+        self.instrument = kwargs.get('instrument', self.instrument)
+        self.profile_columns = kwargs.get('profile_columns', self.profile_columns)
+        self.metrics_hook = kwargs.get('metrics_hook', self.metrics_hook)
+        self.watermark_field = kwargs.get('watermark_field', self.watermark_field)
+        self.watermark_lag = kwargs.get('watermark_lag', self.watermark_lag)
+        self.memoize = kwargs.get('memoize', self.memoize)
+        self.memoize_size = kwargs.get('memoize_size', self.memoize_size)
         self.normalized_columns = list(map(self._normalize_column, columns))
 
     def __call__(self, queryset, file=None):
         """
-        Serializes a queryset to CSV. If you pass in a file, it will write to
-        that file, otherwise, it will just return a string.
+        Serializes a queryset to CSV (or whichever format is set). If you pass
+        in a file, it will write to that file, otherwise, it will just return
+        a string (or bytes, if compression is set or the format is binary).
         """
+        output = BytesIO() if file is None else file
+        if self.compression:
+            output = CompressedFile(output, self.compression)
+
+        metrics = self.start_metrics(queryset)
+        try:
+            writer = self.write(self.get_rows(queryset, metrics), output, metrics)
+            if self.compression:
+                output.finish()
+                output = output.file
+        finally:
+            self.finish_metrics(metrics)
+
         if file is None:
-            output = BytesIO()
-            writer = csv.writer(output)
+            if self.compression or writer.binary:
+                return output.getvalue()
+            return output.getvalue().decode('utf-8')
+
+    def get_writer_class(self):
+        try:
+            return self.writers[self.format]
+        except KeyError:
+            raise ImproperlyConfigured('Unknown format: %r' % (self.format,))
+
+    def get_writer(self):
+        """
+        Returns a new writer for the format.
+        """
+        return self.get_writer_class()(self)
+
+    def write(self, rows, file, metrics=None):
+        """
+        Writes the headers and the rows to file, and returns the writer.
+        """
+        writer = self.get_writer()
+        header_row = self.get_header_row() if self.output_headers else None
+        self.write_rows(writer, rows, file, writer.start(header_row), metrics)
+        data = writer.finish()
+        if data:
+            file.write(data)
+            if metrics is not None:
+                metrics.bytes += len(data)
+        return writer
+
+    def write_rows(self, writer, rows, file, data=b'', metrics=None):
+        """
+        Writes rows to file, a buffer (see buffer_rows) at a time, after data.
+        """
+        timer = default_timer
+        for chunk in self.buffer_rows(writer, rows, data, metrics):
+            started = timer()
+            file.write(chunk)
+            if metrics is not None:
+                metrics.writing_time += timer() - started
+
+    def buffer_rows(self, writer, rows, data=b'', metrics=None):
+        """
+        Yields the encoded rows, after data.  The rows are encoded batch_size
+        at a time, and yielded once there are buffer_size bytes of them, so
+        a file or a response gets a few big writes instead of one per row.
+        """
+        timer = default_timer
+        chunks = [data]
+        size = len(data)
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+            started = timer()
+            data = writer.write_rows(batch)
+            if metrics is not None:
+                metrics.writing_time += timer() - started
+            chunks.append(data)
+            size += len(data)
+            if size >= self.buffer_size:
+                if metrics is not None:
+                    metrics.bytes += size
+                yield b''.join(chunks)
+                chunks = []
+                size = 0
+        if size:
+            if metrics is not None:
+                metrics.bytes += size
+            yield b''.join(chunks)
+
+    def stream(self, queryset):
+        """
+        Serializes a queryset to CSV lazily.  Returns a generator that yields
+        the encoded CSV buffer_size bytes at a time, which is suitable for
+        passing to a StreamingHttpResponse.  If compression is set, the
+        chunks are compressed as they go.
+        """
+        chunks = self._stream(queryset)
+        if self.compression:
+            chunks = compress_chunks(chunks, self.compression)
+        return chunks
+
+    def _stream(self, queryset):
+        metrics = self.start_metrics(queryset)
+        try:
+            writer = self.get_writer()
+            header = writer.start(self.get_header_row() if self.output_headers else None)
+            rows = self.get_rows(queryset, metrics,
+                                 chunk_size=self.chunk_size or self.stream_chunk_size)
+            for chunk in self.buffer_rows(writer, rows, header, metrics):
+                yield chunk
+
+            chunk = writer.finish()
+            if metrics is not None:
+                metrics.bytes += len(chunk)
+            if chunk:
+                yield chunk
+        finally:
+            self.finish_metrics(metrics)
+
+    def start_metrics(self, queryset):
+        """
+        Returns a running ExportMetrics for an export of queryset, or None if
+        the serializer isn't instrumented.
+        """
+        if not self.instrument:
+            return None
+        metrics = ExportMetrics(self, queryset, profile_columns=self.profile_columns)
+        metrics.start()
+        return metrics
+
+    def finish_metrics(self, metrics):
+        if metrics is not None:
+            metrics.stop()
+            metrics.send()
+
+    def get_delta(self, queryset, since=None):
+        """
+        Returns a 2-tuple of the rows of the queryset whose watermark_field is
+        greater than since, and the new watermark to pass as since next time.
+        The rows are limited to the watermark, so that rows that change while
+        they are being exported are picked up by the next delta instead of
+        being missed.  since can be a string, like the one format_watermark
+        returns.  If nothing changed, the new watermark is since.
+
+        A row can be committed after a newer one, with an older auto_now
+        timestamp or primary key than the watermark that was already handed
+        out, and it would never be exported.  watermark_lag (a timedelta, or a
+        number for numeric fields) is subtracted from the new watermark, so
+        that the next delta exports the rows of that window again: they are
+        exported at least once, and may be exported twice.
+        """
+        if self.watermark_field is None:
+            raise ImproperlyConfigured('Please set the watermark_field.')
+        lookup = get_field_lookup(queryset.model, self.watermark_field)
+        if lookup is None:
+            raise ImproperlyConfigured(
+                'watermark_field must be a field, not %r.' % (self.watermark_field,))
+        if isinstance(since, six.string_types):
+            since = self.parse_watermark(queryset.model, since)
+        if since is not None:
+            queryset = queryset.filter(**{lookup + '__gt': since})
+        watermark = queryset.order_by().aggregate(watermark=Max(lookup))['watermark']
+        if watermark is None:
+            return queryset.none(), since
+        queryset = queryset.filter(**{lookup + '__lte': watermark})
+        if self.watermark_lag:
+            watermark -= self.watermark_lag
+            if since is not None and watermark < since:
+                # Don't go back further than the last delta did.
+                watermark = since
+        return queryset, watermark
+
+    def parse_watermark(self, model, value):
+        """
+        Converts a string into a value of watermark_field.  Raises a
+        ValidationError if it isn't one.
+        """
+        field = get_path_field(model, self.watermark_field)
+        value = field.to_python(value)
+        if isinstance(value, datetime.datetime) and settings.USE_TZ and timezone.is_naive(value):
+            value = timezone.make_aware(value, timezone.get_current_timezone())
+        return value
+
+    def format_watermark(self, value):
+        """
+        Converts a watermark into a string that parse_watermark can read.
+        """
+        if value is None:
+            return ''
+        if isinstance(value, (datetime.date, datetime.time)):
+            return value.isoformat()
+        return force_text(value)
+
+    def get_rows(self, queryset, metrics=None, chunk_size=None):
+        """
+        Returns an iterator over the rows for the queryset.  When every column
+        is a plain field, the values are fetched with values_list() and no
+        model instances are built at all.  If metrics is given, the rows are
+        measured into it.  chunk_size overrides the serializer's chunk_size.
+        """
+        if not self.can_compile_row_getter(queryset):
+            objects = self.iterate(queryset, chunk_size)
+            get_row = self.get_row
+            if metrics is not None and metrics.profile_columns:
+                get_row = metrics.profile_row_getter([
+                    partial(lambda getter, obj: [force_text(getter(obj))], getter)
+                    for getter, header in self.normalized_columns
+                ])
         else:
-            writer = csv.writer(file)
+            lookups = None
+            if self.use_values:
+                lookups = self.get_value_lookups(queryset)
+            get_row = self.compile_row_getter(queryset, values=lookups is not None,
+                                              metrics=metrics, memo=self.get_memo(metrics))
+            if lookups is not None:
+                objects = self.iterate_values(queryset, lookups, chunk_size)
+            else:
+                objects = self.iterate(queryset, chunk_size)
 
-        if self.output_headers:
-            writer.writerow(self.get_header_row())
+        if metrics is not None:
+            return metrics.measure_rows(objects, get_row)
+        return (get_row(obj) for obj in objects)
 
-        for obj in queryset:
-            writer.writerow(self.get_row(obj))
+    def get_memo(self, metrics=None):
+        """
+        Returns a new Memo for the values of memoized columns, or None if
+        memoize is False.  Every export gets its own, so that the values don't
+        go stale between exports.
+        """
+        if not self.memoize:
+            return None
+        memo = Memo(self.memoize_size)
+        if metrics is not None:
+            metrics.memo = memo
+        return memo
 
-        if file is None:
-            output.seek(0)
-            return output.read().decode('utf-8')
+    def can_compile_row_getter(self, queryset):
+        """
+        Returns whether the rows of queryset can be read with
+        compile_row_getter, which only works for unevaluated querysets of
+        model instances.  Otherwise, every row goes through get_row.
+        """
+        return isinstance(queryset, QuerySet) and queryset._result_cache is None \
+            and getattr(queryset, '_fields', None) is None
+
+    def iterate(self, queryset, chunk_size=None):
+        """
+        Iterates over the objects in the queryset.  If chunk_size (or the
+        serializer's chunk_size) is set, the rows are fetched chunk_size at a
+        time and never end up in the queryset's result cache, so memory use
+        doesn't grow with the size of the table.
+        """
+        if not isinstance(queryset, QuerySet) or queryset._result_cache is not None:
+            return iter(queryset)
+
+        if getattr(queryset, '_fields', None) is not None:
+            # Somebody passed in a values() queryset, there are no model
+            # instances to optimize for or to page through by primary key.
+            return self._iterate_chunked(queryset, None, chunk_size)
+
+        if self.optimize_queries:
+            queryset = self.optimize_queryset(queryset)
+        return self._iterate_chunked(queryset, attrgetter('pk'), chunk_size)
+
+    def iterate_values(self, queryset, lookups, chunk_size=None):
+        """
+        Like iterate, but yields tuples of the values for lookups instead of
+        model instances.
+        """
+        if self.optimize_queries:
+            queryset = self.optimize_queryset(queryset)
+        # The primary key is tacked onto the end of every row so that we can
+        # page through the queryset with it.
+        queryset = queryset.prefetch_related(None).values_list(*(list(lookups) + ['pk']))
+        end = len(lookups)
+        rows = self._iterate_chunked(queryset, itemgetter(end), chunk_size)
+        return (values[:end] for values in rows)
+
+    def _iterate_chunked(self, queryset, get_pk, chunk_size=None):
+        chunk_size = chunk_size or self.chunk_size
+        if chunk_size is None:
+            return iter(queryset)
+
+        query = queryset.query
+        is_sliced = query.low_mark or query.high_mark is not None
+        ordering = get_pk_ordering(queryset)
+        if get_pk is not None and not is_sliced and ordering is not None and \
+                not has_multivalued_joins(queryset):
+            return self._iterate_by_pk(queryset, get_pk, ordering, chunk_size)
+
+        # The rows have to come back in a specific order, or the same primary
+        # key can come back more than once, so we can't page through them by
+        # primary key.  Let the database cursor do the work.
+        if django.VERSION >= (2, 0):
+            return queryset.iterator(chunk_size=chunk_size)
+        if queryset._prefetch_related_lookups:
+            # iterator() skips prefetch_related before Django 2.0, every row
+            # would query its related objects.
+            return iter(queryset)
+        return queryset.iterator()
+
+    def optimize_queryset(self, queryset):
+        """
+        Returns the queryset with select_related and prefetch_related applied
+        for every relation that the columns traverse, so that related objects
+        are loaded up front instead of once per row.  Columns that count a
+        relation are annotated onto the queryset instead.
+        """
+        aggregates = self.get_aggregates(queryset)
+        select_related = set()
+        prefetch_related = set()
+        for index, plan in enumerate(self.get_column_plans(queryset.model)):
+            if index in aggregates:
+                continue
+            selected, prefetched = plan.related_lookups
+            if selected:
+                select_related.add(selected)
+            if prefetched:
+                prefetch_related.add(prefetched)
+
+        if select_related and queryset.query.select_related is not True:
+            queryset = queryset.select_related(*sorted(select_related))
+
+        # Don't clobber any Prefetch objects that are already on the queryset.
+        already_prefetched = set(
+            getattr(lookup, 'prefetch_to', lookup)
+            for lookup in queryset._prefetch_related_lookups
+        )
+        prefetch_related -= already_prefetched
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*sorted(prefetch_related))
+
+        if aggregates:
+            queryset = queryset.annotate(**dict(aggregates.values()))
+        return queryset
+
+    def get_aggregates(self, queryset):
+        """
+        Returns a dict that maps the index of every column that counts a
+        relation to a 2-tuple of (annotation name, aggregate).
+        """
+        aggregates = {}
+        # If the queryset is already filtered across a relation, annotate()
+        # would reuse that join and only count the rows that matched the
+        # filter.
+        if not self.optimize_queries or len(queryset.query.alias_map) > 1:
+            return aggregates
+        for index, plan in enumerate(self.get_column_plans(queryset.model)):
+            if plan.count_lookup is not None:
+                aggregates[index] = (
+                    'separated_count_%d' % index,
+                    Count(plan.count_lookup, distinct=True),
+                )
+        return aggregates
+
+    def get_value_lookups(self, queryset):
+        """
+        Returns the values_list() lookups for the columns of the queryset, or
+        None if any of the columns has to be evaluated against a model
+        instance.
+        """
+        aggregates = self.get_aggregates(queryset)
+        lookups = []
+        for index, plan in enumerate(self.get_column_plans(queryset.model)):
+            if index in aggregates:
+                lookups.append(aggregates[index][0])
+            elif plan.lookup is not None:
+                lookups.append(plan.lookup)
+            else:
+                return None
+        return lookups
+
+    def _iterate_by_pk(self, queryset, get_pk, ordering='pk', chunk_size=None):
+        # Keyset pagination: each chunk picks up after the last primary key of
+        # the previous one, so every query is an index range scan.
+        chunk_size = chunk_size or self.chunk_size
+        after = 'pk__lt' if ordering == '-pk' else 'pk__gt'
+        queryset = queryset.order_by(ordering)
+        chunk = list(queryset[:chunk_size])
+        while chunk:
+            for obj in chunk:
+                yield obj
+            if len(chunk) < chunk_size:
+                break
+            chunk = list(queryset.filter(**{after: get_pk(chunk[-1])})[:chunk_size])
 
     def format_header(self, column):
         if self.output_headers:
@@ -104,6 +888,107 @@ class ColumnSerializer(object):
     def get_row(self, obj):
         return [force_text(c[0](obj)) for c in self.normalized_columns]
 
+    def compile_row_getter(self, queryset, values=False, metrics=None, memo=None):
+        """
+        Returns a function that does the same thing as get_row, specialized
+        for the model of the queryset.  If values is True, the function takes
+        the tuples that iterate_values yields instead of model instances.  If
+        metrics is profiling columns, every cell gets its own function so
+        that it can be timed.  If memo is given, the columns in memoize (or
+        all of them, if memoize is True) that read a method or property of a
+        related object remember their values in it (see memoize_path).
+        """
+        model = queryset.model
+        aggregates = self.get_aggregates(queryset)
+        fields = self.get_column_fields(queryset)
+        plans = self.get_column_plans(model)
+        cells = []
+        for index, (getter, header) in enumerate(self.normalized_columns):
+            normalizer = getattr(getter, 'value_normalizer', None)
+            to_text = self.get_formatter(fields[index])
+            memoized = None
+            if memo is not None and normalizer is not None and not values and \
+                    (self.memoize is True or getter.path in self.memoize):
+                memoized = memoize_path(model, getter.path, memo)
+            if index in aggregates:
+                cells.append((aggregates[index][0], None, False, normalizer, to_text))
+            elif memoized is not None:
+                if normalizer is not identity:
+                    memoized = compose(normalizer, memoized)
+                cells.append((None, memoized, False, identity, to_text))
+            elif normalizer is not None:
+                may_be_callable = plans[index].field is None
+                cells.append((getter.path, None, may_be_callable, normalizer, to_text))
+            else:
+                cells.append((None, getter, False, identity, to_text))
+        if metrics is not None and metrics.profile_columns:
+            return metrics.profile_row_getter(
+                [compile_row_getter([cell], unpack=values) for cell in cells],
+                unpack=values,
+            )
+        return compile_row_getter(cells, unpack=values)
+
+    def get_column_plans(self, model):
+        """
+        Returns a tuple of the ColumnPlan for every column on model.  They are
+        kept in plan_cache, so serializers with the same columns only work
+        them out once.
+        """
+        paths = tuple(
+            (getattr(getter, 'path', None), getattr(getter, 'value_normalizer', None) is not None)
+            for getter, header in self.normalized_columns
+        )
+        return plan_cache.get_or_set((model, paths), lambda: tuple(
+            ColumnPlan(model, path, has_normalizer) for path, has_normalizer in paths
+        ))
+
+    def get_column_fields(self, queryset):
+        """
+        Returns a list with the model field that the value of each column comes
+        straight out of, or None for columns that could be anything (because
+        they are callables or have a normalizer).
+        """
+        aggregates = self.get_aggregates(queryset)
+        plans = self.get_column_plans(queryset.model)
+        fields = []
+        for index, (getter, header) in enumerate(self.normalized_columns):
+            if index in aggregates:
+                fields.append(IntegerField())
+            elif getattr(getter, 'value_normalizer', None) is identity:
+                fields.append(plans[index].field)
+            else:
+                # Could be anything, even a lazy string.
+                fields.append(None)
+        return fields
+
+    def get_formatter(self, field):
+        """
+        Returns the function that turns values of field into text, from the
+        field_formatters registry.  field is None for columns that don't read
+        a field directly.
+        """
+        if field is None:
+            return force_text
+        for klass in type(field).__mro__:
+            if klass in self.field_formatters:
+                return self.field_formatters[klass](self, field)
+        return force_text
+
+    def get_l10n_format(self, format_type):
+        return formats.get_format(format_type, lang=self.locale, use_l10n=True)
+
+    def get_date_format(self, format_type):
+        """
+        Returns the format for dates, datetimes or times (format_type is
+        'DATE_FORMAT', 'DATETIME_FORMAT' or 'TIME_FORMAT').  Uses the
+        date_format, datetime_format or time_format attribute if it is set,
+        the format for the locale if localize is True, and None otherwise.
+        """
+        format_string = getattr(self, format_type.lower())
+        if format_string is None and self.localize:
+            format_string = self.get_l10n_format(format_type)
+        return format_string
+
     def _normalize_column(self, column):
         # column can either be a 2-tuple of (accessor, header), or just an
         # accessor.  accessor will be passed to Getter, and we will get the
@@ -115,9 +1000,14 @@ class ColumnSerializer(object):
             column = (column, self.format_header(column))
         return column
 
-    _getter_cache = {}
+    # The Getters for the accessors of every serializer in the process.  The
+    # cache lets go of callable accessors as soon as nothing uses their
+    # Getter anymore.
+    getter_cache = LRUCache(1024, weak_callables=True)
 
     def _normalize_getter(self, getter):
-        if getter not in self._getter_cache:
-            self._getter_cache[getter] = Getter(getter)
-        return self._getter_cache[getter]
+        if callable(getter) and hasattr(getter, 'value_normalizer'):
+            # It already is a Getter, wrapping it again wouldn't change what
+            # it does.
+            return getter
+        return self.getter_cache.get_or_set(getter, partial(Getter, getter))
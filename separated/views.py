@@ -1,28 +1,93 @@
 from __future__ import unicode_literals
 
+import hashlib
+from calendar import timegm
 from email.header import Header
 
 import django
-from django.core.exceptions import ImproperlyConfigured
-from django.http import HttpResponse
+from django.apps import apps
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.files.storage import default_storage
+from django.db.models import Count, Max
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, HttpResponseNotModified,
+    StreamingHttpResponse,
+)
+from django.utils.cache import patch_vary_headers
+from django.utils.encoding import force_bytes
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
 from django.views.generic.list import BaseListView, MultipleObjectMixin
 
-from .utils import ColumnSerializer
+from .cache import describe, get_export_cache_aliases, get_path_models, get_versions
+from .compression import get_available_encodings, negotiate_encoding
+from .ranges import ChunkedExport, get_pk_ranges, parse_range_header
+from .utils import ColumnSerializer, can_split_by_pk
+
+
+try:
+    from django.core.exceptions import EmptyResultSet
+except ImportError:  # Django < 1.11
+    from django.db.models.sql.datastructures import EmptyResultSet
+
+try:
+    from django.utils.cache import get_conditional_response
+except ImportError:  # Django < 1.9
+    def get_conditional_response(request, etag=None, last_modified=None, response=None):
+        """
+        Returns a 304 for a GET or HEAD that If-None-Match or
+        If-Modified-Since say the client already has, or None.  Only the
+        parts of the Django 1.9 version that CsvView needs.
+        """
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            try:
+                etags = parse_etags(if_none_match)
+            except ValueError:
+                return None
+            if etag is not None and (etag in etags or '*' in etags):
+                return HttpResponseNotModified()
+            return None
+        if_modified_since = request.META.get('HTTP_IF_MODIFIED_SINCE')
+        if if_modified_since:
+            if_modified_since = parse_http_date_safe(if_modified_since)
+        if last_modified and if_modified_since and last_modified <= if_modified_since:
+            return HttpResponseNotModified()
+        return None
 
 
 def encode_header(value):
     return Header(value, 'utf-8').encode()
 
 
+def attachment_disposition(filename):
+    disposition = 'attachment; filename="{0}"'.format(filename)
+    # BBB: Django 1.4 and earlier didn't support non-ASCII headers.  Later
+    # versions do this for us.
+    if django.VERSION < (1, 5):
+        disposition = encode_header(disposition)
+    return disposition
+
+
+def quote_etag(etag):
+    return '"%s"' % etag
+
+
 class CsvResponse(HttpResponse):
     def __init__(self, filename, content_type='text/csv', **kwargs):
         super(CsvResponse, self).__init__(content_type=content_type, **kwargs)
-        disposition = 'attachment; filename="{0}"'.format(filename)
-        # BBB: Django 1.4 and earlier didn't support non-ASCII headers.  Later
-        # versions do this for us.
-        if django.VERSION < (1, 5):
-            disposition = encode_header(disposition)
-        self['Content-Disposition'] = disposition
+        self['Content-Disposition'] = attachment_disposition(filename)
+
+
+class StreamingCsvResponse(StreamingHttpResponse):
+    def __init__(self, filename, streaming_content=(), content_type='text/csv', **kwargs):
+        super(StreamingCsvResponse, self).__init__(
+            streaming_content, content_type=content_type, **kwargs)
+        self['Content-Disposition'] = attachment_disposition(filename)
 
 
 class CsvResponseMixin(MultipleObjectMixin):
@@ -30,21 +95,412 @@ class CsvResponseMixin(MultipleObjectMixin):
     A ListView mixin that returns a CsvResponse.
     """
     response_class = CsvResponse
+    streaming_response_class = StreamingCsvResponse
     column_serializer_class = ColumnSerializer
+    content_type = None
+    format = 'csv'
+    formats = None
+    format_param = 'format'
     columns = None
     output_headers = True
-    filename = '{model_name}_list.csv'
+    streaming = False
+    chunk_size = None
+    filename = '{model_name}_list.{extension}'
+    cache_exports = False
+    cache_alias = 'default'
+    cache_timeout = 300
+    cache_max_size = 10 * 1024 * 1024
+    last_modified_field = None
+    instrument = False
+    metrics_hook = None
+    memoize = False
+    compress = False
+    compress_encodings = None
+    resumable = False
+    resumable_chunk_size = 10000
+    resumable_storage = None
+    resumable_path = 'exports/resumable/{etag}/'
+    watermark_field = None
+    watermark_lag = None
+    watermark_param = 'since'
+    watermark_header = 'X-Watermark'
 
     def render_to_response(self, context, **kwargs):
         queryset = context['object_list']
+        serialize = self.get_column_serializer(queryset.model)
+        if self.watermark_field is not None:
+            try:
+                queryset, watermark = serialize.get_delta(queryset, self.get_since())
+            except ValidationError as e:
+                return HttpResponseBadRequest(
+                    'Invalid %s: %s' % (self.watermark_param, ' '.join(e.messages)))
+        # The byte ranges of a resumable export are ranges of the file, which
+        # is never compressed.
+        encoding = None if self.resumable else self.get_content_encoding()
+        if encoding is not None:
+            serialize.compression = encoding
+
+        response = self.render_conditional_export(queryset, serialize)
+        if self.compress:
+            patch_vary_headers(response, ('Accept-Encoding',))
+            if encoding is not None and response.status_code == 200:
+                response['Content-Encoding'] = encoding
+        if self.watermark_field is not None and self.watermark_header:
+            response[self.watermark_header] = serialize.format_watermark(watermark)
+        return response
+
+    def render_conditional_export(self, queryset, serialize):
+        cache_key = None
+        if self.cache_exports:
+            cache_key = self.get_cache_key(queryset, serialize)
+
+        etag = self.get_etag(queryset, serialize, cache_key)
+        if self.resumable and etag is None:
+            raise ImproperlyConfigured(
+                'Resumable exports need an ETag, set last_modified_field or cache_exports.')
+        last_modified = None
+        if self.get_export_models(queryset, serialize) == [queryset.model]:
+            # The related models' changes aren't in the queryset's dates.
+            last_modified = self.get_last_modified(queryset)
+        if last_modified is not None:
+            last_modified = timegm(last_modified.utctimetuple())
+        if etag is not None or last_modified is not None:
+            # Django < 1.11 compares unquoted ETags.
+            response = get_conditional_response(
+                self.request,
+                etag=quote_etag(etag) if django.VERSION >= (1, 11) else etag,
+                last_modified=last_modified,
+            )
+            if response is None and self.resumable:
+                response = self.render_resumable_export(queryset, serialize, etag, last_modified)
+            if response is None:
+                response = self.render_export(queryset, serialize, cache_key)
+            if etag is not None and not response.has_header('ETag'):
+                response['ETag'] = quote_etag(etag)
+            if last_modified is not None and not response.has_header('Last-Modified'):
+                response['Last-Modified'] = http_date(last_modified)
+            return response
+
+        return self.render_export(queryset, serialize, cache_key)
+
+    def render_export(self, queryset, serialize, cache_key=None):
         model = queryset.model
+        if cache_key is not None:
+            content = self.get_cache().get(cache_key)
+            if content is not None:
+                return self.response_class(
+                    filename=self.get_filename(model),
+                    content_type=self.get_content_type(serialize),
+                    content=content,
+                )
+
+        if self.streaming:
+            content = serialize.stream(queryset)
+            if cache_key is not None:
+                content = self.cache_stream(cache_key, content)
+            return self.streaming_response_class(
+                filename=self.get_filename(model),
+                content_type=self.get_content_type(serialize),
+                streaming_content=content,
+            )
         response = self.response_class(
             filename=self.get_filename(model),
+            content_type=self.get_content_type(serialize),
         )
-        serialize = self.get_column_serializer(model)
         serialize(queryset, file=response)
+        if cache_key is not None and len(response.content) <= self.cache_max_size:
+            self.get_cache().set(cache_key, response.content, self.cache_timeout)
+        return response
+
+    def render_resumable_export(self, queryset, serialize, etag, last_modified=None):
+        """
+        Returns a response for an export that is saved in chunks of primary
+        keys and that answers Range requests, or None if the queryset can't
+        be split up by primary key.
+        """
+        if not can_split_by_pk(queryset) or not serialize.get_writer_class().concatenable:
+            return None
+        model = queryset.model
+        export = self.get_chunked_export(queryset, serialize, etag)
+        requested = self.get_requested_range(etag, last_modified)
+
+        if requested is None:
+            response = self.streaming_response_class(
+                filename=self.get_filename(model),
+                content_type=self.get_content_type(serialize),
+                streaming_content=export.iter_range(),
+            )
+            # The length is only known once every chunk has been saved.
+            length = export.get_length(stop=0)
+            if length is not None:
+                response['Content-Length'] = length
+            response['Accept-Ranges'] = 'bytes'
+            return response
+
+        first, last = requested
+        if first is None:
+            length = export.get_length()
+            first, last = max(length - last, 0), length - 1
+        else:
+            length = export.get_length(None if last is None else last + 1)
+            if last is None or (length is not None and last >= length):
+                last = length - 1
+        if length is not None and first >= length:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % length
+            return response
+
+        response = self.streaming_response_class(
+            filename=self.get_filename(model),
+            content_type=self.get_content_type(serialize),
+            streaming_content=export.iter_range(first, last),
+            status=206,
+        )
+        response['Content-Range'] = 'bytes %d-%d/%s' % (
+            first, last, '*' if length is None else length)
+        response['Content-Length'] = last - first + 1
+        response['Accept-Ranges'] = 'bytes'
         return response
 
+    def get_requested_range(self, etag, last_modified=None):
+        """
+        Returns the (first, last) byte range that the request asks for, or
+        None for the whole export.  Ranges are ignored if the If-Range header
+        doesn't match the current version of the export.
+        """
+        if_range = self.request.META.get('HTTP_IF_RANGE')
+        if if_range is not None:
+            validators = [quote_etag(etag)]
+            if last_modified is not None:
+                validators.append(http_date(last_modified))
+            if if_range.strip() not in validators:
+                return None
+        return parse_range_header(self.request.META.get('HTTP_RANGE'))
+
+    def get_resumable_storage(self):
+        return self.resumable_storage or default_storage
+
+    def get_chunked_export(self, queryset, serializer, etag):
+        # Finding the ranges reads every primary key, so they are remembered
+        # for as long as the ETag stays the same.
+        ranges_key = 'separated-resumable-ranges:%s' % etag
+        ranges = self.get_cache().get(ranges_key)
+        if ranges is None:
+            ranges = get_pk_ranges(queryset, self.resumable_chunk_size)
+            self.get_cache().set(ranges_key, ranges, self.cache_timeout)
+        return ChunkedExport(
+            serializer,
+            queryset,
+            ranges,
+            storage=self.get_resumable_storage(),
+            path=self.resumable_path.format(etag=etag),
+            cache=self.get_cache(),
+            cache_key='separated-resumable:%s' % etag,
+            cache_timeout=self.cache_timeout,
+        )
+
+    def get_content_encoding(self):
+        """
+        Returns the compression to use for the response, based on the
+        Accept-Encoding header of the request, or None.
+        """
+        if not self.compress:
+            return None
+        encodings = self.compress_encodings
+        if encodings is None:
+            encodings = get_available_encodings()
+        return negotiate_encoding(self.request.META.get('HTTP_ACCEPT_ENCODING'), encodings)
+
+    def get_format(self):
+        """
+        Returns the format to export.  If formats is set, the format can be
+        picked out of it with a URL keyword argument or a GET parameter
+        named format_param.
+        """
+        if not self.formats or not self.format_param:
+            return self.format
+        request = getattr(self, 'request', None)
+        requested = getattr(self, 'kwargs', {}).get(self.format_param)
+        if requested is None and request is not None:
+            requested = request.GET.get(self.format_param)
+        if not requested:
+            return self.format
+        if requested not in self.formats:
+            raise Http404('Unknown format: %s' % requested)
+        return requested
+
+    def get_since(self):
+        """
+        Returns the watermark that the request asks for the changes since, as
+        a URL keyword argument or a GET parameter named watermark_param, or
+        None for a full export.
+        """
+        since = getattr(self, 'kwargs', {}).get(self.watermark_param)
+        request = getattr(self, 'request', None)
+        if since is None and request is not None:
+            since = request.GET.get(self.watermark_param)
+        return since or None
+
+    def get_content_type(self, serializer):
+        if self.content_type is not None:
+            return self.content_type
+        return serializer.get_writer_class().content_type
+
+    def get_validators(self, queryset):
+        """
+        Returns the newest value of last_modified_field and the number of rows
+        in the queryset, with one query.
+        """
+        if not hasattr(self, '_validators'):
+            self._validators = queryset.order_by().aggregate(
+                last_modified=Max(self.last_modified_field),
+                count=Count('pk'),
+            )
+        return self._validators
+
+    def get_last_modified(self, queryset):
+        """
+        Returns a datetime for the Last-Modified header, or None.  By default,
+        this is the newest value of last_modified_field.
+        """
+        if self.last_modified_field is None:
+            return None
+        return self.get_validators(queryset)['last_modified']
+
+    def get_etag(self, queryset, serializer, cache_key=None):
+        """
+        Returns an (unquoted) ETag for the export, or None.  With
+        cache_exports, the cache key already changes whenever the export does.
+        Otherwise, the ETag is made from the newest value of
+        last_modified_field and the number of rows, which catches deleted
+        rows too, and from the versions of the related models that the
+        columns read from.
+        """
+        if cache_key is not None:
+            return cache_key.rpartition(':')[2]
+        if self.last_modified_field is None:
+            return None
+        description = self.describe_export(queryset, serializer)
+        if description is None:
+            return None
+        validators = self.get_validators(queryset)
+        related_models = [
+            model for model in self.get_export_models(queryset, serializer)
+            if model is not queryset.model
+        ]
+        if related_models:
+            # last_modified_field only changes with the queryset's own rows.
+            self.check_export_cache()
+        key = repr((
+            description,
+            validators['last_modified'],
+            validators['count'],
+            get_versions(self.get_cache(), related_models),
+        ))
+        return hashlib.sha1(force_bytes(key)).hexdigest()
+
+    def get_cache(self):
+        return caches[self.cache_alias]
+
+    def get_cache_key(self, queryset, serializer):
+        """
+        Returns the cache key for the export, or None if it can't be cached.
+        It depends on the SQL of the queryset, the columns, the headers, the
+        filename and the versions of every model that the columns read from.
+        If the output of your view depends on anything else, you should
+        override this method.
+        """
+        self.check_export_cache()
+        description = self.describe_export(queryset, serializer)
+        if description is None:
+            return None
+        key = repr((
+            description,
+            get_versions(self.get_cache(), self.get_export_models(queryset, serializer)),
+        ))
+        return 'separated-export:%s' % hashlib.sha1(force_bytes(key)).hexdigest()
+
+    def check_export_cache(self):
+        """
+        Raises ImproperlyConfigured unless saving a model bumps its version in
+        the cache_alias cache, in every process.
+        """
+        if not apps.is_installed('separated') or \
+                self.cache_alias not in get_export_cache_aliases():
+            raise ImproperlyConfigured(
+                'Cached exports and ETags of related models need separated in '
+                'INSTALLED_APPS and the %r cache in SEPARATED_EXPORT_CACHES, so that '
+                'saving a model invalidates them in every process.' % self.cache_alias)
+        cache = self.get_cache()
+        if isinstance(cache, (DummyCache, LocMemCache)):
+            # Every process would have versions of its own, and the others
+            # would go on answering with stale exports.
+            raise ImproperlyConfigured(
+                'Cached exports and ETags of related models need a cache that all '
+                'processes share, the %r cache is a %s.'
+                % (self.cache_alias, type(cache).__name__))
+
+    def get_export_models(self, queryset, serializer):
+        """
+        Returns the models that the export reads from, the queryset's model
+        and the ones that the columns follow relations to.
+        """
+        models = set([queryset.model])
+        for getter, header in serializer.normalized_columns:
+            path = getattr(getter, 'path', None)
+            if path:
+                models.update(get_path_models(queryset.model, path))
+        return sorted(models, key=lambda model: model._meta.db_table)
+
+    def describe_export(self, queryset, serializer):
+        """
+        Returns a description of everything that determines the output of the
+        export, other than the data itself, or None if a column can't be
+        described reliably (like a callable object, or a function that closes
+        over one), in which case the export isn't cached.
+        """
+        try:
+            columns = [
+                (describe(getter), header)
+                for getter, header in serializer.normalized_columns
+            ]
+        except ValueError:
+            return None
+
+        try:
+            sql = queryset.query.get_compiler(queryset.db).as_sql()
+        except EmptyResultSet:
+            sql = None
+
+        return (
+            describe(type(self)),
+            describe(type(serializer)),
+            sql,
+            columns,
+            serializer.output_headers,
+            serializer.format,
+            serializer.compression,
+            self.get_filename(queryset.model),
+        )
+
+    def cache_stream(self, cache_key, chunks):
+        """
+        Passes the chunks of a streamed export through, and caches the export
+        once it is finished, unless it turns out to be bigger than
+        cache_max_size.
+        """
+        content = []
+        size = 0
+        for chunk in chunks:
+            yield chunk
+            if content is not None:
+                size += len(chunk)
+                content.append(chunk)
+                if size > self.cache_max_size:
+                    content = None
+        if content is not None:
+            self.get_cache().set(cache_key, b''.join(content), self.cache_timeout)
+
     def get_column_serializer_class(self, model):
         return self.column_serializer_class
 
@@ -52,6 +508,13 @@ class CsvResponseMixin(MultipleObjectMixin):
         return self.get_column_serializer_class(model)(
             self.get_columns(model),
             output_headers=self.output_headers,
+            chunk_size=self.chunk_size,
+            format=self.get_format(),
+            instrument=self.instrument,
+            metrics_hook=self.metrics_hook,
+            memoize=self.memoize,
+            watermark_field=self.watermark_field,
+            watermark_lag=self.watermark_lag,
         )
 
     def get_columns(self, model):
@@ -66,8 +529,10 @@ class CsvResponseMixin(MultipleObjectMixin):
         except AttributeError:
             # for Django < 1.6. Deprecated in 1.6 & removed in 1.8.
             model_name = opts.module_name
+        serializer_class = self.get_column_serializer_class(model)
         return self.filename.format(
             model_name=model_name,
+            extension=serializer_class.writers[self.get_format()].extension,
         )
 
 
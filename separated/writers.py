@@ -0,0 +1,295 @@
+"""
+Output formats for ColumnSerializer.
+
+ColumnSerializer turns a queryset into rows of text, a writer turns those rows
+into bytes.  Every writer works a piece at a time, so that any of them can be
+streamed: start takes the header row (or None) and returns the beginning of
+the file, write_rows returns the encoded rows, and finish returns whatever
+comes after the last row.  ColumnSerializer picks the writer out of
+ColumnSerializer.writers by its format.
+"""
+import json
+import re
+import sys
+import zipfile
+from collections import OrderedDict
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+import unicodecsv as csv
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.encoding import force_bytes
+
+
+class ChunkSink(object):
+    """
+    A write-only file that keeps what is written to it until somebody pops
+    it.
+    """
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def pop(self):
+        chunks, self.chunks = self.chunks, []
+        return b''.join(chunks)
+
+
+class Writer(object):
+    """
+    The base class for writers.  A writer is used for one file.
+
+    binary says whether the output is text (so that ColumnSerializer can
+    return it as a string), concatenable whether files without a header can
+    be glued together (which ShardedColumnSerializer needs) and writes_rows
+    whether write_rows works at all.  Writers that don't write rows only
+    describe a format that their serializer writes itself.
+    """
+    extension = None
+    content_type = None
+    binary = False
+    concatenable = True
+    writes_rows = True
+
+    def __init__(self, serializer):
+        self.serializer = serializer
+
+    def start(self, header_row):
+        return b''
+
+    def write_rows(self, rows):
+        raise NotImplementedError
+
+    def finish(self):
+        return b''
+
+
+class CsvWriter(Writer):
+    extension = 'csv'
+    content_type = 'text/csv'
+    dialect = 'excel'
+
+    def __init__(self, serializer):
+        super(CsvWriter, self).__init__(serializer)
+        # The csv writer encodes into this buffer, which is emptied after
+        # every call instead of making a new one.
+        self.buffer = BytesIO()
+        self.writer = csv.writer(self.buffer, dialect=self.dialect)
+
+    def start(self, header_row):
+        if header_row is None:
+            return b''
+        self.writer.writerow(header_row)
+        return self._flush()
+
+    def write_rows(self, rows):
+        self.writer.writerows(rows)
+        return self._flush()
+
+    def _flush(self):
+        value = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return value
+
+
+class TsvWriter(CsvWriter):
+    extension = 'tsv'
+    content_type = 'text/tab-separated-values'
+    dialect = 'excel-tab'
+
+
+class JsonLinesWriter(Writer):
+    """
+    Writes a JSON object per row, keyed by the headers.  Without headers, the
+    rows are written as JSON arrays.
+    """
+    extension = 'jsonl'
+    content_type = 'application/x-ndjson'
+
+    def start(self, header_row):
+        self.keys = header_row
+        return b''
+
+    def write_rows(self, rows):
+        keys = self.keys
+        lines = []
+        for row in rows:
+            value = OrderedDict(zip(keys, row)) if keys is not None else row
+            lines.append(json.dumps(value, ensure_ascii=False, separators=(',', ':')))
+            lines.append('\n')
+        return force_bytes(''.join(lines))
+
+
+XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" '
+    'ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '%s'
+    '</Types>'
+)
+
+XLSX_SHEET_CONTENT_TYPE = (
+    '<Override PartName="/xl/worksheets/sheet%d.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+)
+
+XLSX_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets>%s</sheets>'
+    '</workbook>'
+)
+
+XLSX_SHEET = '<sheet name="%s" sheetId="%d" r:id="rId%d"/>'
+
+XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '%s'
+    '</Relationships>'
+)
+
+XLSX_SHEET_REL = (
+    '<Relationship Id="rId%d" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet%d.xml"/>'
+)
+
+XLSX_SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<sheetData>'
+)
+
+XLSX_SHEET_END = '</sheetData></worksheet>'
+
+# Characters that aren't allowed in XML at all.
+illegal_xml_re = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# Characters that Excel doesn't allow in sheet names.
+illegal_sheet_name_re = re.compile(r'[\[\]:*?/\\]')
+
+
+def get_sheet_name(name):
+    # Excel also limits sheet names to 31 characters.
+    return illegal_sheet_name_re.sub('', illegal_xml_re.sub('', name))[:31] or 'Sheet'
+
+
+class XlsxWriter(Writer):
+    """
+    Writes a single sheet Excel workbook, with every cell as an inline
+    string.  The sheet is compressed into the zip file as the rows come in, so
+    memory use stays the same no matter how many rows there are.  Writing a
+    zip file without seeking back needs Python 3.6.
+
+    Workbooks with more sheets are written with start_workbook, then
+    start_sheet, write_rows and finish_sheet for every sheet, and
+    finish_workbook.
+    """
+    extension = 'xlsx'
+    content_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    binary = True
+    concatenable = False
+
+    def __init__(self, serializer):
+        if sys.version_info < (3, 6):
+            raise ImproperlyConfigured(
+                'XLSX output requires Python 3.6 or later, this is Python %d.%d.'
+                % sys.version_info[:2])
+        super(XlsxWriter, self).__init__(serializer)
+        self.sink = ChunkSink()
+        self.row_number = 0
+
+    def start(self, header_row):
+        return self.start_workbook(['Sheet1']) + self.start_sheet(1, header_row)
+
+    def write_rows(self, rows):
+        self.sheet.write(b''.join(self.encode_row(row) for row in rows))
+        return self.sink.pop()
+
+    def finish(self):
+        return self.finish_sheet() + self.finish_workbook()
+
+    def start_workbook(self, sheet_names):
+        # The sink can't seek, so zipfile writes the sizes after the data
+        # instead of going back to the local headers.
+        self.zip = zipfile.ZipFile(self.sink, 'w', zipfile.ZIP_DEFLATED)
+        numbers = range(1, len(sheet_names) + 1)
+        self.zip.writestr('[Content_Types].xml', XLSX_CONTENT_TYPES % ''.join(
+            XLSX_SHEET_CONTENT_TYPE % number for number in numbers))
+        self.zip.writestr('_rels/.rels', XLSX_RELS)
+        self.zip.writestr('xl/workbook.xml', (XLSX_WORKBOOK % ''.join(
+            XLSX_SHEET % (escape(get_sheet_name(name), {'"': '&quot;'}), number, number)
+            for number, name in zip(numbers, sheet_names)
+        )).encode('utf-8'))
+        self.zip.writestr('xl/_rels/workbook.xml.rels', XLSX_WORKBOOK_RELS % ''.join(
+            XLSX_SHEET_REL % (number, number) for number in numbers))
+        return self.sink.pop()
+
+    def start_sheet(self, number, header_row):
+        """
+        Starts the sheet number (counting from 1) of the workbook.
+        """
+        self.row_number = 0
+        self.sheet = self.zip.open('xl/worksheets/sheet%d.xml' % number, 'w', force_zip64=True)
+        self.sheet.write(XLSX_SHEET_START.encode('utf-8'))
+        if header_row is not None:
+            self.sheet.write(self.encode_row(header_row))
+        return self.sink.pop()
+
+    def finish_sheet(self):
+        self.sheet.write(XLSX_SHEET_END.encode('utf-8'))
+        self.sheet.close()
+        return self.sink.pop()
+
+    def finish_workbook(self):
+        self.zip.close()
+        return self.sink.pop()
+
+    def encode_row(self, row):
+        self.row_number += 1
+        cells = ''.join(
+            '<c t="inlineStr"><is><t xml:space="preserve">%s</t></is></c>'
+            % escape(illegal_xml_re.sub('', cell))
+            for cell in row
+        )
+        return ('<row r="%d">%s</row>' % (self.row_number, cells)).encode('utf-8')
+
+
+WRITERS = {
+    'csv': CsvWriter,
+    'tsv': TsvWriter,
+    'jsonl': JsonLinesWriter,
+    'xlsx': XlsxWriter,
+}
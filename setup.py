@@ -3,8 +3,13 @@ import os
 from setuptools import setup
 
 
-install_requires = ['Django>=1.3', 'unicodecsv']
+install_requires = ['Django>=1.8', 'unicodecsv']
 tests_require = []
+extras_require = {
+    'arrow': ['pyarrow'],
+    'async': ['asgiref>=3.4'],
+    'zstd': ['zstandard'],
+}
 
 
 def read_file(filename):
@@ -34,9 +39,13 @@ setup(
     ],
     install_requires=install_requires,
     tests_require=tests_require,
+    extras_require=extras_require,
     packages=[
         'separated',
     ],
+    package_data={
+        'separated': ['templates/separated/admin/*.html'],
+    },
 
     test_suite='testproject.runtests',
 )
@@ -1,6 +1,12 @@
-from separated.admin import CsvExportModelAdmin
+from django.contrib.admin import AdminSite
+
+from separated.admin import CsvExportModelAdmin, CsvImportAdminMixin
+from separated.jobs import SynchronousExportBackend
+from separated.utils import BooleanGetter, DisplayGetter
 from separated.views import CsvView
 
+from .models import Car, Manufacturer
+
 
 class OverrideExportColumnsAdmin(CsvExportModelAdmin):
     csv_export_columns = [
@@ -27,3 +33,24 @@ class ExportColumnsAndExportViewAdmin(OverrideExportColumnsAdmin, OverrideExport
 
 class NoColumnsExportAdmin(CsvExportModelAdmin):
     "This one is invalid on purpose"
+
+
+class AsyncExportAdmin(OverrideExportColumnsAdmin):
+    csv_export_async = True
+    csv_export_backend_class = SynchronousExportBackend
+
+
+class CarAdmin(CsvImportAdminMixin, CsvExportModelAdmin):
+    csv_export_columns = [
+        'pk',
+        'name',
+        'manufacturer.name',
+        BooleanGetter('is_electric'),
+        DisplayGetter('body_style'),
+    ]
+    csv_import_key_fields = ['pk']
+
+
+site = AdminSite(name='testadmin')
+site.register(Manufacturer, AsyncExportAdmin)
+site.register(Car, CarAdmin)
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils.text import slugify
 
 
 try:
@@ -13,6 +14,12 @@ class Manufacturer(models.Model):
     def __str__(self):
         return self.name
 
+    def get_absolute_url(self):
+        return '/manufacturers/%d/' % self.pk
+
+    def get_slug(self):
+        return slugify(self.name)
+
 if python_2_unicode_compatible:
     Manufacturer = python_2_unicode_compatible(Manufacturer)
 else:
@@ -21,8 +28,17 @@ else:
 
 
 class Car(models.Model):
+    BODY_STYLE_CHOICES = (
+        ('sedan', 'Sedan'),
+        ('hatchback', 'Hatchback'),
+        ('suv', 'SUV'),
+    )
+
     manufacturer = models.ForeignKey(Manufacturer)
     name = models.CharField(max_length=255)
+    is_electric = models.BooleanField(default=False)
+    body_style = models.CharField(max_length=20, choices=BODY_STYLE_CHOICES, default='sedan')
+    updated_at = models.DateTimeField(auto_now=True)
 
     def get_display_name(self):
         return self.name.upper()
@@ -1,3 +1,7 @@
+import atexit
+import shutil
+import tempfile
+
 SECRET_KEY = 'not a secret'
 
 INSTALLED_APPS = (
@@ -21,7 +25,36 @@ DATABASES = {
     }
 }
 
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'context_processors': [
+                'django.contrib.auth.context_processors.auth',
+                'django.contrib.messages.context_processors.messages',
+            ],
+        },
+    },
+]
+
 ROOT_URLCONF = 'testproject.testproject.urls'
 
+# The exports and the export jobs need a cache that all processes share.
+CACHE_DIR = tempfile.mkdtemp(prefix='separated-cache-')
+atexit.register(shutil.rmtree, CACHE_DIR, True)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_DIR,
+    },
+    'local': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+SEPARATED_EXPORT_CACHES = ('default', 'local')
+
 STATIC_URL = '/static/'
 DEBUG = True
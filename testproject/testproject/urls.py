@@ -1,15 +1,17 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+from separated.arrow import ArrowView, ParquetView
 from separated.views import CsvView
 
-from .models import Manufacturer
+from .admin import site
+from .models import Car, Manufacturer
 
 
 try:
-    from django.conf.urls import url
+    from django.conf.urls import include, url
 except ImportError:  # Django 1.3
-    from django.conf.urls.defaults import url
+    from django.conf.urls.defaults import include, url
 
 
 class ManufacturerView(CsvView):
@@ -20,7 +22,38 @@ class ManufacturerView(CsvView):
     ]
 
 
+class CarView(CsvView):
+    model = Car
+    columns = ['name']
+    last_modified_field = 'updated_at'
+
+
 urlpatterns = [
     url('^foo/$', ManufacturerView.as_view(), name='manufacturers'),
     url('^bar/$', ManufacturerView.as_view(filename='áèïôų.csv'), name='unicode_filename'),
+    url('^baz/$', ManufacturerView.as_view(streaming=True), name='streaming_manufacturers'),
+    url('^cached/$', ManufacturerView.as_view(cache_exports=True), name='cached_manufacturers'),
+    url('^cached-streaming/$', ManufacturerView.as_view(cache_exports=True, streaming=True),
+        name='cached_streaming_manufacturers'),
+    url('^compressed/$', ManufacturerView.as_view(columns=[('name', 'Name')], compress=True),
+        name='compressed_manufacturers'),
+    url('^compressed-streaming/$',
+        ManufacturerView.as_view(columns=[('name', 'Name')], compress=True, streaming=True),
+        name='compressed_streaming_manufacturers'),
+    url('^export/$', ManufacturerView.as_view(formats=['csv', 'tsv', 'jsonl', 'xlsx']),
+        name='multi_format_manufacturers'),
+    url('^export\\.(?P<format>[a-z]+)$',
+        ManufacturerView.as_view(formats=['csv', 'tsv', 'jsonl', 'xlsx']),
+        name='multi_format_manufacturers_by_extension'),
+    url('^instrumented/$', ManufacturerView.as_view(instrument=True),
+        name='instrumented_manufacturers'),
+    url('^cars/$', CarView.as_view(), name='cars'),
+    url('^resumable/$', CarView.as_view(resumable=True, resumable_chunk_size=2),
+        name='resumable_cars'),
+    url('^delta/$', CarView.as_view(watermark_field='updated_at'), name='delta_cars'),
+    url('^parquet/$', ParquetView.as_view(model=Car, columns=['name', 'manufacturer.name']),
+        name='parquet_cars'),
+    url('^arrow/$', ArrowView.as_view(model=Car, columns=['name', 'manufacturer.name']),
+        name='arrow_cars'),
+    url('^admin/', include(site.urls)),
 ]